@@ -0,0 +1,150 @@
+import logging
+from typing import Dict, List, Optional, Sequence
+
+
+class ABRSelector:
+    """按吞吐量和播放质量选择HLS码率
+
+    起播时选择不超过 吞吐量 × safety 的最高码率。播放中连续down_after次质量得分低于low_score
+    （或当前码率超过可用吞吐量）时降一档；连续up_after次得分不低于high_score且吞吐量 × up_safety
+    足以支撑高一档码率时升一档。只做决策，不做网络请求，可以直接用模拟的吞吐量序列测试。
+
+    参数:
+        variants: 主播放列表中的码率列表，每项包含'url'和'bandwidth'（bit/s）
+    """
+
+    def __init__(self, variants: List[Dict], safety: float = 0.8, up_safety: float = 0.6,
+                 low_score: float = 60, high_score: float = 80, down_after: int = 3, up_after: int = 5,
+                 current_url: Optional[str] = None):
+        if not variants:
+            raise ValueError("没有可选码率")
+        self.logger = logging.getLogger(__name__)
+        self.variants = sorted(variants, key=lambda v: v['bandwidth'])
+        self.safety = safety
+        self.up_safety = up_safety
+        self.low_score = low_score
+        self.high_score = high_score
+        self.down_after = down_after
+        self.up_after = up_after
+        self.current = len(self.variants) - 1
+        for i, variant in enumerate(self.variants):
+            if variant['url'] == current_url:
+                self.current = i
+        self._low_count = 0
+        self._high_count = 0
+
+    @property
+    def current_variant(self) -> Dict:
+        return self.variants[self.current]
+
+    def _kbps(self, i: int) -> float:
+        return self.variants[i]['bandwidth'] / 1000
+
+    def _fitting(self, throughput_kbps: float, safety: float) -> int:
+        """吞吐量可支撑的最高码率序号，都支撑不了时为最低码率"""
+        best = 0
+        for i in range(len(self.variants)):
+            if self._kbps(i) <= throughput_kbps * safety:
+                best = i
+        return best
+
+    def select(self, throughput_kbps: Optional[float]) -> Dict:
+        """起播时选择码率，吞吐量未知时保持当前（默认最高）码率"""
+        if throughput_kbps:
+            self.current = self._fitting(throughput_kbps, self.safety)
+        self._low_count = self._high_count = 0
+        return self.current_variant
+
+    def start_at(self, url: str) -> Dict:
+        """从指定码率起播（例如已预取了该码率的分片），不在列表中时保持当前码率"""
+        for i, variant in enumerate(self.variants):
+            if variant['url'] == url:
+                self.current = i
+        self._low_count = self._high_count = 0
+        return self.current_variant
+
+    def step_down(self) -> Optional[Dict]:
+        """降一档，已是最低码率时返回None"""
+        if self.current == 0:
+            return None
+        self.current -= 1
+        self._low_count = self._high_count = 0
+        return self.current_variant
+
+    def update(self, throughput_kbps: Optional[float], quality_score: float) -> Optional[Dict]:
+        """输入一次吞吐量和质量得分，需要切换码率时返回新码率，否则返回None"""
+        overloaded = bool(throughput_kbps) and self._kbps(self.current) > throughput_kbps * self.safety
+        if quality_score < self.low_score or overloaded:
+            self._low_count += 1
+            self._high_count = 0
+        else:
+            self._low_count = 0
+            can_step_up = (self.current < len(self.variants) - 1 and bool(throughput_kbps)
+                           and self._kbps(self.current + 1) <= throughput_kbps * self.up_safety)
+            if quality_score >= self.high_score and can_step_up:
+                self._high_count += 1
+            else:
+                self._high_count = 0
+
+        if self._low_count >= self.down_after and self.current > 0:
+            target = self.current - 1
+            if throughput_kbps:
+                target = min(target, self._fitting(throughput_kbps, self.safety))
+            self.current = target
+            self._low_count = self._high_count = 0
+            return self.current_variant
+
+        if self._high_count >= self.up_after:
+            self.current += 1
+            self._low_count = self._high_count = 0
+            return self.current_variant
+        return None
+
+
+class QualityScorer:
+    """播放质量得分（0-100），供ABRSelector.update使用
+
+    按两次打分之间新增的丢帧、丢失音频缓冲、解复用损坏以及卡顿扣分，不看播放器的读取速率：
+    播放器只按当前码率读取，低码率时读取速率本来就低，用它打分会让低码率永远升不上去。
+    网络能否支撑更高码率由ABRSelector按代理实测的源站吞吐量判断。
+
+    参数:
+        lost_picture_penalty / lost_abuffer_penalty / corrupted_penalty: 每个丢帧、丢失音频缓冲、损坏的扣分
+        rebuffer_penalty: 每次新的卡顿扣分
+        stall_penalty_per_s: 每秒卡顿时长扣分
+    """
+
+    def __init__(self, lost_picture_penalty: float = 2, lost_abuffer_penalty: float = 5,
+                 corrupted_penalty: float = 10, rebuffer_penalty: float = 30, stall_penalty_per_s: float = 10):
+        self.lost_picture_penalty = lost_picture_penalty
+        self.lost_abuffer_penalty = lost_abuffer_penalty
+        self.corrupted_penalty = corrupted_penalty
+        self.rebuffer_penalty = rebuffer_penalty
+        self.stall_penalty_per_s = stall_penalty_per_s
+        self._previous: Optional[tuple] = None
+
+    def reset(self):
+        """换了媒体或播放器后计数器从0开始，下一次打分只记录基准值"""
+        self._previous = None
+
+    def score(self, loss_counters: Sequence[int], rebuffers: int = 0, stall_ms: float = 0) -> float:
+        """根据累计计数器打分
+
+        参数:
+            loss_counters: 播放器统计的累计(lost_pictures, lost_abuffers, demux_corrupted)
+            rebuffers / stall_ms: 本集累计的卡顿次数和卡顿时长
+        """
+        counters = tuple(loss_counters) + (rebuffers, stall_ms)
+        previous = self._previous or counters
+        self._previous = counters
+        # 计数器变小说明重新加载过媒体，此时按新的累计值计算
+        lost_pictures, lost_abuffers, corrupted, new_rebuffers, new_stall_ms = (
+            current - last if current >= last else current for current, last in zip(counters, previous))
+
+        quality_score = 100
+        quality_score -= lost_pictures * self.lost_picture_penalty
+        quality_score -= lost_abuffers * self.lost_abuffer_penalty
+        quality_score -= corrupted * self.corrupted_penalty
+        quality_score -= new_rebuffers * self.rebuffer_penalty
+        quality_score -= new_stall_ms / 1000 * self.stall_penalty_per_s
+        return max(0, min(100, quality_score))
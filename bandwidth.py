@@ -0,0 +1,120 @@
+import math
+import time
+from array import array
+from typing import Optional
+
+
+class BandwidthEstimator:
+    """播放器读取速度估计
+
+    输入VLC MediaStats中累计的read_bytes，按两次采样的实际时间间隔换算速度（KB/s），
+    不依赖定时器的节拍。最近capacity个速度保存在定长的array环形缓冲中，用于计算分位数；
+    另外维护按时间加权的快/慢两条EWMA（半衰期fast_half_life/slow_half_life秒）和慢线的方差。
+    estimate()取两条EWMA中较小的值：网速下降时快线先反应，回升时由慢线压住，避免追高。
+    """
+
+    def __init__(self, capacity: int = 64, fast_half_life: float = 2.0, slow_half_life: float = 10.0):
+        self.capacity = capacity
+        self.fast_half_life = fast_half_life
+        self.slow_half_life = slow_half_life
+        self.reset()
+
+    def reset(self):
+        """清空全部记录"""
+        self._rates = array('d', [0.0] * self.capacity)
+        self._next = 0
+        self._count = 0
+        self.fast = 0.0
+        self.slow = 0.0
+        self.variance = 0.0
+        self.last_rate: Optional[float] = None
+        self._weight = 0.0
+        self._last_bytes: Optional[int] = None
+        self._last_time: Optional[float] = None
+        self._last_data_time: Optional[float] = None
+
+    @property
+    def sample_count(self) -> int:
+        return self._count
+
+    def reset_counter(self):
+        """切换媒体后read_bytes从0重新计数，只重置基准，保留已有的速度估计"""
+        self._last_bytes = None
+        self._last_time = None
+
+    def add_bytes(self, total_bytes: int, now: Optional[float] = None) -> Optional[float]:
+        """输入一次累计读取字节数，返回这段时间的速度（KB/s），首次采样返回None"""
+        now = time.monotonic() if now is None else now
+        previous_bytes, previous_time = self._last_bytes, self._last_time
+        self._last_bytes, self._last_time = total_bytes, now
+        if self._last_data_time is None:
+            self._last_data_time = now
+        if previous_bytes is None or total_bytes < previous_bytes:
+            # 首次采样或计数器被重置（重新加载了媒体）
+            return None
+        elapsed = now - previous_time
+        if elapsed <= 0:
+            return None
+        rate = (total_bytes - previous_bytes) / elapsed / 1024
+        self.add_sample(rate, elapsed)
+        if total_bytes > previous_bytes:
+            self._last_data_time = now
+        return rate
+
+    def add_sample(self, rate: float, elapsed: float):
+        """输入一段时长为elapsed秒、速度为rate（KB/s）的采样"""
+        self._rates[self._next] = rate
+        self._next = (self._next + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+        self.last_rate = rate
+
+        fast_alpha = 1 - 0.5 ** (elapsed / self.fast_half_life)
+        slow_alpha = 1 - 0.5 ** (elapsed / self.slow_half_life)
+        self.fast += fast_alpha * (rate - self.fast)
+        diff = rate - self.slow
+        increment = slow_alpha * diff
+        self.slow += increment
+        self.variance = (1 - slow_alpha) * (self.variance + diff * increment)
+        # 累计权重，用于修正初始值为0带来的偏低
+        self._weight += elapsed
+
+    def _debiased(self, value: float, half_life: float) -> float:
+        zero_factor = 1 - 0.5 ** (self._weight / half_life)
+        return value / zero_factor if zero_factor > 0 else 0.0
+
+    def fast_estimate(self) -> Optional[float]:
+        return self._debiased(self.fast, self.fast_half_life) if self._count else None
+
+    def slow_estimate(self) -> Optional[float]:
+        return self._debiased(self.slow, self.slow_half_life) if self._count else None
+
+    def estimate(self) -> Optional[float]:
+        """当前速度估计（KB/s），没有采样时返回None"""
+        if not self._count:
+            return None
+        return min(self.fast_estimate(), self.slow_estimate())
+
+    def estimate_kbps(self) -> Optional[float]:
+        """当前速度估计换算为kbit/s，与码率单位一致"""
+        estimate = self.estimate()
+        return estimate * 8 * 1024 / 1000 if estimate is not None else None
+
+    def stddev(self) -> float:
+        return math.sqrt(max(0.0, self.variance))
+
+    def percentile(self, p: float) -> Optional[float]:
+        """最近采样速度的第p百分位（0-100，线性插值）"""
+        if not self._count:
+            return None
+        values = sorted(self._rates[:self._count])
+        rank = (len(values) - 1) * min(max(p, 0), 100) / 100
+        low = int(rank)
+        high = min(low + 1, len(values) - 1)
+        return values[low] + (values[high] - values[low]) * (rank - low)
+
+    def idle_seconds(self, now: Optional[float] = None) -> float:
+        """距离上一次读到新数据的秒数"""
+        if self._last_data_time is None:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        return max(0.0, now - self._last_data_time)
@@ -0,0 +1,1329 @@
+"""本地基准测试工具
+
+在本机启动一个模拟订阅站点，对爬虫等模块做可重复的耗时对比，不访问真实网站。
+
+用法:
+    python benchmark.py refresh [--subs 9] [--latency 0.3] [--workers 8]
+    python benchmark.py conditional [--subs 9]
+    python benchmark.py extract [--pages 保存的详情页目录] [--rounds 20]
+    python benchmark.py links [--episodes 1229] [--latency 0.05] [--workers 32]
+    python benchmark.py proxy [--segments 20] [--latency 0.3] [--prefetch 5]
+    python benchmark.py next [--latency 0.3] [--intro 90]
+    python benchmark.py abr
+    python benchmark.py bandwidth [--trace 记录的read_bytes序列.json]
+    python benchmark.py window [--cycles 50] [--no-pool]（需要libvlc和图形界面）
+    python benchmark.py origin [--scenario 场景名或JSON文件 ...]
+    python benchmark.py download [--episodes 3] [--workers 6] [--scenario jitter]
+    python benchmark.py crypto [--segments 20] [--rotate 8]（需要cryptography）
+    python benchmark.py cache [--episodes 10] [--quota-mb 6]
+    python benchmark.py player [--scenario steady --scenario jitter] [--media-dir 分片目录] [--report report.json]
+        （需要libvlc；Linux无桌面时在xvfb-run下运行）
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urljoin
+
+from crawler import VideoCrawler
+from download_manager import DownloadCancelled, DownloadManager, DownloadTask
+from episode_feed import ChangeFeed
+from extractors import FastExtractor, SoupExtractor
+import requests
+
+from hls import HLSResolver, parse_playlist
+from abr import ABRSelector
+from bandwidth import BandwidthEstimator
+from cache_store import WatchHistory, pin_episode, unpin_episode
+from hls_crypto import HAS_AES, KeyCache, SegmentDecryptor, encrypt_segment
+from hls_origin import SCENARIOS, HLSOrigin, load_scenario, make_test_media
+from hls_proxy import HLSProxy, SegmentCache
+from http_cache import ValidatorCache
+from link_checker import LinkChecker, LinkHealthStore
+from qoe import QoESession
+from rate_limiter import get_rate_limiter
+from update_scheduler import UpdateScheduler
+
+
+def render_detail_page(vod_id, episode_count, padding_kb=60):
+    """生成与订阅站点结构一致的详情页HTML"""
+    episodes = "\n".join(
+        f'<li><a href="javascript:;">第{i:02d}集$https://play.example.test/{vod_id}/{i:04d}/index.m3u8</a></li>'
+        for i in range(1, episode_count + 1)
+    )
+    # 页面尾部的推荐列表、脚本等与解析无关的内容
+    filler = "\n".join(
+        f'<li class="col-md-2"><a class="thumb" href="/vod/{n}/"><img src="/img/{n}.jpg"></a>推荐影片{n}</li>'
+        for n in range(padding_kb * 10)
+    )
+    return f"""<!DOCTYPE html>
+<html>
+<head><meta charset="utf-8"><title>测试剧集{vod_id}</title></head>
+<body>
+<div class="container">
+    <div class="content__thumb"><a class="thumb" href="/vod/{vod_id}/"><img src="https://img.example.test/{vod_id}.jpg" alt=""></a></div>
+    <div class="content__detail">
+        <h1 class="title">测试剧集{vod_id}<small>更新至{episode_count}集</small></h1>
+        <p class="text-light">更新时间：2025-05-10</p>
+    </div>
+    <div class="content__playlist"><ul class="clearfix">
+{episodes}
+    </ul></div>
+    <ul class="recommend">
+{filler}
+    </ul>
+</div>
+<script>var stat = "{'x' * 1024}";</script>
+</body>
+</html>
+"""
+
+
+class StubSite:
+    """本地模拟订阅站点，/vod/<id>/ 返回详情页，可设置固定响应延迟，支持ETag条件请求"""
+
+    def __init__(self, episode_count=120, latency=0.3):
+        self.episode_count = episode_count
+        self.latency = latency
+        self.request_count = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self._pages = {}
+
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                match = re.match(r'^/vod/(\d+)/$', self.path)
+                if not match:
+                    self.send_error(404)
+                    return
+                time.sleep(site.latency)
+                body = site.page(int(match.group(1))).encode('utf-8')
+                etag = f'"{hashlib.md5(body).hexdigest()}"'
+                with site._lock:
+                    site.request_count += 1
+                    if self.headers.get('If-None-Match') != etag:
+                        site.bytes_sent += len(body)
+
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('ETag', etag)
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    # 客户端提前断开（流式读取已拿到所需内容）
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        # 客户端提前断开或关闭长连接属于正常情况，不打印异常
+        self.server.handle_error = lambda request, client_address: None
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def page(self, vod_id):
+        """获取（并缓存）指定编号的详情页"""
+        if vod_id not in self._pages:
+            self._pages[vod_id] = render_detail_page(vod_id, self.episode_count)
+        return self._pages[vod_id]
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class StubCDN:
+    """本地模拟播放链接主机
+
+    /<剧集>/index.m3u8 为主播放列表，/<剧集>/<码率名>/index.m3u8 为码率列表，
+    /<剧集>/<码率名>/<n>.ts 为分片（支持Range，大小与码率成正比）。
+    编号在dead中的剧集返回404，在slow中的额外延迟。variants为(码率名, bit/s)列表。
+    """
+
+    def __init__(self, latency=0.05, dead=(), slow=(), slow_latency=2.0, segment_count=180,
+                 variants=(('hls', 1500000),)):
+        self.latency = latency
+        self.variants = dict(variants)
+        self.segment_requests = {}
+        self.dead = set(dead)
+        self.slow = set(slow)
+        self.slow_latency = slow_latency
+        self.segment_count = segment_count
+        self.request_count = 0
+        self._lock = threading.Lock()
+
+        cdn = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                with cdn._lock:
+                    cdn.request_count += 1
+                match = re.match(r'^/(\d+)/(index\.m3u8|(\w+)/index\.m3u8|(\w+)/(\d+)\.ts)$', self.path)
+                variant = match and (match.group(3) or match.group(4))
+                if not match or int(match.group(1)) in cdn.dead or (variant and variant not in cdn.variants):
+                    self.send_error(404)
+                    return
+                episode = int(match.group(1))
+                segment = match.group(5)
+                time.sleep(cdn.latency + (cdn.slow_latency if episode in cdn.slow and segment else 0))
+
+                status = 200
+                if match.group(2) == 'index.m3u8':
+                    lines = ["#EXTM3U"]
+                    for name, bandwidth in cdn.variants.items():
+                        lines += [f"#EXT-X-STREAM-INF:BANDWIDTH={bandwidth}", f"{name}/index.m3u8"]
+                    body = ("\n".join(lines) + "\n").encode('ascii')
+                elif segment is None:
+                    lines = ["#EXTM3U", "#EXT-X-TARGETDURATION:10", "#EXT-X-MEDIA-SEQUENCE:0"]
+                    for n in range(cdn.segment_count):
+                        lines += ["#EXTINF:10.0,", f"{n}.ts"]
+                    lines.append("#EXT-X-ENDLIST")
+                    body = ("\n".join(lines) + "\n").encode('ascii')
+                else:
+                    with cdn._lock:
+                        cdn.segment_requests.setdefault(variant, []).append(int(segment))
+                    # 10秒分片的大小按码率计算，以188字节TS包对齐
+                    size = max(188, cdn.variants[variant] * 10 // 8 // 188 * 188)
+                    body = f"{episode}:{variant}:{segment}:".encode('ascii').ljust(size, b'\0')
+                    range_match = re.match(r'bytes=(\d+)-(\d+)', self.headers.get('Range', ''))
+                    if range_match:
+                        status = 206
+                        body = body[int(range_match.group(1)):int(range_match.group(2)) + 1]
+
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.server.handle_error = lambda request, client_address: None
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def episode_url(self, episode):
+        return f"{self.base_url}/{episode}/index.m3u8"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def write_subscriptions(path, base_url, count):
+    """生成指向模拟站点的订阅文件，所有订阅都处于待更新状态"""
+    data = {
+        "config_version": 2,
+        "subscriptions": [
+            {
+                "url": f"{base_url}/vod/{1000 + i}/",
+                "title": f"测试剧集{1000 + i}",
+                "last_check": "2000-01-01 00:00:00",
+                "update_time": "",
+                "episodes": [],
+                "total_episodes": 0,
+            }
+            for i in range(count)
+        ]
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=4)
+
+
+def make_crawler(workdir, subs_file, tag='', **kwargs):
+    """创建读写临时目录的爬虫，避免改动工作目录下的真实数据"""
+    crawler = VideoCrawler(**kwargs)
+    crawler.subscriptions_file = subs_file
+    crawler.validator_cache = ValidatorCache(os.path.join(workdir, f'http_cache{tag}.json'))
+    crawler.change_feed = ChangeFeed(os.path.join(workdir, f'episode_changes{tag}.jsonl'))
+    crawler.scheduler = UpdateScheduler(os.path.join(workdir, f'update_schedule{tag}.json'))
+    return crawler
+
+
+def bench_refresh(args):
+    """对比顺序刷新与并发刷新的耗时"""
+    workdir = tempfile.mkdtemp(prefix='bench_refresh_')
+    try:
+        with StubSite(latency=args.latency) as site:
+            rows = []
+            for label, workers in (("顺序", 1), ("并发", args.workers)):
+                subs_file = os.path.join(workdir, f'subscriptions_{workers}.json')
+                write_subscriptions(subs_file, site.base_url, args.subs)
+
+                crawler = make_crawler(workdir, subs_file, f'_{workers}',
+                                       max_workers=workers, per_host_limit=args.workers)
+
+                start = time.perf_counter()
+                result = crawler.update_subscriptions()
+                elapsed = time.perf_counter() - start
+
+                updated = sum(1 for v in result['updated_subscriptions'].values() if v.get('has_update'))
+                rows.append((label, workers, elapsed, updated))
+
+            print(f"订阅数: {args.subs}  单页延迟: {args.latency:.2f}s")
+            for label, workers, elapsed, updated in rows:
+                print(f"{label:<4} workers={workers:<3} 耗时 {elapsed:7.2f}s  有更新 {updated}/{args.subs}")
+            print(f"加速比: {rows[0][2] / rows[1][2]:.1f}x")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def bench_conditional(args):
+    """连续刷新两次，统计条件请求节省的流量"""
+    workdir = tempfile.mkdtemp(prefix='bench_conditional_')
+    try:
+        with StubSite(latency=args.latency) as site:
+            subs_file = os.path.join(workdir, 'subscriptions.json')
+            write_subscriptions(subs_file, site.base_url, args.subs)
+
+            crawler = make_crawler(workdir, subs_file)
+
+            for round_no in (1, 2):
+                sent_before = site.bytes_sent
+                start = time.perf_counter()
+                # 强制刷新，忽略检查计划
+                crawler.update_subscriptions(force=True)
+                elapsed = time.perf_counter() - start
+                print(f"第{round_no}轮: 耗时 {elapsed:.2f}s  下载 {(site.bytes_sent - sent_before) / 1024:.0f} KB")
+
+            print(f"条件请求统计: {crawler.validator_cache.get_stats()}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def bench_links(args):
+    """检查整个片库的剧集链接，分别统计冷启动（需解析播放列表）和分片索引已缓存时的耗时"""
+    workdir = tempfile.mkdtemp(prefix='bench_links_')
+    dead = range(0, args.episodes, 97)
+    slow = range(5, args.episodes, 151)
+    try:
+        with StubCDN(latency=args.latency, dead=dead, slow=slow) as cdn:
+            urls = [cdn.episode_url(n) for n in range(args.episodes)]
+            checker = LinkChecker(max_workers=args.workers, per_host_limit=args.workers,
+                                  store=LinkHealthStore(os.path.join(workdir, 'link_health.json')))
+            checker.resolver = HLSResolver(cache_dir=os.path.join(workdir, 'hls_cache'))
+
+            for label in ("冷启动", "索引已缓存"):
+                requests_before = cdn.request_count
+                start = time.perf_counter()
+                results = checker.check(urls)
+                elapsed = time.perf_counter() - start
+                counts = checker.store.summary(urls)
+                print(f"{label}: {len(urls)}集 耗时 {elapsed:6.2f}s  请求 {cdn.request_count - requests_before}  "
+                      f"正常 {counts['ok']} 慢 {counts['slow']} 失效 {counts['dead']}")
+
+            expected_dead = {cdn.episode_url(n) for n in dead}
+            wrong = [url for url, result in results.items() if (result['status'] == 'dead') != (url in expected_dead)]
+            if wrong:
+                raise SystemExit(f"{len(wrong)} 个链接状态与预期不符")
+            print(f"顺序检查预计耗时: {args.episodes * args.latency * 3:.0f}s 以上")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def play_through(session, url, segments, segment_time):
+    """模拟播放器：读取播放列表后依次请求分片，每个分片播放segment_time秒
+
+    返回:
+        (各分片等待时间列表, 分片内容列表)
+    """
+    playlist = parse_playlist(session.get(url).text, url)
+    if playlist['type'] == 'master':
+        url = playlist['variants'][0]['url']
+        playlist = parse_playlist(session.get(url).text, url)
+
+    waits, bodies = [], []
+    for segment in playlist['segments'][:segments]:
+        start = time.perf_counter()
+        response = session.get(urljoin(url, segment['uri']))
+        response.raise_for_status()
+        waits.append(time.perf_counter() - start)
+        bodies.append(response.content)
+        time.sleep(segment_time)
+    return waits, bodies
+
+
+def bench_proxy(args):
+    """对比直连、经代理首次播放（预取）和经代理重看时的分片等待时间"""
+    workdir = tempfile.mkdtemp(prefix='bench_proxy_')
+    try:
+        with StubCDN(latency=args.latency, segment_count=args.segments) as cdn:
+            proxy = HLSProxy(SegmentCache(os.path.join(workdir, 'segment_cache')),
+                             prefetch_segments=args.prefetch)
+            proxy.start()
+            session = requests.Session()
+            url = cdn.episode_url(1)
+            try:
+                rows = []
+                for label, media_url in (("直连", url), ("代理首次", proxy.proxy_url(url)),
+                                         ("代理重看", proxy.proxy_url(url))):
+                    requests_before = cdn.request_count
+                    waits, bodies = play_through(session, media_url, args.segments, args.segment_time)
+                    rows.append((label, waits, bodies, cdn.request_count - requests_before))
+
+                for label, waits, _, origin_requests in rows:
+                    print(f"{label:<6} 分片等待 平均 {sum(waits) / len(waits) * 1000:7.1f} ms  "
+                          f"最长 {max(waits) * 1000:7.1f} ms  源站请求 {origin_requests}")
+                print(f"代理统计: {proxy.get_stats()}")
+                if any(bodies != rows[0][2] for _, _, bodies, _ in rows):
+                    raise SystemExit("经代理读取的分片内容与源站不一致")
+            finally:
+                proxy.stop()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def start_episode(session, proxy, resolver, url, intro_seconds):
+    """模拟换集：经代理读取播放列表、首个分片和片头之后的分片，返回耗时"""
+    start = time.perf_counter()
+    index = resolver.cached(url)
+    media_url = proxy.proxy_url(index['variant_url'] if index else url)
+    playlist = parse_playlist(session.get(media_url).text, media_url)
+    if playlist['type'] == 'master':
+        media_url = playlist['variants'][0]['url']
+        playlist = parse_playlist(session.get(media_url).text, media_url)
+    segments = playlist['segments']
+    target = min(len(segments) - 1, int(intro_seconds // segments[0]['duration']))
+    for i in (0, target):
+        session.get(urljoin(media_url, segments[i]['uri'])).raise_for_status()
+    return time.perf_counter() - start
+
+
+def bench_next(args):
+    """对比未预取与已预取的下一集起播耗时"""
+    workdir = tempfile.mkdtemp(prefix='bench_next_')
+    try:
+        with StubCDN(latency=args.latency) as cdn:
+            proxy = HLSProxy(SegmentCache(os.path.join(workdir, 'segment_cache')))
+            proxy.start()
+            resolver = HLSResolver(cache_dir=os.path.join(workdir, 'hls_cache'))
+            proxy.resolver = resolver
+            session = requests.Session()
+            try:
+                cold = start_episode(session, proxy, resolver, cdn.episode_url(2), args.intro)
+                prefetch_start = time.perf_counter()
+                downloaded = proxy.prefetch_episode(cdn.episode_url(3), args.intro, args.seconds, args.kbps)
+                prefetch_time = time.perf_counter() - prefetch_start
+                requests_before = cdn.request_count
+                warm = start_episode(session, proxy, resolver, cdn.episode_url(3), args.intro)
+                print(f"未预取起播: {cold * 1000:7.1f} ms")
+                print(f"已预取起播: {warm * 1000:7.1f} ms  源站请求 {cdn.request_count - requests_before}（后台预取后续分片）")
+                print(f"预取: {downloaded / 1024:.0f} KB，耗时 {prefetch_time:.1f}s（限速 {args.kbps:.0f} KB/s）")
+            finally:
+                proxy.stop()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+ABR_VARIANTS = [
+    {'url': 'low', 'bandwidth': 500000},
+    {'url': 'mid', 'bandwidth': 1500000},
+    {'url': 'high', 'bandwidth': 3000000},
+]
+
+# (名称, [(吞吐量kbps, 质量得分), ...], 起播码率, 结束码率, 最多切换次数)
+ABR_TRACES = [
+    ("稳定高速", [(8000, 95)] * 30, 'high', 'high', 0),
+    ("起播带宽不足", [(1000, 90)] * 10, 'low', 'low', 0),
+    ("带宽骤降", [(8000, 95)] * 5 + [(1200, 40)] * 10, 'high', 'low', 2),
+    ("丢帧但带宽充足", [(8000, 30)] * 12, 'high', 'low', 2),
+    ("恢复后逐级升档", [(1000, 50)] * 6 + [(8000, 95)] * 20, 'low', 'high', 2),
+    ("短暂抖动不切换", ([(8000, 95)] * 4 + [(8000, 40)] * 2) * 5, 'high', 'high', 0),
+]
+
+
+def replay_trace(trace):
+    """用模拟的吞吐量和质量得分序列驱动选择器，返回(起播码率, 结束码率, 切换记录)"""
+    selector = ABRSelector(ABR_VARIANTS)
+    start = selector.select(trace[0][0])['url']
+    switches = []
+    for step, (throughput, score) in enumerate(trace):
+        variant = selector.update(throughput, score)
+        if variant:
+            switches.append((step, variant['url']))
+    return start, selector.current_variant['url'], switches
+
+
+def bench_abr(args):
+    """用模拟序列校验码率选择，并经代理验证码率切换在分片边界生效"""
+    failures = 0
+    for name, trace, expected_start, expected_end, max_switches in ABR_TRACES:
+        start, end, switches = replay_trace(trace)
+        ok = start == expected_start and end == expected_end and len(switches) <= max_switches
+        failures += not ok
+        print(f"{'通过' if ok else '失败'} {name}: 起播 {start} 结束 {end} 切换 {switches}")
+
+    workdir = tempfile.mkdtemp(prefix='bench_abr_')
+    try:
+        variants = (('low', 500000), ('mid', 1500000), ('high', 3000000))
+        with StubCDN(latency=args.latency, segment_count=args.segments, variants=variants) as cdn:
+            proxy = HLSProxy(SegmentCache(os.path.join(workdir, 'segment_cache')), prefetch_segments=2)
+            proxy.resolver = HLSResolver(cache_dir=os.path.join(workdir, 'hls_cache'))
+            proxy.start()
+            session = requests.Session()
+            master = cdn.episode_url(1)
+            try:
+                media_url = proxy.abr_url(master)
+                playlist = parse_playlist(session.get(media_url).text, media_url)
+                played = []
+                for i, segment in enumerate(playlist['segments']):
+                    if i == args.switch_at:
+                        proxy.set_variant(master, f"{cdn.base_url}/1/low/index.m3u8")
+                    body = session.get(urljoin(media_url, segment['uri'])).content
+                    played.append(body.split(b':')[1].decode('ascii') + ':' + body.split(b':')[2].decode('ascii'))
+                print(f"播放的分片(码率:序号): {played}")
+                expected = [f"{'high' if i < args.switch_at else 'low'}:{i}" for i in range(len(played))]
+                if played != expected:
+                    failures += 1
+                    print("失败: 码率切换没有在分片边界生效或分片序号不连续")
+                else:
+                    print(f"通过: 第{args.switch_at}个分片起切换到低码率，分片序号连续，播放器无需重新打开媒体")
+            finally:
+                proxy.stop()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if failures:
+        raise SystemExit(f"{failures} 项检查失败")
+
+
+def media_stats_trace(rates, tick, reset_at=None):
+    """按节拍tick秒生成MediaStats.read_bytes累计值序列[(时间, read_bytes)]
+
+    参数:
+        rates: [(持续秒数, 速度KB/s), ...]
+        reset_at: 在该时间重新加载媒体，read_bytes从0重新计数
+    """
+    trace, now, total = [(0.0, 0)], 0.0, 0.0
+    for duration, rate in rates:
+        end = now + duration
+        while now + tick <= end + 1e-9:
+            now += tick
+            total += rate * 1024 * tick
+            if reset_at is not None and now >= reset_at:
+                total, reset_at = rate * 1024 * tick, None
+            trace.append((round(now, 3), int(total)))
+    return trace
+
+
+def bursty_trace(seconds, segment_kb, segment_seconds, link_kbps, tick):
+    """HLS分片式读取：每个分片时长内先以链路速度下载segment_kb，然后空闲"""
+    trace, total = [(0.0, 0)], 0.0
+    download_time = segment_kb / link_kbps
+    steps = int(seconds / tick)
+    for step in range(1, steps + 1):
+        t = step * tick
+        total = 0.0
+        for start in range(0, int(t // segment_seconds) + 1):
+            elapsed = min(max(t - start * segment_seconds, 0), download_time)
+            total += elapsed * link_kbps * 1024
+        trace.append((round(t, 3), int(total)))
+    return trace
+
+
+def replay_media_stats(trace):
+    """把read_bytes序列喂给估计器，返回(估计器, 每次采样后的估计值列表)"""
+    estimator = BandwidthEstimator()
+    estimates = []
+    for now, read_bytes in trace:
+        estimator.add_bytes(read_bytes, now)
+        estimates.append((now, estimator.estimate()))
+    return estimator, estimates
+
+
+def legacy_speeds(trace):
+    """原来的算法：每个节拍的字节差直接当作每秒速度"""
+    return [(b - a) / 1024 for (_, a), (_, b) in zip(trace, trace[1:])]
+
+
+def bench_bandwidth(args):
+    """速度估计的每次采样耗时，以及回放记录的MediaStats序列（正确性见tests/test_bandwidth.py）"""
+    for tick in (0.5, 1.0):
+        trace = media_stats_trace([(3600, 600)], tick)
+        start = time.perf_counter()
+        estimator, _ = replay_media_stats(trace)
+        elapsed = (time.perf_counter() - start) * 1e6 / len(trace)
+        print(f"1小时{tick * 1000:.0f}ms采样: {len(trace)} 个采样，每次 {elapsed:.1f}us，"
+              f"缓冲 {estimator.sample_count}/{estimator.capacity}，估计 {estimator.estimate():.1f}KB/s")
+
+    if args.trace:
+        with open(args.trace, 'r', encoding='utf-8') as f:
+            trace = [tuple(item) for item in json.load(f)]
+        estimator, estimates = replay_media_stats(trace)
+        print(f"回放 {args.trace}: {len(trace)} 个采样，估计 {estimator.estimate():.1f}KB/s，"
+              f"快线 {estimator.fast_estimate():.1f}，慢线 {estimator.slow_estimate():.1f}，"
+              f"P10 {estimator.percentile(10):.1f} P50 {estimator.percentile(50):.1f} P90 {estimator.percentile(90):.1f}")
+
+
+def resident_memory_mb():
+    """当前进程的常驻内存（MB），优先使用psutil"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 1024 / 1024
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS单位为字节，Linux为KB；这里只能得到峰值
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+def bench_window(args):
+    """连续打开/关闭播放窗口，统计打开耗时和常驻内存"""
+    import tkinter as tk
+    import video_player
+    from vlc_pool import PlayerPool
+
+    if args.no_pool:
+        # 对照组：每个窗口新建VLC实例、播放器用完即释放，即改动前的做法
+        video_player.get_player_pool = lambda: PlayerPool(size=0)
+
+    root = tk.Tk()
+    root.withdraw()
+    with StubCDN(latency=0, segment_count=5) as cdn:
+        url = args.media or cdn.episode_url(1)
+        video_list = [{'title': f"第{i}集", 'url': url} for i in range(1, 4)]
+        open_times, memory = [], [resident_memory_mb()]
+        for cycle in range(args.cycles):
+            start = time.perf_counter()
+            window = video_player.VideoPlayerWindow(root, url, "基准测试", video_list=video_list, current_index=0,
+                                                    subscription_data={'title': "基准测试"})
+            root.update()
+            open_times.append((time.perf_counter() - start) * 1000)
+            window.on_closing()
+            root.update()
+            memory.append(resident_memory_mb())
+    root.destroy()
+
+    first = open_times[0]
+    open_times.sort()
+    label = "每窗口新建实例" if args.no_pool else "共享实例+播放器池"
+    print(f"{label}: {args.cycles}次打开/关闭")
+    print(f"  打开耗时 首次 {first:.0f} ms  "
+          f"中位数 {open_times[len(open_times) // 2]:.0f} ms  "
+          f"P95 {open_times[min(len(open_times) - 1, int(len(open_times) * 0.95))]:.0f} ms")
+    print(f"  常驻内存 开始 {memory[0]:.0f} MB  第1次关闭后 {memory[1]:.0f} MB  结束 {memory[-1]:.0f} MB  "
+          f"增长 {memory[-1] - memory[1]:+.0f} MB")
+    if not args.no_pool:
+        print(f"  播放器池: {video_player.get_player_pool().get_stats()}")
+
+
+def simulate_playback(origin):
+    """模拟播放器按场景播放：依次下载分片放入缓冲，按实际时间消耗缓冲
+
+    缓冲达到startup_buffer秒开始播放，耗尽时卡顿，恢复到resume_buffer秒后继续；
+    分片请求失败或传输中断时按retries重试（计为一次恢复），重试用尽即播放失败。
+    直播列表播完已有分片后按目标时长刷新列表。指标用QoESession统计，与播放窗口一致。
+    """
+    player = origin.scenario['player']
+    url = origin.variant_url()
+    qoe = QoESession(url, series=origin.scenario['name'])
+    estimator = BandwidthEstimator()
+    state = {'buffer': 0.0, 'playing': False, 'started': False, 'clock': time.perf_counter()}
+
+    def advance():
+        """按经过的实际时间消耗缓冲"""
+        now = time.perf_counter()
+        elapsed, state['clock'] = now - state['clock'], now
+        if state['playing']:
+            if state['buffer'] >= elapsed:
+                state['buffer'] -= elapsed
+            else:
+                # 缓冲在这段时间内耗尽，从耗尽的时刻开始算卡顿
+                qoe.on_tick(True, None, now - (elapsed - state['buffer']))
+                state['buffer'], state['playing'] = 0.0, False
+
+    def add_segment(duration, size, elapsed):
+        advance()
+        estimator.add_sample(size / 1024 / elapsed, elapsed)
+        qoe.bytes_read += size
+        state['buffer'] += duration
+        target = player['resume_buffer'] if state['started'] else player['startup_buffer']
+        if not state['playing'] and state['buffer'] >= target:
+            state['playing'] = True
+            if not state['started']:
+                state['started'] = True
+                qoe.mark_playing()
+                qoe.mark_first_frame()
+            qoe.on_tick(False)
+        if state['buffer'] > player['max_buffer']:
+            time.sleep(state['buffer'] - player['max_buffer'])
+            advance()
+
+    http = requests.Session()
+    next_sequence, segments_played, refreshes, failed = 0, 0, 0, False
+    while not failed:
+        playlist = parse_playlist(http.get(url, timeout=10).text, url)
+        pending = [(playlist['media_sequence'] + i, seg) for i, seg in enumerate(playlist['segments'])
+                   if playlist['media_sequence'] + i >= next_sequence]
+        if not pending:
+            if playlist['endlist'] or refreshes >= 10:
+                break
+            refreshes += 1
+            time.sleep(playlist['target_duration'] / 2)
+            advance()
+            continue
+        refreshes = 0
+
+        for sequence, segment in pending:
+            for attempt in range(player['retries'] + 1):
+                start = time.perf_counter()
+                try:
+                    response = http.get(urljoin(url, segment['uri']), timeout=10)
+                    response.raise_for_status()
+                    expected = int(response.headers.get('Content-Length', len(response.content)))
+                    if len(response.content) != expected:
+                        raise IOError("分片不完整")
+                    add_segment(segment['duration'], len(response.content), time.perf_counter() - start)
+                    break
+                except (requests.RequestException, IOError):
+                    qoe.mark_recovery()
+                    time.sleep(0.2 * (attempt + 1))
+                    advance()
+            else:
+                failed = True
+                break
+            next_sequence = sequence + 1
+            segments_played += 1
+
+    advance()
+    record = qoe.finish()
+    record.update({
+        'completed': not failed,
+        'segments': segments_played,
+        'estimate_kbps': round(estimator.estimate_kbps() or 0),
+    })
+    return record
+
+
+def check_expectations(record, expect):
+    """对照场景中的expect，返回不满足的条目"""
+    problems = []
+    fields = {'rebuffers': 'rebuffer_count', 'recoveries': 'recovery_attempts', 'stall_ms': 'stall_ms',
+              'segments': 'segments', 'startup_ms': 'startup_ms'}
+    for key, value in expect.items():
+        if key == 'completed':
+            if record['completed'] != value:
+                problems.append(f"completed={record['completed']}")
+            continue
+        bound, name = key.split('_', 1)
+        actual = record.get(fields.get(name, name))
+        if actual is None:
+            problems.append(f"{name}无数据")
+        elif bound == 'max' and actual > value:
+            problems.append(f"{name}={actual} > {value}")
+        elif bound == 'min' and actual < value:
+            problems.append(f"{name}={actual} < {value}")
+    return problems
+
+
+def bench_origin(args):
+    """在本地模拟源站上按场景模拟播放，统计卡顿和恢复并校验预期"""
+    failures = 0
+    for spec in args.scenario or list(SCENARIOS):
+        with HLSOrigin(spec) as origin:
+            record = simulate_playback(origin)
+            problems = check_expectations(record, origin.scenario['expect'])
+        failures += bool(problems)
+        print(f"{'通过' if not problems else '失败'} {origin.scenario['name']:<14} "
+              f"{'完成' if record['completed'] else '中断'} 分片 {record['segments']:3d}  "
+              f"起播 {record['startup_ms'] or 0:5.0f} ms  卡顿 {record['rebuffer_count']}次/{record['stall_ms']:5d} ms  "
+              f"恢复 {record['recovery_attempts']:2d}  估计带宽 {record['estimate_kbps']}kbps"
+              + (f"  不满足: {', '.join(problems)}" if problems else ""))
+    if failures:
+        raise SystemExit(f"{failures} 个场景不满足预期")
+
+
+def new_download_manager(directory, workers, max_bytes=0):
+    """基准专用的下载管理器：下载目录和分片索引都放在临时目录中"""
+    manager = DownloadManager(os.path.join(directory, 'downloads'), workers=workers, timeout=5, retries=3,
+                              max_bytes=max_bytes)
+    manager.resolver = HLSResolver(cache_dir=os.path.join(directory, 'hls_cache'))
+    return manager
+
+
+def verify_download(manager, origin, url):
+    """本地播放列表中的分片数量和内容与源站一致"""
+    path = manager.local_playlist(url)
+    if path is None:
+        return "没有生成本地播放列表"
+    with open(path, 'r', encoding='utf-8') as f:
+        playlist = parse_playlist(f.read(), path)
+    if len(playlist['segments']) != origin.segment_count:
+        return f"分片数 {len(playlist['segments'])}，应为 {origin.segment_count}"
+    directory = os.path.dirname(path)
+    for i, segment in enumerate(playlist['segments']):
+        with open(os.path.join(directory, segment['uri']), 'rb') as f:
+            if f.read() != origin.segment_body('mid', i):
+                return f"第{i}个分片内容不一致"
+    return None
+
+
+def bench_download(args):
+    """离线下载：单线程与并发下载的耗时对比、中断后续传的请求数，以及断线场景下的完整性校验"""
+    workdir = tempfile.mkdtemp(prefix='bench_download_')
+    try:
+        with HLSOrigin(args.scenario) as origin:
+            urls = [f"{origin.variant_url()}?ep={i}" for i in range(1, args.episodes + 1)]
+            timings = {}
+            for workers in (1, args.workers):
+                manager = new_download_manager(os.path.join(workdir, f"workers{workers}"), workers)
+                requests_before = origin.segment_requests
+                start = time.perf_counter()
+                for url in urls:
+                    manager.download(DownloadTask(url, "基准", url.rsplit('=', 1)[1]))
+                timings[workers] = time.perf_counter() - start
+                size = manager.get_progress()['bytes']
+                problems = [problem for problem in (verify_download(manager, origin, url) for url in urls) if problem]
+                print(f"并发 {workers:2d}: {len(urls)}集 耗时 {timings[workers]:6.2f}s  "
+                      f"分片请求 {origin.segment_requests - requests_before}  {size / 1024 / 1024:.1f}MB"
+                      + (f"  校验失败: {problems[0]}" if problems else ""))
+                if problems:
+                    raise SystemExit("下载内容与源站不一致")
+            print(f"并发加速: {timings[1] / timings[args.workers]:.1f}x")
+
+            # 下载到一半取消，再次下载时只请求缺失的分片
+            manager = new_download_manager(os.path.join(workdir, 'resume'), args.workers)
+            task = DownloadTask(urls[0], "基准", "续传")
+
+            def cancel_halfway(current):
+                if current.done_segments >= current.total_segments // 2:
+                    current.cancelled = True
+
+            try:
+                manager.download(task, cancel_halfway)
+                raise SystemExit("取消没有生效")
+            except DownloadCancelled:
+                pass
+            done_at_cancel = task.done_segments
+            requests_before = origin.segment_requests
+            manager.download(DownloadTask(urls[0], "基准", "续传"))
+            resumed = origin.segment_requests - requests_before
+            print(f"续传: 取消时已完成 {done_at_cancel}/{origin.segment_count} 个分片，续传请求 {resumed} 个")
+            if resumed > origin.segment_count - done_at_cancel:
+                raise SystemExit("续传重新下载了已完成的分片")
+
+        # 传输中断开：依靠Content-Length校验发现不完整的分片并重试
+        with HLSOrigin('dropped_connections') as origin:
+            manager = new_download_manager(os.path.join(workdir, 'dropped'), args.workers)
+            url = f"{origin.variant_url()}?ep=1"
+            manager.download(DownloadTask(url, "基准", "断线"))
+            problem = verify_download(manager, origin, url)
+            print(f"断线场景: 分片请求 {origin.segment_requests}（{origin.segment_count}个分片）  "
+                  f"{'校验通过' if not problem else problem}")
+            if problem:
+                raise SystemExit("断线场景下载内容不完整")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def write_watch_history(path, series, watched, unwatched):
+    """生成播放记录：watched中的剧集播放到了结尾，unwatched中的只看了开头"""
+    records = [{'episode_title': title, 'url': url, 'current_time': 95 if title in watched else 10,
+                'total_time': 100, 'last_play': datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+               for title, url in list(watched.items()) + list(unwatched.items())]
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({series: {'play_history': records}}, f, ensure_ascii=False)
+
+
+def wait_until(predicate, timeout):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+def bench_cache(args):
+    """缓存配额：后台淘汰不阻塞写入，已看完的剧集先淘汰、再按最近最少使用，正在播放的剧集不淘汰；
+    重启时读取索引不扫描目录，旧缓存目录在后台接管"""
+    workdir = tempfile.mkdtemp(prefix='bench_cache_')
+    segment_size = 100 * 1024
+    segments_per_episode = 10
+    episodes = [(f"第{i:02d}集", f"https://play.example.test/cache/{i:02d}/index.m3u8")
+                for i in range(1, args.episodes + 1)]
+    # 第1集最早写入，按LRU本应最先淘汰，但它正在播放；第2集和第5集已经看完
+    pinned_url = episodes[0][1]
+    watched = {title: url for i, (title, url) in enumerate(episodes) if i in (1, 4)}
+    unwatched = {title: url for title, url in episodes if title not in watched}
+    history_file = os.path.join(workdir, 'play_history.json')
+    write_watch_history(history_file, "基准剧集", watched, unwatched)
+    cache_dir = os.path.join(workdir, 'segment_cache')
+    quota = args.quota_mb * 1024 * 1024
+    failures = []
+
+    def present(cache, url):
+        return sum(f"{url}/{n}.ts" in cache for n in range(segments_per_episode))
+
+    pin_episode(pinned_url)
+    try:
+        cache = SegmentCache(cache_dir, max_bytes=quota, history=WatchHistory(history_file))
+        put_times = []
+        start = time.perf_counter()
+        for title, url in episodes:
+            for n in range(segments_per_episode):
+                data = os.urandom(segment_size)
+                put_start = time.perf_counter()
+                cache.put(f"{url}/{n}.ts", data, {'url': url, 'series': "基准剧集", 'episode': title})
+                put_times.append(time.perf_counter() - put_start)
+        written = time.perf_counter() - start
+        settled = wait_until(lambda: cache.total_bytes <= quota, 10)
+        settle_time = time.perf_counter() - start
+        put_times.sort()
+        print(f"写入 {len(put_times)}个分片 {len(put_times) * segment_size / 1024 / 1024:.1f}MB，配额 {args.quota_mb}MB: "
+              f"写入耗时 {written * 1000:.0f}ms，单次中位 {put_times[len(put_times) // 2] * 1000:.2f}ms "
+              f"最大 {put_times[-1] * 1000:.2f}ms；{settle_time:.2f}s后回到配额内 "
+              f"当前 {cache.total_bytes / 1024 / 1024:.1f}MB")
+        if not settled:
+            failures.append("后台淘汰没有回到配额内")
+
+        for title, url in episodes:
+            state = ("播放中" if url == pinned_url else "已看完" if url in watched.values() else "未看完")
+            print(f"  {title} {state}: 保留 {present(cache, url)}/{segments_per_episode}")
+        stats = cache.get_stats()
+        print(f"淘汰 {stats['evicted']}个分片，其中已看完 {stats['evicted_watched']}个")
+        if present(cache, pinned_url) != segments_per_episode:
+            failures.append("淘汰了正在播放的剧集")
+        if any(present(cache, url) for url in watched.values()):
+            failures.append("已看完的剧集没有被淘汰")
+        if present(cache, episodes[-1][1]) != segments_per_episode:
+            failures.append("最近写入的剧集被淘汰")
+        # 未看完的剧集按写入先后淘汰：保留的分片数随写入顺序不减
+        kept = [present(cache, url) for title, url in episodes if url != pinned_url and title in unwatched]
+        if kept != sorted(kept):
+            failures.append(f"未看完的剧集没有按最近最少使用淘汰: {kept}")
+        # 淘汰的文件已从磁盘删除
+        files = [name for name in os.listdir(cache_dir) if name != SegmentCache.INDEX_NAME]
+        if len(files) != stats['entries']:
+            failures.append(f"磁盘上有 {len(files)} 个文件，索引中有 {stats['entries']} 个")
+        cache.store.stop()
+
+        # 重启：读取索引后立即可用，目录在后台核对
+        start = time.perf_counter()
+        reopened = SegmentCache(cache_dir, max_bytes=quota, history=WatchHistory(history_file))
+        reopen_time = time.perf_counter() - start
+        entries = reopened.get_stats()['entries']
+        reconciled = reopened.store.reconciled.wait(10)
+        print(f"重新打开: {reopen_time * 1000:.1f}ms，索引 {entries}个分片，"
+              f"{time.perf_counter() - start:.2f}s后核对完成")
+        if entries != stats['entries'] or not reconciled or reopened.get_stats()['entries'] != entries:
+            failures.append("重新打开后索引与淘汰后的缓存不一致")
+        reopened.store.stop()
+
+        # 没有索引的旧缓存目录：在后台接管，构造时立即返回
+        os.remove(os.path.join(cache_dir, SegmentCache.INDEX_NAME))
+        start = time.perf_counter()
+        migrated = SegmentCache(cache_dir, max_bytes=quota, history=WatchHistory(history_file))
+        construct_time = time.perf_counter() - start
+        adopted = wait_until(lambda: len(migrated.store) == stats['entries'], 10)
+        print(f"接管旧缓存: 构造 {construct_time * 1000:.1f}ms，后台接管 {len(migrated.store)}个分片")
+        if not adopted:
+            failures.append("没有接管目录中已有的分片")
+        migrated.store.stop()
+
+        # 下载目录同样按配额淘汰：已看完的整集先删除，正在播放的不删除
+        with HLSOrigin('steady') as origin:
+            urls = [f"{origin.variant_url()}?ep={i}" for i in range(1, 4)]
+            episode_size = origin.segment_count * len(origin.segment_body('mid', 0))
+            manager = new_download_manager(os.path.join(workdir, 'downloads'), 6, max_bytes=int(episode_size * 2.5))
+            download_history = os.path.join(workdir, 'download_history.json')
+            write_watch_history(download_history, "基准", {'第2集': urls[1]}, {'第1集': urls[0], '第3集': urls[2]})
+            manager.store.history = WatchHistory(download_history)
+            pin_episode(urls[0])
+            try:
+                for i, url in enumerate(urls, 1):
+                    manager.download(DownloadTask(url, "基准", f"第{i}集"))
+                wait_until(lambda: manager.store.total_bytes <= manager.store.max_bytes, 10)
+                kept = [manager.local_playlist(url) is not None for url in urls]
+                print(f"下载配额 {episode_size * 2.5 / 1024 / 1024:.1f}MB（约2.5集）: "
+                      f"第1集(播放中) {'保留' if kept[0] else '删除'}，第2集(已看完) {'保留' if kept[1] else '删除'}，"
+                      f"第3集 {'保留' if kept[2] else '删除'}")
+                if kept != [True, False, True] or os.path.isdir(manager.episode_dir(urls[1])):
+                    failures.append("下载目录没有按观看进度淘汰")
+            finally:
+                unpin_episode(urls[0])
+                manager.shutdown()
+    finally:
+        unpin_episode(pinned_url)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if failures:
+        raise SystemExit("；".join(failures))
+    print("全部检查通过")
+
+
+def bench_crypto(args):
+    """AES-128：流式解密吞吐量、加密剧集与明文剧集的下载耗时，以及代理密钥读取的耗时
+    （正确性见tests/test_hls_crypto.py）"""
+    if not HAS_AES:
+        raise SystemExit("需要安装cryptography: pip install cryptography")
+    key, iv = os.urandom(16), os.urandom(16)
+    block = encrypt_segment(os.urandom(1024 * 1024 - 1), key, iv)
+    decryptor = SegmentDecryptor(key, iv)
+    start = time.perf_counter()
+    for _ in range(64):
+        for i in range(0, len(block) - 16, 64 * 1024):
+            decryptor.update(block[i:i + 64 * 1024])
+    elapsed = time.perf_counter() - start
+    print(f"流式解密: 64MB {elapsed:.2f}s  {64 / elapsed:.0f}MB/s（64KB分块）")
+
+    workdir = tempfile.mkdtemp(prefix='bench_crypto_')
+    try:
+        for name, encryption in (("明文", None), ("AES-128（IV: sequence）", {'rotate': args.rotate, 'iv': 'sequence'}),
+                                 ("AES-128（IV: explicit）", {'rotate': args.rotate, 'iv': 'explicit'})):
+            scenario = {'name': name, 'segments': args.segments, 'network': {'throughput_kbps': 8000},
+                        'encryption': encryption}
+            with HLSOrigin(scenario) as origin:
+                manager = new_download_manager(os.path.join(workdir, str(len(os.listdir(workdir)))), args.workers)
+                manager.keys = KeyCache()
+                url = f"{origin.variant_url()}?ep=1"
+                start = time.perf_counter()
+                manager.download(DownloadTask(url, "基准", name))
+                elapsed = time.perf_counter() - start
+                manager.shutdown()
+                print(f"{name}: 下载 {args.segments}个分片 {elapsed:.2f}s  密钥请求 {origin.key_requests}")
+
+        # 代理：首次读取密钥要请求源站，之后从缓存返回
+        scenario = {'name': "代理密钥缓存", 'segments': args.segments, 'encryption': {'rotate': args.rotate}}
+        with HLSOrigin(scenario) as origin:
+            proxy = HLSProxy(SegmentCache(os.path.join(workdir, 'segment_cache')))
+            proxy.keys = KeyCache()
+            proxy.start()
+            try:
+                session = requests.Session()
+                text = session.get(proxy.proxy_url(origin.variant_url())).text
+                key_urls = re.findall(r'URI="([^"]+)"', text)
+                timings = []
+                for _ in range(3):
+                    start = time.perf_counter()
+                    for key_url in key_urls:
+                        session.get(key_url).content
+                    timings.append((time.perf_counter() - start) * 1000 / max(1, len(key_urls)))
+            finally:
+                proxy.stop()
+            print(f"代理: 密钥 {len(key_urls)}个  首次读取 {timings[0]:.1f}ms/个  缓存读取 {timings[-1]:.1f}ms/个  "
+                  f"源站密钥请求 {origin.key_requests}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+HEADLESS_VLC_ARGS = ('--vout=dummy', '--aout=dummy', '--no-video-title-show', '--quiet')
+
+
+def pump_until(root, predicate, timeout):
+    """运行Tk事件循环直到predicate()为真，返回耗时毫秒，超时返回None"""
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        root.update()
+        if predicate():
+            return round((time.perf_counter() - start) * 1000)
+        time.sleep(0.005)
+    return None
+
+
+def run_player_scenario(root, origin, video_player, intro_seconds, timeout):
+    """在隐藏的播放窗口中依次执行：起播、跳过片头、三次跳转、下一集、断线恢复"""
+    import vlc
+
+    episodes = [{'title': f"第{i}集", 'url': f"{origin.variant_url()}?ep={i}"} for i in range(1, 4)]
+    result = {'scenario': origin.scenario['name']}
+    cpu_start, memory_start = time.process_time(), resident_memory_mb()
+
+    window = video_player.VideoPlayerWindow(
+        root, episodes[0]['url'], episodes[0]['title'], video_list=episodes, current_index=0,
+        subscription_data={'title': "无界面基准", 'intro_duration': intro_seconds, 'outro_duration': 0})
+    window.withdraw()
+    try:
+        # 起播：load_video到首帧；到达Playing时自动跳过片头
+        pump_until(root, lambda: window.qoe and window.qoe.first_frame_ms is not None, timeout)
+        if window.qoe is None:
+            raise RuntimeError("播放窗口没有开始播放会话")
+        result['startup_ms'] = window.qoe.startup_ms and round(window.qoe.startup_ms)
+        result['ttff_ms'] = window.qoe.first_frame_ms and round(window.qoe.first_frame_ms)
+        result['intro_skip_ms'] = pump_until(root, lambda: window.player.get_time() >= intro_seconds * 1000, timeout)
+
+        # 跳转：进度条拖到25%、50%、75%，直到播放时间到达目标附近
+        result['seek_ms'] = []
+        length = window.player.get_length()
+        for percent in (25, 50, 75):
+            if length <= 0:
+                break
+            target = length * percent / 100
+            window.seek(percent)
+            result['seek_ms'].append(pump_until(
+                root, lambda: window.player.is_playing() and abs(window.player.get_time() - target) < 1500, timeout))
+
+        # 下一集：从play_next到新剧集首帧
+        window.play_next()
+        pump_until(root, lambda: window.qoe and window.qoe.url == episodes[1]['url'] and
+                   window.qoe.first_frame_ms is not None, timeout)
+        result['switch_ms'] = window.qoe and window.qoe.switch_ms and round(window.qoe.switch_ms)
+
+        # 断线恢复：重新加载当前剧集直到重新进入播放状态
+        seen_reload = []
+        window.attempt_recovery()
+        result['recovery_ms'] = pump_until(
+            root, lambda: seen_reload.append(window.player.get_state() != vlc.State.Playing) or
+            (any(seen_reload) and window.player.get_state() == vlc.State.Playing), timeout)
+        result['rebuffers'] = window.qoe.rebuffer_count
+        result['stall_ms'] = round(window.qoe.stall_ms)
+        result['seek_wait_ms'] = round(window.qoe.seek_wait_ms)
+    finally:
+        window.on_closing()
+        root.update()
+
+    result['cpu_s'] = round(time.process_time() - cpu_start, 2)
+    result['rss_mb'] = round(resident_memory_mb(), 1)
+    result['rss_growth_mb'] = round(result['rss_mb'] - memory_start, 1)
+    return result
+
+
+def bench_player(args):
+    """无界面驱动播放窗口，输出每个场景的起播、跳转、切集、恢复耗时和CPU/内存"""
+    import tkinter as tk
+    import vlc
+    import vlc_pool
+
+    workdir = tempfile.mkdtemp(prefix='bench_player_')
+    cwd = os.getcwd()
+    media_dir = os.path.abspath(args.media_dir) if args.media_dir else os.path.join(workdir, 'media')
+    if not args.media_dir and not make_test_media(media_dir, seconds=args.seconds):
+        # 没有ffmpeg时使用生成的分片：能测起播和网络路径，但没有可解码画面
+        print("未找到ffmpeg，使用不含画面的生成分片，首帧和跳转指标可能为空")
+        media_dir = None
+    segments = len([name for name in os.listdir(media_dir) if name.endswith('.ts')]) if media_dir else args.seconds
+
+    # 播放记录、质量日志和缓存都写到临时目录
+    os.chdir(workdir)
+    vlc_pool.get_player_pool(HEADLESS_VLC_ARGS)
+    import video_player
+
+    root = tk.Tk()
+    root.withdraw()
+    results = []
+    try:
+        for spec in args.scenario or ['steady', 'jitter', 'bandwidth_drop']:
+            scenario = load_scenario(spec)
+            scenario.update(segments=segments, media_dir=media_dir)
+            with HLSOrigin(scenario) as origin:
+                result = run_player_scenario(root, origin, video_player, args.intro, args.timeout)
+            results.append(result)
+            print(f"{result['scenario']:<14} 首帧 {result['ttff_ms']} ms  跳过片头 {result['intro_skip_ms']} ms  "
+                  f"跳转 {result['seek_ms']} ms  切集 {result['switch_ms']} ms  恢复 {result['recovery_ms']} ms  "
+                  f"CPU {result['cpu_s']}s  内存 {result['rss_mb']}MB")
+    finally:
+        root.destroy()
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'time': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'vlc_version': vlc.libvlc_get_version().decode('utf-8', 'replace'),
+        'platform': sys.platform,
+        'media': 'ffmpeg' if media_dir else 'synthetic',
+        'scenarios': results
+    }
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+        print(f"报告已写入 {args.report}")
+    else:
+        print(json.dumps(report, ensure_ascii=False, indent=1))
+
+
+def sample_pages():
+    """生成覆盖常见结构变化的详情页样本"""
+    base = render_detail_page(2001, 120)
+    return {
+        'generated_120': base,
+        'generated_1': render_detail_page(2002, 1),
+        'entities': base.replace('测试剧集2001<small>', '测试&amp;剧集 &lt;2001&gt;<small>'),
+        'nested_playlist': base.replace(
+            '<div class="content__playlist"><ul class="clearfix">',
+            '<div class="content__playlist"><ul class="content__playlist clearfix">'
+        ),
+        'two_sources': base.replace(
+            '<ul class="recommend">',
+            '<div class="content__playlist"><ul><li><a>第01集$https://b.example.test/1/index.m3u8</a></li></ul></div>\n'
+            '<ul class="recommend">'
+        ),
+        'missing_markers': base.replace('content__playlist', 'playlist'),
+    }
+
+
+def load_saved_pages(directory):
+    """读取目录下保存的详情页(*.html)"""
+    pages = {}
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(('.html', '.htm')):
+            with open(os.path.join(directory, name), 'r', encoding='utf-8', errors='replace') as f:
+                pages[name] = f.read()
+    return pages
+
+
+def bench_extract(args):
+    """对比快速提取器与BeautifulSoup的耗时（结果一致性见tests/test_extractors.py）"""
+    pages = load_saved_pages(args.pages) if args.pages else sample_pages()
+    fast, soup = FastExtractor(), SoupExtractor()
+
+    fallback = [name for name, html in pages.items() if fast.extract(html) is None]
+    if fallback:
+        print(f"快速提取未找到标记（将回退到BeautifulSoup）: {', '.join(fallback)}")
+
+    for extractor in (soup, fast):
+        start = time.perf_counter()
+        for _ in range(args.rounds):
+            for html in pages.values():
+                extractor.extract(html)
+        elapsed = time.perf_counter() - start
+        per_page = elapsed / (args.rounds * len(pages)) * 1000
+        print(f"{extractor.name:<5} 平均 {per_page:8.3f} ms/页")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地基准测试")
+    parser.add_argument('--rate', type=float, default=100.0, help="模拟站点的每秒请求上限（共享限速器）")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    refresh = sub.add_parser('refresh', help="订阅刷新: 顺序 vs 并发")
+    refresh.add_argument('--subs', type=int, default=9)
+    refresh.add_argument('--latency', type=float, default=0.3)
+    refresh.add_argument('--workers', type=int, default=8)
+    refresh.set_defaults(func=bench_refresh)
+
+    conditional = sub.add_parser('conditional', help="条件请求缓存: 两轮刷新流量对比")
+    conditional.add_argument('--subs', type=int, default=9)
+    conditional.add_argument('--latency', type=float, default=0.3)
+    conditional.set_defaults(func=bench_conditional)
+
+    extract = sub.add_parser('extract', help="页面提取: 快速提取与BeautifulSoup的耗时对比")
+    extract.add_argument('--pages', help="保存的详情页目录，缺省时使用生成的样本页")
+    extract.add_argument('--rounds', type=int, default=20)
+    extract.set_defaults(func=bench_extract)
+
+    links = sub.add_parser('links', help="链接检查: 整个片库的检查耗时")
+    links.add_argument('--episodes', type=int, default=1229)
+    links.add_argument('--latency', type=float, default=0.05)
+    links.add_argument('--workers', type=int, default=32)
+    links.set_defaults(func=bench_links)
+
+    proxy = sub.add_parser('proxy', help="缓存代理: 直连/首次/重看的分片等待时间")
+    proxy.add_argument('--segments', type=int, default=20)
+    proxy.add_argument('--latency', type=float, default=0.3)
+    proxy.add_argument('--segment-time', type=float, default=0.2, help="模拟每个分片的播放时长（秒）")
+    proxy.add_argument('--prefetch', type=int, default=5)
+    proxy.set_defaults(func=bench_proxy)
+
+    next_episode = sub.add_parser('next', help="下一集预取: 未预取/已预取的起播耗时")
+    next_episode.add_argument('--latency', type=float, default=0.3)
+    next_episode.add_argument('--intro', type=float, default=90, help="片头时长（秒）")
+    next_episode.add_argument('--seconds', type=float, default=30, help="预取片头之后的秒数")
+    next_episode.add_argument('--kbps', type=float, default=8192, help="预取限速（KB/s）")
+    next_episode.set_defaults(func=bench_next)
+
+    abr = sub.add_parser('abr', help="码率选择: 模拟序列校验与分片边界切换")
+    abr.add_argument('--latency', type=float, default=0.05)
+    abr.add_argument('--segments', type=int, default=10)
+    abr.add_argument('--switch-at', type=int, default=4, help="在第几个分片前切换到低码率")
+    abr.set_defaults(func=bench_abr)
+
+    bandwidth = sub.add_parser('bandwidth', help="速度估计: 采样耗时与回放MediaStats序列")
+    bandwidth.add_argument('--trace', help="[[时间秒, read_bytes], ...] 格式的JSON文件")
+    bandwidth.set_defaults(func=bench_bandwidth)
+
+    window = sub.add_parser('window', help="播放窗口: 打开耗时与内存（需要libvlc）")
+    window.add_argument('--cycles', type=int, default=50)
+    window.add_argument('--media', help="播放地址，默认使用本地模拟CDN")
+    window.add_argument('--no-pool', action='store_true', help="对照组：每个窗口新建VLC实例")
+    window.set_defaults(func=bench_window)
+
+    origin = sub.add_parser('origin', help="模拟源站: 按场景测试缓冲与恢复")
+    origin.add_argument('--scenario', action='append', help=f"内置场景（{', '.join(SCENARIOS)}）或JSON文件，可重复")
+    origin.set_defaults(func=bench_origin)
+
+    download = sub.add_parser('download', help="离线下载: 并发加速、续传和完整性校验")
+    download.add_argument('--episodes', type=int, default=3)
+    download.add_argument('--workers', type=int, default=6)
+    download.add_argument('--scenario', default='jitter', help="下载时使用的源站场景")
+    download.set_defaults(func=bench_download)
+
+    crypto = sub.add_parser('crypto', help="AES-128: 解密吞吐量、加密剧集下载和密钥读取耗时（需要cryptography）")
+    crypto.add_argument('--segments', type=int, default=20)
+    crypto.add_argument('--rotate', type=int, default=8, help="每隔几个分片换一个密钥")
+    crypto.add_argument('--workers', type=int, default=6)
+    crypto.set_defaults(func=bench_crypto)
+
+    cache = sub.add_parser('cache', help="缓存配额: 后台淘汰、按观看进度淘汰和索引重建")
+    cache.add_argument('--episodes', type=int, default=10)
+    cache.add_argument('--quota-mb', type=int, default=6)
+    cache.set_defaults(func=bench_cache)
+
+    player = sub.add_parser('player', help="无界面播放窗口: 起播/跳转/切集/恢复耗时（需要libvlc）")
+    player.add_argument('--scenario', action='append', help=f"内置场景（{', '.join(SCENARIOS)}）或JSON文件，可重复")
+    player.add_argument('--media-dir', help="TS分片目录，默认用ffmpeg生成")
+    player.add_argument('--seconds', type=int, default=60, help="生成测试分片的总时长")
+    player.add_argument('--intro', type=int, default=3, help="片头秒数")
+    player.add_argument('--timeout', type=float, default=20, help="每个步骤的等待上限（秒）")
+    player.add_argument('--report', help="JSON报告输出路径")
+    player.set_defaults(func=bench_player)
+
+    args = parser.parse_args()
+    # 在创建任何爬虫之前配置共享限速器，避免默认速率掩盖并发效果
+    get_rate_limiter(rate=args.rate, burst=max(1, int(args.rate)))
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,339 @@
+"""磁盘缓存配额与按观看进度淘汰
+
+CacheStore记录一个缓存目录中各条目（分片文件或整集下载）的大小、最后访问时间和所属剧集，
+索引保存在index.json中，启动时读取索引即可使用，目录由后台线程扫描核对（上次退出前没来得及
+写入索引的条目在此接管）。总大小超过配额时由后台线程分批淘汰：
+先淘汰已看完的剧集（按play_history.json中的播放位置判断），再按最近最少使用淘汰；
+任何播放窗口中正在打开的剧集都不会被淘汰。
+"""
+import json
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 正在播放窗口中打开的剧集URL及打开次数（同一集可能在多个窗口中打开）
+_open_episodes: Dict[str, int] = {}
+_open_lock = threading.Lock()
+
+
+def pin_episode(url: str):
+    """标记剧集正在播放，淘汰时跳过"""
+    if not url:
+        return
+    with _open_lock:
+        _open_episodes[url] = _open_episodes.get(url, 0) + 1
+
+
+def unpin_episode(url: str):
+    if not url:
+        return
+    with _open_lock:
+        count = _open_episodes.get(url, 0) - 1
+        if count > 0:
+            _open_episodes[url] = count
+        else:
+            _open_episodes.pop(url, None)
+
+
+def is_pinned(url: Optional[str]) -> bool:
+    with _open_lock:
+        return bool(url) and url in _open_episodes
+
+
+class WatchHistory:
+    """从play_history.json判断剧集是否已看完，文件修改后重新读取
+
+    播放记录中的current_time达到total_time的watched_fraction即视为看完（跳过片尾时记录的是
+    片尾开始位置，所以不要求播放到最后一秒）。记录带有url时按url匹配，旧记录按剧集标题匹配。
+    """
+
+    def __init__(self, history_file: str = 'play_history.json', watched_fraction: float = 0.9):
+        self.history_file = history_file
+        self.watched_fraction = watched_fraction
+        self._mtime = None
+        self._urls: set = set()
+        self._titles: set = set()
+        self._lock = threading.Lock()
+
+    def _reload(self):
+        try:
+            mtime = os.path.getmtime(self.history_file)
+        except OSError:
+            mtime = None
+        if mtime == self._mtime:
+            return
+        urls, titles = set(), set()
+        try:
+            with open(self.history_file, 'r', encoding='utf-8') as f:
+                history = json.load(f)
+            for series_title, series_data in history.items():
+                if not isinstance(series_data, dict):
+                    continue
+                for record in series_data.get('play_history', []):
+                    total = record.get('total_time') or 0
+                    if total <= 0 or (record.get('current_time') or 0) < total * self.watched_fraction:
+                        continue
+                    if record.get('url'):
+                        urls.add(record['url'])
+                    titles.add((series_title, record.get('episode_title', '')))
+        except (OSError, ValueError, AttributeError) as e:
+            if mtime is not None:
+                logger.warning(f"读取播放记录失败: {str(e)}")
+        self._urls, self._titles, self._mtime = urls, titles, mtime
+
+    def is_watched(self, url: str = '', series: str = '', episode: str = '') -> bool:
+        with self._lock:
+            self._reload()
+            if url and url in self._urls:
+                return True
+            # 播放记录以剧集标题（或单集标题）为键
+            return bool(episode) and ((series, episode) in self._titles or (episode, episode) in self._titles)
+
+
+class CacheStore:
+    """带配额的缓存索引
+
+    条目以key区分（分片缓存用文件名，下载目录用剧集URL），记录size、last_access和
+    url/series/episode。淘汰时调用on_evict(key)删除实际文件，删除失败的条目同样移出索引。
+    max_bytes为0时只记录不淘汰。
+
+    参数:
+        scan: 每次启动时在后台调用一次，返回磁盘上已有的条目(key, size, last_access, 剧集信息)；
+              索引中没有的条目被接管，索引中有但磁盘上已不存在的条目被移除
+    """
+
+    def __init__(self, index_file: str, max_bytes: int, on_evict: Callable[[str], None],
+                 history: Optional[WatchHistory] = None, low_watermark: float = 0.9, batch_size: int = 20,
+                 scan: Optional[Callable[[], Iterable[Tuple[str, int, float, Dict]]]] = None):
+        self.index_file = index_file
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self.history = history or WatchHistory()
+        self.low_watermark = low_watermark
+        self.batch_size = batch_size
+        self.total_bytes = 0
+        self._entries: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._dirty = False
+        self._stopped = False
+        self._thread: Optional[threading.Thread] = None
+        self._scan = scan
+        # 后台核对完成（没有scan时启动后立即完成）
+        self.reconciled = threading.Event()
+        self._created = time.time()
+        self.stats = {'evicted': 0, 'evicted_watched': 0, 'evicted_bytes': 0, 'skipped_open': 0, 'passes': 0}
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+            if isinstance(entries, dict):
+                self._entries = entries
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取缓存索引失败，将重新建立: {str(e)}")
+        self.total_bytes = sum(entry.get('size', 0) for entry in self._entries.values())
+
+    def save(self):
+        """保存索引（只在有改动时写入）"""
+        with self._lock:
+            if not self._dirty:
+                return
+            entries = json.loads(json.dumps(self._entries))
+            self._dirty = False
+        temp_file = f"{self.index_file}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.index_file) or '.', exist_ok=True)
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(entries, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(temp_file, self.index_file)
+        except Exception as e:
+            logger.error(f"保存缓存索引失败: {str(e)}")
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def record(self, key: str, size: int, url: str = '', series: str = '', episode: str = '',
+               last_access: Optional[float] = None):
+        """添加或更新条目；超过配额时唤醒后台淘汰"""
+        with self._lock:
+            old = self._entries.get(key)
+            if old is not None:
+                self.total_bytes -= old.get('size', 0)
+                # 同一文件的剧集信息未知时保留原来的
+                url = url or old.get('url', '')
+                series = series or old.get('series', '')
+                episode = episode or old.get('episode', '')
+            self._entries[key] = {'size': size, 'last_access': last_access or time.time(),
+                                  'url': url, 'series': series, 'episode': episode}
+            self.total_bytes += size
+            self._dirty = True
+            over = self.max_bytes and self.total_bytes > self.max_bytes
+        if over:
+            self._wake.set()
+
+    def touch(self, key: str):
+        """更新最后访问时间"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry['last_access'] = time.time()
+                self._dirty = True
+
+    def discard(self, key: str) -> Optional[Dict]:
+        """从索引中移除条目（不删除文件）"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.total_bytes -= entry.get('size', 0)
+                self._dirty = True
+            return entry
+
+    def episode_bytes(self) -> Dict[str, int]:
+        """按剧集URL汇总的缓存字节数"""
+        totals: Dict[str, int] = {}
+        with self._lock:
+            for entry in self._entries.values():
+                totals[entry.get('url', '')] = totals.get(entry.get('url', ''), 0) + entry.get('size', 0)
+        return totals
+
+    def eviction_order(self) -> List[str]:
+        """淘汰顺序：已看完的剧集在前，其余按最后访问时间从早到晚；正在播放的剧集不在列表中"""
+        with self._lock:
+            entries = [(key, dict(entry)) for key, entry in self._entries.items()]
+        watched_cache: Dict[Tuple[str, str, str], bool] = {}
+        candidates = []
+        for key, entry in entries:
+            if is_pinned(entry.get('url')):
+                continue
+            identity = (entry.get('url', ''), entry.get('series', ''), entry.get('episode', ''))
+            if identity not in watched_cache:
+                watched_cache[identity] = any(identity) and self.history.is_watched(*identity)
+            candidates.append((not watched_cache[identity], entry.get('last_access', 0), key))
+        candidates.sort()
+        return [key for _, _, key in candidates]
+
+    def evict(self, target_bytes: Optional[int] = None, max_entries: Optional[int] = None,
+              order: Optional[Iterable[str]] = None) -> int:
+        """淘汰到total_bytes不超过target_bytes（默认配额的low_watermark），返回释放的字节数
+
+        max_entries限制本次最多淘汰的条目数；后台线程传入同一个order迭代器分批调用，
+        整轮淘汰只排序一次。
+        """
+        if not self.max_bytes:
+            return 0
+        target = int(self.max_bytes * self.low_watermark) if target_bytes is None else target_bytes
+        freed = 0
+        evicted = 0
+        if self.total_bytes <= target:
+            return 0
+        # 达到目标后立即停止，不从order中多取一个条目（后台线程下一批还要接着用）
+        for key in self.eviction_order() if order is None else order:
+            with self._lock:
+                entry = self._entries.get(key)
+            # 排序之后剧集可能已被打开
+            if entry is None or is_pinned(entry.get('url')):
+                with self._lock:
+                    self.stats['skipped_open'] += entry is not None
+                continue
+            watched = self.history.is_watched(entry.get('url', ''), entry.get('series', ''), entry.get('episode', ''))
+            # 先移出索引再删除文件，on_evict中再调用discard也不会重复计算
+            if self.discard(key) is None:
+                continue
+            try:
+                self.on_evict(key)
+            except Exception as e:
+                logger.warning(f"删除缓存条目失败 {key}: {str(e)}")
+            freed += entry.get('size', 0)
+            evicted += 1
+            with self._lock:
+                self.stats['evicted'] += 1
+                self.stats['evicted_watched'] += watched
+                self.stats['evicted_bytes'] += entry.get('size', 0)
+            if self.total_bytes <= target or (max_entries is not None and evicted >= max_entries):
+                break
+        return freed
+
+    def start(self, interval: float = 30, pause: float = 0.05):
+        """启动后台线程：超过配额或每隔interval秒检查一次，每批淘汰batch_size个条目后暂停pause秒"""
+        if self._thread is not None:
+            return
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, args=(interval, pause), name='cache-evict', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.save()
+
+    def _reconcile(self):
+        """核对索引与磁盘：接管索引中没有的条目，移除文件已不存在的条目"""
+        try:
+            if self._scan is None:
+                return
+            seen = set()
+            adopted = 0
+            try:
+                for key, size, last_access, identity in self._scan():
+                    if self._stopped:
+                        return
+                    seen.add(key)
+                    # 启动之后写入的条目已经由record()记录，扫描到的信息可能已过时
+                    if last_access < self._created and key not in self:
+                        self.record(key, size, last_access=last_access, **identity)
+                        adopted += 1
+            except Exception as e:
+                logger.error(f"核对缓存索引失败: {str(e)}")
+                return
+            # 启动之后写入或访问过的条目可能在扫描开始后才写到磁盘
+            with self._lock:
+                missing = [key for key, entry in self._entries.items()
+                           if key not in seen and entry.get('last_access', 0) < self._created]
+            for key in missing:
+                self.discard(key)
+            if adopted or missing:
+                logger.info(f"缓存索引已核对: {self.index_file} 接管 {adopted} 个未记录的条目，"
+                            f"移除 {len(missing)} 个已不存在的条目")
+            self.save()
+        finally:
+            self.reconciled.set()
+
+    def _run(self, interval: float, pause: float):
+        self._reconcile()
+        while not self._stopped:
+            self._wake.wait(interval)
+            self._wake.clear()
+            if self._stopped:
+                break
+            if self.max_bytes and self.total_bytes > self.max_bytes:
+                with self._lock:
+                    self.stats['passes'] += 1
+                before = self.total_bytes
+                order = iter(self.eviction_order())
+                while not self._stopped and self.evict(max_entries=self.batch_size, order=order):
+                    time.sleep(pause)
+                logger.info(f"缓存淘汰完成: {self.index_file} 释放 {(before - self.total_bytes) / 1024 / 1024:.1f}MB，"
+                            f"当前 {self.total_bytes / 1024 / 1024:.1f}MB")
+            self.save()
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return dict(self.stats, entries=len(self._entries), bytes=self.total_bytes, max_bytes=self.max_bytes)
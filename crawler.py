@@ -1,14 +1,36 @@
 import requests
-from bs4 import BeautifulSoup
+import codecs
 import json
-import time
 import random
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+from episode_feed import ChangeFeed, EpisodeIndex, is_empty_diff
+from extractors import SoupExtractor, get_extractor
+from http_cache import ValidatorCache
+from http_client import get_client_stats, get_session
+from rate_limiter import get_rate_limiter
+from update_scheduler import UpdateScheduler
+
+# fetch_page在条件请求命中（304或内容哈希未变）时返回的标记
+NOT_MODIFIED = object()
+
+
+def load_update_settings(settings_file: str = 'settings.json') -> Dict:
+    """读取settings.json中的update_settings，文件缺失或损坏时返回空字典"""
+    try:
+        with open(settings_file, 'r', encoding='utf-8') as f:
+            return json.load(f).get('update_settings', {}) or {}
+    except (OSError, ValueError, AttributeError):
+        return {}
+
 
 class VideoCrawler:
-    def __init__(self):
+    def __init__(self, max_workers: Optional[int] = None, per_host_limit: Optional[int] = None):
         # 设置日志
         logging.basicConfig(
             level=logging.INFO,
@@ -23,11 +45,43 @@ class VideoCrawler:
             'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:121.0) Gecko/20100101 Firefox/121.0'
         ]
 
-        # 请求配置
-        self.session = requests.Session()
+        # 请求配置（使用进程共享的Session，复用连接池和DNS缓存）
+        self.session = get_session()
         self.timeout = 10
         self.max_retries = 3
-        self.retry_delay = 2
+        self.stream_chunk_size = 16 * 1024
+        # 提前结束时剩余内容不超过该字节数则读完，让连接回到连接池复用
+        self.stream_drain_limit = 16 * 1024
+
+        # 并发刷新配置（参数优先，其次settings.json，最后使用默认值）
+        update_settings = load_update_settings()
+        self.max_workers = max_workers or update_settings.get('max_workers', 8)
+        self.per_host_limit = per_host_limit or update_settings.get('per_host_limit', 4)
+        self.subscriptions_file = 'subscriptions.json'
+        self._host_semaphores: Dict[str, threading.BoundedSemaphore] = {}
+        self._host_lock = threading.Lock()
+
+        # 进程共享的按主机限速器（令牌桶 + 退避）
+        self.rate_limiter = get_rate_limiter(
+            rate=update_settings.get('requests_per_second', 4.0),
+            burst=update_settings.get('request_burst', 4)
+        )
+
+        # 条件请求校验缓存
+        self.validator_cache = ValidatorCache()
+        # 已下载但尚未应用的页面校验信息，订阅保存成功后才提交
+        self._pending_validators: Dict[str, Dict] = {}
+        self._pending_lock = threading.Lock()
+
+        # 页面提取器（快速提取失败时回退到BeautifulSoup）
+        self.extractor = get_extractor(update_settings.get('extractor', 'fast'))
+        self.fallback_extractor = SoupExtractor()
+
+        # 剧集变更记录
+        self.change_feed = ChangeFeed()
+
+        # 按订阅自适应安排检查时间
+        self.scheduler = UpdateScheduler(base_interval_hours=update_settings.get('check_interval_hours', 6))
 
     def _get_random_headers(self) -> Dict[str, str]:
         """生成随机请求头"""
@@ -40,83 +94,164 @@ class VideoCrawler:
             'Upgrade-Insecure-Requests': '1'
         }
 
-    def fetch_page(self, url: str) -> Optional[str]:
-        """获取页面内容，带重试机制"""
+    def fetch_page(self, url: str, conditional: bool = False, stream: bool = False):
+        """获取页面内容，带重试机制
+
+        参数:
+            url: 页面地址
+            conditional: 是否发送条件请求；页面未变化时返回NOT_MODIFIED。页面有变化时校验信息暂存，
+                         由commit_validators在更新应用后保存
+            stream: 是否流式读取；提取所需内容已到齐时提前断开连接
+        """
+        headers = self._get_random_headers()
+        if conditional:
+            headers.update(self.validator_cache.conditional_headers(url))
+
         for attempt in range(self.max_retries):
+            # 等待限速器放行（退避期间也在这里等待）
+            self.rate_limiter.acquire(url)
             try:
-                response = self.session.get(
+                with self.session.get(
                     url,
-                    headers=self._get_random_headers(),
-                    timeout=self.timeout
-                )
-                response.raise_for_status()
-                return response.text
+                    headers=headers,
+                    timeout=self.timeout,
+                    stream=stream
+                ) as response:
+                    if response.status_code in (429, 503):
+                        _ = response.content
+                        delay = self.rate_limiter.on_throttled(url, response.headers.get('Retry-After'))
+                        self.logger.warning(f"第 {attempt + 1} 次请求被限流({response.status_code})，{delay:.1f}s后重试")
+                        continue
+                    if conditional and response.status_code == 304:
+                        # 读完空响应体，连接才能回到连接池
+                        _ = response.content
+                        self.rate_limiter.on_success(url)
+                        self.validator_cache.record_not_modified(url)
+                        return NOT_MODIFIED
+                    response.raise_for_status()
+                    html = self._read_streaming(url, response) if stream else response.text
+                self.rate_limiter.on_success(url)
+                if conditional:
+                    entry = self.validator_cache.build_entry(response.headers, html)
+                    if self.validator_cache.is_unchanged(url, entry):
+                        # 内容已经应用过，只更新ETag等校验信息
+                        self.validator_cache.commit(url, entry)
+                        return NOT_MODIFIED
+                    with self._pending_lock:
+                        self._pending_validators[url] = entry
+                return html
             except requests.RequestException as e:
                 self.logger.warning(f"第 {attempt + 1} 次请求失败: {str(e)}")
                 if attempt < self.max_retries - 1:
-                    time.sleep(self.retry_delay * (attempt + 1))
+                    self.rate_limiter.on_error(url)
                 continue
         return None
 
+    def _read_streaming(self, url: str, response) -> str:
+        """分块读取响应，提取器判定内容已完整时停止读取"""
+        is_complete = getattr(self.extractor, 'is_complete', None)
+        decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8')(errors='replace')
+        html = ''
+        early_exit = False
+
+        for chunk in response.iter_content(chunk_size=self.stream_chunk_size):
+            html += decoder.decode(chunk)
+            if is_complete and is_complete(html):
+                early_exit = True
+                break
+        if not early_exit:
+            html += decoder.decode(b'', final=True)
+        elif int(response.headers.get('Content-Length') or 0) - response.raw.tell() <= self.stream_drain_limit:
+            # 剩余内容很少，读完比断开后重新握手更划算
+            for _ in response.iter_content(chunk_size=self.stream_chunk_size):
+                pass
+            early_exit = False
+
+        # 统计实际传输字节数（压缩后），与Content-Length比较得到节省量
+        transferred = response.raw.tell() if hasattr(response.raw, 'tell') else len(html.encode('utf-8'))
+        total = int(response.headers.get('Content-Length') or 0)
+        if early_exit and total:
+            self.logger.info(f"提前结束下载 {url}: 读取 {transferred} / {total} 字节，节省 {total - transferred} 字节")
+        elif early_exit:
+            self.logger.info(f"提前结束下载 {url}: 读取 {transferred} 字节（总大小未知）")
+        else:
+            self.logger.info(f"完整下载 {url}: {transferred} 字节")
+        return html
+
     def parse_video_info(self, html: str) -> Dict:
         """解析视频页面信息"""
         try:
-            soup = BeautifulSoup(html, 'html.parser')
-
-            # 提取剧名和更新状态
-            title_elem = soup.select_one('.content__detail h1.title')
-            if title_elem:
-                # 获取主标题（第一个文本节点）
-                title = next(title_elem.stripped_strings)
-                # 获取更新状态（small标签）
-                status_elem = title_elem.select_one('small')
-                update_status = status_elem.text.strip() if status_elem else ""
-            else:
-                title = "未知剧名"
-                update_status = ""
-
-            # 提取更新时间
-            update_time_elem = soup.select_one('.text-light')
-            if update_time_elem:
-                update_time = update_time_elem.text.replace('更新时间：', '').strip()
-            else:
-                update_time = datetime.now().strftime("%Y-%m-%d")
-
-            # 提取图片地址
-            image_elem = soup.select_one('.content__thumb .thumb img')
-            image_url = image_elem['src'] if image_elem else ""
-
-            # 提取剧集列表
-            episodes = []
-            episode_list = soup.select('.content__playlist li a')
-            for ep in episode_list:
-                # 解析形如 "第01集$https://play.modujx10.com/xxx/index.m3u8" 的文本
-                parts = ep.text.strip().split('$')
-                if len(parts) == 2:
-                    episodes.append({
-                        'title': parts[0].strip(),
-                        'url': parts[1].strip()
-                    })
+            info = None
+            if self.extractor is not None:
+                try:
+                    info = self.extractor.extract(html)
+                except Exception as e:
+                    self.logger.debug(f"快速提取出错: {str(e)}")
+                if info is None:
+                    self.logger.debug("快速提取未找到页面标记，回退到BeautifulSoup解析")
 
-            return {
-                'title': title,
-                'update_status': update_status,
-                'update_time': update_time,
-                'image_url': image_url,
-                'episodes': episodes,
-                'total_episodes': len(episodes)
-            }
+            return info or self.fallback_extractor.extract(html)
         except Exception as e:
             self.logger.error(f"解析页面失败: {str(e)}")
             return {
                 'title': "解析失败",
                 'update_time': datetime.now().strftime("%Y-%m-%d"),
                 'episodes': [],
-                'total_episodes': 0
+                'total_episodes': 0,
+                'parse_failed': True
             }
 
-    def update_subscriptions(self):
-        """更新所有订阅信息"""
+    def _host_semaphore(self, url: str) -> threading.BoundedSemaphore:
+        """获取目标主机的并发信号量，限制同一主机的同时请求数"""
+        host = urlparse(url).netloc
+        with self._host_lock:
+            if host not in self._host_semaphores:
+                self._host_semaphores[host] = threading.BoundedSemaphore(self.per_host_limit)
+            return self._host_semaphores[host]
+
+    def _refresh_one(self, sub: Dict):
+        """抓取并解析单个订阅页面
+
+        返回:
+            解析结果；页面未变化时返回NOT_MODIFIED；失败时返回None
+        """
+        url = sub['url']
+        try:
+            # 没有剧集数据时丢弃旧校验信息，避免空订阅被缓存短路
+            if not sub.get('episodes'):
+                self.validator_cache.invalidate(url)
+            with self._host_semaphore(url):
+                html = self.fetch_page(url, conditional=True, stream=True)
+            if html is NOT_MODIFIED:
+                return NOT_MODIFIED
+            if not html:
+                return None
+            return self.parse_video_info(html)
+        except Exception as e:
+            self.logger.error(f"刷新订阅失败 {url}: {str(e)}")
+            return None
+
+    def commit_validators(self, urls):
+        """保存已成功应用的页面的校验信息；未提交的页面下次仍会完整下载和解析"""
+        with self._pending_lock:
+            entries = [(url, self._pending_validators.pop(url)) for url in urls if url in self._pending_validators]
+        for url, entry in entries:
+            self.validator_cache.commit(url, entry)
+
+    def _refresh_all(self, subs: List[Dict]) -> List:
+        """并发抓取多个订阅，返回结果与输入顺序一致"""
+        if self.max_workers <= 1 or len(subs) <= 1:
+            return [self._refresh_one(sub) for sub in subs]
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(subs))) as executor:
+            return list(executor.map(self._refresh_one, subs))
+
+    def update_subscriptions(self, force: bool = False):
+        """更新到期的订阅信息（并发抓取，按原顺序合并结果）
+
+        参数:
+            force: 忽略检查计划，刷新全部订阅
+        """
         result = {
             "has_updates": False,
             "updated_subscriptions": {}
@@ -124,58 +259,89 @@ class VideoCrawler:
         
         try:
             # 读取订阅配置
-            with open('subscriptions.json', 'r', encoding='utf-8') as f:
+            with open(self.subscriptions_file, 'r', encoding='utf-8') as f:
                 data = json.load(f)
 
-            # 记录原始剧集数用于比较
-            original_counts = {sub['title']: len(sub['episodes']) for sub in data['subscriptions']}
-
-            # 更新每个订阅
+            # 由调度器挑选到期的订阅，保持文件中的原始顺序
+            due_ids = {id(sub) for sub in self.scheduler.due(data['subscriptions'], force=force)}
+            pending = []
             for sub in data['subscriptions']:
-                # 检查最后更新时间是否在1小时内
-                try:
-                    last_check_time = datetime.strptime(sub['last_check'], "%Y-%m-%d %H:%M:%S")
-                    time_diff = datetime.now() - last_check_time
-                    if time_diff.total_seconds() < 3600:  # 3600秒 = 1小时
-                        self.logger.info(f"跳过更新 {sub['title']}: 距离上次更新不足1小时")
-                        continue
-                except (ValueError, KeyError):
-                    # 如果last_check不存在或格式错误,继续更新
-                    pass
+                if id(sub) not in due_ids:
+                    self.logger.info(f"跳过更新 {sub['title']}: 下次检查 {self.scheduler.describe(sub['url']).get('next_check')}")
+                    continue
                 self.logger.info(f"正在更新: {sub['url']}")
+                pending.append(sub)
+
+            # 并发抓取并解析
+            infos = self._refresh_all(pending)
+
+            # 按原顺序合并结果
+            changed = False
+            for sub, info in zip(pending, infos):
                 sub_result = {"has_update": False}
 
-                # 获取页面内容
-                html = self.fetch_page(sub['url'])
-                if not html:
+                if info is NOT_MODIFIED:
+                    # 页面未变化，不重新解析也不改写剧集
+                    self.logger.info(f"页面未变化: {sub['title']}")
+                    self.scheduler.record(sub, False, sub.get('update_status', ''))
                     result["updated_subscriptions"][sub['title']] = sub_result
                     continue
 
-                # 解析信息
-                info = self.parse_video_info(html)
+                if not info or info.get('parse_failed'):
+                    self.scheduler.record_failure(sub)
+                    result["updated_subscriptions"][sub['title']] = sub_result
+                    continue
+
+                # 按URL比较剧集差异
+                diff = EpisodeIndex(sub.get('episodes', [])).diff(info['episodes'])
+                metadata_changed = (sub.get('title') != info['title']
+                                    or sub.get('update_time') != info['update_time']
+                                    or sub.get('update_status') != info.get('update_status', ''))
+                self.scheduler.record(sub, bool(diff['added']), info.get('update_status', ''))
 
-                # 检查是否有新剧集
-                new_count = len(info['episodes'])
-                old_count = original_counts.get(sub['title'], 0)
-                has_update = new_count > old_count
+                if not is_empty_diff(diff) or metadata_changed:
+                    changed = True
+                    sub['last_check'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                    sub['title'] = info['title']
+                    sub['update_time'] = info['update_time']
+                    sub['update_status'] = info.get('update_status', '')
+                    sub['episodes'] = info['episodes']
+                    sub['total_episodes'] = info['total_episodes']
 
-                # 更新订阅信息
-                sub['last_check'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                sub['title'] = info['title']
-                sub['update_time'] = info['update_time']
-                sub['episodes'] = info['episodes']
-                sub['total_episodes'] = info['total_episodes']
+                if not is_empty_diff(diff):
+                    self.change_feed.append(sub['url'], sub['title'], diff)
+                    self.logger.info(
+                        f"剧集变化 {sub['title']}: 新增{len(diff['added'])} "
+                        f"下架{len(diff['removed'])} 改名{len(diff['retitled'])}"
+                    )
 
                 # 记录更新结果
+                has_update = bool(diff['added'])
                 sub_result["has_update"] = has_update
                 if has_update:
-                    sub_result["new_episodes"] = new_count - old_count
+                    sub_result["new_episodes"] = len(diff['added'])
                     result["has_updates"] = True
                 result["updated_subscriptions"][sub['title']] = sub_result
 
-            # 保存更新后的配置
-            with open('subscriptions.json', 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=4)
+            # 仅在有变化时保存更新后的配置
+            if changed:
+                with open(self.subscriptions_file, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False, indent=4)
+            else:
+                self.logger.info("订阅内容无变化，跳过写入")
+
+            # 订阅已保存，提交成功解析的页面的校验信息
+            self.commit_validators(sub['url'] for sub, info in zip(pending, infos)
+                                   if info and info is not NOT_MODIFIED and not info.get('parse_failed'))
+            with self._pending_lock:
+                self._pending_validators.clear()
+
+            # 保存调度计划、校验缓存并输出统计
+            self.scheduler.save()
+            self.validator_cache.save()
+            self.logger.info(f"条件请求统计: {self.validator_cache.get_stats()}")
+            self.logger.info(f"限速器状态: {self.rate_limiter.get_metrics()}")
+            self.logger.info(f"连接复用统计: {get_client_stats()}")
 
             return result
         except Exception as e:
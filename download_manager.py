@@ -0,0 +1,490 @@
+"""离线下载管理
+
+把剧集的HLS分片下载到本地，供没有网络时播放。每集一个目录（以剧集URL的SHA1命名），
+目录中保存分片、初始化分片、下载清单manifest.json和本地播放列表index.m3u8。
+AES-128加密的剧集在下载时边接收边解密，保存明文分片，不在磁盘上保存密钥；
+无法在本地解密时（未安装cryptography或其他加密方式）保存密文和密钥文件，由播放器解密。
+
+清单记录每个分片的远程地址、本地文件名和已校验的字节数，中断后重新加入队列时只下载
+缺失或大小不符的分片。全部分片校验通过后才写出index.m3u8，播放器只在它存在时使用本地文件。
+下载完成的剧集记录在CacheStore索引（downloads/index.json）中，设置了配额时按观看进度和最近播放时间淘汰。
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urlparse
+
+from bandwidth import BandwidthEstimator
+from cache_store import CacheStore
+from hls import get_hls_resolver, segment_url
+from hls_crypto import SegmentDecryptor, can_decrypt, get_key_cache, segment_iv
+from hls_proxy import load_playback_settings
+from http_client import get_session
+
+logger = logging.getLogger(__name__)
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# 下载状态
+STATUS_QUEUED = 'queued'
+STATUS_DOWNLOADING = 'downloading'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+STATUS_CANCELLED = 'cancelled'
+
+MANIFEST_NAME = 'manifest.json'
+PLAYLIST_NAME = 'index.m3u8'
+
+
+class DownloadCancelled(Exception):
+    """下载任务已取消"""
+
+
+class DownloadTask:
+    """单集下载任务的进度"""
+
+    def __init__(self, url: str, series: str = '', title: str = ''):
+        self.url = url
+        self.series = series
+        self.title = title
+        self.status = STATUS_QUEUED
+        self.error = ''
+        self.total_segments = 0
+        self.done_segments = 0
+        self.bytes_downloaded = 0
+        self.cancelled = False
+
+    def to_dict(self) -> Dict:
+        return {
+            'url': self.url,
+            'series': self.series,
+            'title': self.title,
+            'status': self.status,
+            'error': self.error,
+            'total_segments': self.total_segments,
+            'done_segments': self.done_segments,
+            'bytes_downloaded': self.bytes_downloaded
+        }
+
+
+def _extension(url: str, default: str = '.ts') -> str:
+    ext = os.path.splitext(urlparse(url).path)[1].lower()
+    return ext if ext and len(ext) <= 5 else default
+
+
+class DownloadManager:
+    """剧集下载队列
+
+    剧集按加入顺序逐集下载，每集的分片在共享线程池中并发下载（workers个），同一时刻最多
+    workers个分片请求。Content-Length与实际字节数不符时重试该分片，重试retries次仍失败
+    则该集标记为失败，已下载的分片保留，下次加入队列时继续。
+    """
+
+    def __init__(self, download_dir: str = 'downloads', workers: int = 4, timeout: float = 15,
+                 retries: int = 3, max_bytes: int = 0):
+        self.download_dir = download_dir
+        self.workers = workers
+        self.timeout = timeout
+        self.retries = retries
+        self.session = get_session()
+        self.resolver = get_hls_resolver()
+        self.keys = get_key_cache()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='hls-download')
+        self._lock = threading.Lock()
+        self._queue: deque = deque()
+        self._tasks: Dict[str, DownloadTask] = {}
+        self._worker: Optional[threading.Thread] = None
+        self._local: Dict[str, Optional[str]] = {}
+        self._throughput = BandwidthEstimator(fast_half_life=3.0)
+        self._total_bytes = 0
+        # 已下载剧集的索引，max_bytes为0时不限制总大小
+        self.store = CacheStore(os.path.join(download_dir, 'index.json'), max_bytes, self.remove,
+                                batch_size=1, scan=self._scan_downloads)
+        self.store.start()
+
+    def episode_dir(self, url: str) -> str:
+        return os.path.join(self.download_dir, hashlib.sha1(url.encode('utf-8')).hexdigest())
+
+    def local_playlist(self, url: str) -> Optional[str]:
+        """已下载完成的剧集返回本地播放列表的绝对路径，否则返回None"""
+        with self._lock:
+            if url in self._local:
+                return self._local[url]
+        path = os.path.abspath(os.path.join(self.episode_dir(url), PLAYLIST_NAME))
+        path = path if os.path.exists(path) else None
+        with self._lock:
+            self._local[url] = path
+        return path
+
+    def touch(self, url: str):
+        """播放已下载的剧集时更新最后访问时间"""
+        self.store.touch(url)
+
+    def _scan_downloads(self):
+        """列出已下载完成的剧集供索引核对"""
+        if not os.path.isdir(self.download_dir):
+            return
+        with os.scandir(self.download_dir) as entries:
+            for entry in entries:
+                if not entry.is_dir():
+                    continue
+                manifest = self._load_manifest(entry.path)
+                playlist = os.path.join(entry.path, PLAYLIST_NAME)
+                if not manifest or not manifest.get('completed_at') or not os.path.exists(playlist):
+                    continue
+                files = manifest['segments'] + manifest['keys'] + ([manifest['map']] if manifest['map'] else [])
+                yield (manifest['url'], sum(item['size'] or 0 for item in files), os.path.getmtime(playlist),
+                       {'url': manifest['url'], 'series': manifest.get('series', ''),
+                        'episode': manifest.get('title', '')})
+
+    def enqueue_episode(self, url: str, series: str = '', title: str = '') -> DownloadTask:
+        """加入一集，已在队列中或正在下载时返回原任务"""
+        with self._lock:
+            task = self._tasks.get(url)
+            if task is not None and task.status in (STATUS_QUEUED, STATUS_DOWNLOADING):
+                return task
+            task = DownloadTask(url, series, title)
+            self._tasks[url] = task
+            self._queue.append(task)
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='download-queue', daemon=True)
+                self._worker.start()
+        return task
+
+    def enqueue_series(self, subscription: Dict) -> List[DownloadTask]:
+        """加入订阅的全部剧集，跳过已下载完成的"""
+        series = subscription.get('title', '')
+        return [self.enqueue_episode(episode['url'], series, episode.get('title', ''))
+                for episode in subscription.get('episodes', [])
+                if episode.get('url') and self.local_playlist(episode['url']) is None]
+
+    def cancel(self, url: Optional[str] = None):
+        """取消指定剧集，url为None时取消全部；已下载的分片保留"""
+        with self._lock:
+            tasks = [self._tasks[url]] if url in self._tasks else ([] if url else list(self._tasks.values()))
+            for task in tasks:
+                if task.status in (STATUS_QUEUED, STATUS_DOWNLOADING):
+                    task.cancelled = True
+                    if task.status == STATUS_QUEUED:
+                        task.status = STATUS_CANCELLED
+
+    def remove(self, url: str):
+        """删除已下载的剧集"""
+        self.cancel(url)
+        directory = self.episode_dir(url)
+        if os.path.isdir(directory):
+            for name in os.listdir(directory):
+                try:
+                    os.remove(os.path.join(directory, name))
+                except OSError as e:
+                    logger.warning(f"删除下载文件失败: {str(e)}")
+            try:
+                os.rmdir(directory)
+            except OSError:
+                pass
+        with self._lock:
+            self._local.pop(url, None)
+        self.store.discard(url)
+
+    def get_progress(self) -> Dict:
+        """汇总进度：各状态的集数、分片数、已下载字节和总体速度（KB/s）
+
+        在主线程定时调用，速度按两次调用之间新增的字节数计算。
+        """
+        with self._lock:
+            tasks = list(self._tasks.values())
+            total_bytes = self._total_bytes
+            self._throughput.add_bytes(total_bytes)
+        counts = {status: 0 for status in (STATUS_QUEUED, STATUS_DOWNLOADING, STATUS_DONE, STATUS_FAILED,
+                                           STATUS_CANCELLED)}
+        for task in tasks:
+            counts[task.status] += 1
+        active = [task for task in tasks if task.status in (STATUS_QUEUED, STATUS_DOWNLOADING)]
+        current = next((task for task in tasks if task.status == STATUS_DOWNLOADING), None)
+        return {
+            'episodes': counts,
+            'active': len(active),
+            'segments_done': sum(task.done_segments for task in tasks),
+            'segments_total': sum(task.total_segments for task in tasks),
+            'bytes': total_bytes,
+            'speed_kbs': self._throughput.estimate() if active else 0.0,
+            'current': current.to_dict() if current else None
+        }
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._queue:
+                    self._worker = None
+                    return
+                task = self._queue.popleft()
+                if task.cancelled:
+                    continue
+                task.status = STATUS_DOWNLOADING
+            try:
+                self.download(task)
+                task.status = STATUS_DONE
+            except DownloadCancelled:
+                task.status = STATUS_CANCELLED
+                logger.info(f"已取消下载: {task.series} {task.title}")
+            except Exception as e:
+                task.status = STATUS_FAILED
+                task.error = str(e)
+                logger.error(f"下载失败 {task.series} {task.title}: {str(e)}")
+
+    def _load_manifest(self, directory: str) -> Optional[Dict]:
+        try:
+            with open(os.path.join(directory, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save_manifest(self, directory: str, manifest: Dict):
+        path = os.path.join(directory, MANIFEST_NAME)
+        temp_file = path + '.tmp'
+        try:
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(temp_file, path)
+        except OSError as e:
+            logger.warning(f"保存下载清单失败: {str(e)}")
+
+    def _new_manifest(self, task: DownloadTask) -> Dict:
+        """按分片索引建立下载清单"""
+        index = self.resolver.resolve(task.url, raise_errors=True)
+        if not index['segments']:
+            raise ValueError("播放列表中没有分片")
+        if not index.get('endlist'):
+            logger.warning(f"{task.title} 不是已结束的点播列表，只下载当前已有的分片")
+
+        # 全部密钥都能在本地解密时保存明文，否则原样保存密文和密钥
+        decrypt = bool(index['keys']) and all(can_decrypt(key) for key in index['keys'])
+        media_sequence = index.get('media_sequence', 0)
+        segments = []
+        for i, (uri, duration, key) in enumerate(index['segments']):
+            url = segment_url(index, i)
+            segment = {'url': url, 'file': f"{i:05d}{_extension(url)}", 'duration': duration, 'key': key, 'size': None}
+            if decrypt and key is not None:
+                segment['key_url'] = index['keys'][key]['uri']
+                segment['iv'] = segment_iv(index['keys'][key], media_sequence + i).hex()
+            segments.append(segment)
+        keys = [] if decrypt else [
+            {'url': key['uri'], 'file': f"key{i}.key", 'method': key['method'], 'iv': key['iv'], 'size': None}
+            for i, key in enumerate(index['keys'])]
+        init = None
+        if index.get('map'):
+            init = {'url': index['map'], 'file': f"init{_extension(index['map'], '.mp4')}", 'size': None}
+        return {
+            'url': task.url,
+            'series': task.series,
+            'title': task.title,
+            'variant_url': index['variant_url'],
+            'target_duration': index['target_duration'],
+            # 保存密文时，未写IV的分片按媒体序号解密，本地播放列表需要沿用源站的起始序号
+            'media_sequence': media_sequence,
+            'segments': segments,
+            'keys': keys,
+            'decrypted': decrypt,
+            'map': init,
+            'created_at': datetime.now().strftime(TIME_FORMAT),
+            'completed_at': None
+        }
+
+    @staticmethod
+    def _verified(directory: str, entry: Dict) -> bool:
+        """清单中记录的大小与磁盘文件一致"""
+        if entry['size'] is None:
+            return False
+        try:
+            return os.path.getsize(os.path.join(directory, entry['file'])) == entry['size']
+        except OSError:
+            return False
+
+    def _stream_to_file(self, task: DownloadTask, entry: Dict, temp_file: str) -> int:
+        """分块接收并写入临时文件（需要时同时解密），校验接收的字节数，返回写入的字节数"""
+        decryptor = None
+        if entry.get('iv'):
+            decryptor = SegmentDecryptor(self.keys.get(entry['key_url']), bytes.fromhex(entry['iv']))
+        response = self.session.get(entry['url'], timeout=self.timeout, stream=True)
+        try:
+            response.raise_for_status()
+            received = written = 0
+            with open(temp_file, 'wb') as f:
+                for chunk in response.iter_content(64 * 1024):
+                    if task.cancelled:
+                        raise DownloadCancelled()
+                    received += len(chunk)
+                    data = decryptor.update(chunk) if decryptor else chunk
+                    f.write(data)
+                    written += len(data)
+                expected = response.headers.get('Content-Length')
+                if expected is not None and 'Content-Encoding' not in response.headers and int(expected) != received:
+                    raise IOError(f"大小不符: 应为{expected}字节，实际{received}字节")
+                if not received:
+                    raise IOError("内容为空")
+                if decryptor:
+                    data = decryptor.finalize()
+                    f.write(data)
+                    written += len(data)
+        finally:
+            response.close()
+        with self._lock:
+            task.bytes_downloaded += received
+            self._total_bytes += received
+        return written
+
+    def _fetch(self, task: DownloadTask, directory: str, entry: Dict):
+        """下载一个文件并校验大小，成功后在清单条目中记录磁盘上的字节数"""
+        path = os.path.join(directory, entry['file'])
+        temp_file = path + '.tmp'
+        last_error = None
+        for attempt in range(self.retries + 1):
+            if task.cancelled:
+                raise DownloadCancelled()
+            try:
+                size = self._stream_to_file(task, entry, temp_file)
+                os.replace(temp_file, path)
+                entry['size'] = size
+                return
+            except DownloadCancelled:
+                if os.path.exists(temp_file):
+                    os.remove(temp_file)
+                raise
+            except Exception as e:
+                last_error = e
+                logger.debug(f"下载 {entry['url']} 失败({attempt + 1}/{self.retries + 1}): {str(e)}")
+                time.sleep(min(2 ** attempt, 8))
+        raise IOError(f"下载失败 {entry['url']}: {str(last_error)}")
+
+    def download(self, task: DownloadTask, progress: Optional[Callable[[DownloadTask], None]] = None):
+        """下载一集（在调用线程中等待完成），已校验的分片跳过"""
+        directory = self.episode_dir(task.url)
+        os.makedirs(directory, exist_ok=True)
+        manifest = self._load_manifest(directory)
+        if manifest is None or manifest.get('url') != task.url:
+            manifest = self._new_manifest(task)
+            self._save_manifest(directory, manifest)
+
+        entries = manifest['keys'] + ([manifest['map']] if manifest['map'] else []) + manifest['segments']
+        segment_ids = {id(segment) for segment in manifest['segments']}
+        pending = [entry for entry in entries if not self._verified(directory, entry)]
+        task.total_segments = len(manifest['segments'])
+        task.done_segments = task.total_segments - sum(1 for entry in pending if id(entry) in segment_ids)
+        if pending:
+            logger.info(f"开始下载 {task.series} {task.title}: 需下载 {len(pending)} 个文件，"
+                        f"已有 {task.done_segments}/{task.total_segments} 个分片")
+        start = time.monotonic()
+
+        def fetch(entry):
+            self._fetch(task, directory, entry)
+            return entry
+
+        last_save = time.monotonic()
+        errors = []
+        futures = [self._executor.submit(fetch, entry) for entry in pending]
+        try:
+            for future in futures:
+                try:
+                    entry = future.result()
+                except DownloadCancelled:
+                    raise
+                except Exception as e:
+                    # 其余分片继续下载，下次加入队列时只补下载失败的分片
+                    errors.append(str(e))
+                    continue
+                if id(entry) in segment_ids:
+                    with self._lock:
+                        task.done_segments += 1
+                if progress:
+                    progress(task)
+                # 每隔几秒保存一次清单，中断后从已校验的分片继续
+                if time.monotonic() - last_save > 2:
+                    self._save_manifest(directory, manifest)
+                    last_save = time.monotonic()
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            # 等正在下载的分片结束（取消后在下一个数据块处退出），清单中包含全部已完成的分片
+            wait(futures)
+            self._save_manifest(directory, manifest)
+            raise
+
+        missing = [entry['file'] for entry in entries if not self._verified(directory, entry)]
+        if missing:
+            self._save_manifest(directory, manifest)
+            detail = errors[0] if errors else ', '.join(missing[:3])
+            raise IOError(f"{len(missing)}个文件未完成: {detail}")
+
+        manifest['completed_at'] = datetime.now().strftime(TIME_FORMAT)
+        self._save_manifest(directory, manifest)
+        self._write_playlist(directory, manifest)
+        with self._lock:
+            self._local[task.url] = os.path.abspath(os.path.join(directory, PLAYLIST_NAME))
+        size = sum(entry['size'] for entry in entries)
+        self.store.record(task.url, size, task.url, task.series, task.title)
+        logger.info(f"下载完成 {task.series} {task.title}: {task.total_segments}个分片，"
+                    f"{size / 1024 / 1024:.1f}MB，耗时 {time.monotonic() - start:.1f}s")
+
+    def _write_playlist(self, directory: str, manifest: Dict):
+        """写出引用本地文件的媒体播放列表"""
+        target = manifest['target_duration'] or max((seg['duration'] for seg in manifest['segments']), default=0)
+        lines = ['#EXTM3U', '#EXT-X-VERSION:3', f"#EXT-X-TARGETDURATION:{int(target + 0.999)}",
+                 f"#EXT-X-MEDIA-SEQUENCE:{manifest.get('media_sequence', 0)}", '#EXT-X-PLAYLIST-TYPE:VOD']
+        if manifest['map']:
+            lines.append(f'#EXT-X-MAP:URI="{manifest["map"]["file"]}"')
+        current_key = None
+        for segment in manifest['segments']:
+            if segment['key'] != current_key and not manifest.get('decrypted'):
+                if segment['key'] is None:
+                    lines.append('#EXT-X-KEY:METHOD=NONE')
+                else:
+                    key = manifest['keys'][segment['key']]
+                    iv = f",IV={key['iv']}" if key['iv'] else ''
+                    lines.append(f'#EXT-X-KEY:METHOD={key["method"]},URI="{key["file"]}"{iv}')
+                current_key = segment['key']
+            lines.append(f"#EXTINF:{segment['duration']:.3f},")
+            lines.append(segment['file'])
+        lines.append('#EXT-X-ENDLIST')
+
+        path = os.path.join(directory, PLAYLIST_NAME)
+        temp_file = path + '.tmp'
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(temp_file, path)
+
+    def shutdown(self):
+        self.cancel()
+        self.store.stop()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_shared_manager: Optional[DownloadManager] = None
+_shared_lock = threading.Lock()
+
+
+def get_download_manager() -> DownloadManager:
+    """获取进程共享的下载管理器（按playback_settings创建）"""
+    global _shared_manager
+    with _shared_lock:
+        if _shared_manager is None:
+            settings = load_playback_settings()
+            _shared_manager = DownloadManager(settings.get('download_dir', 'downloads'),
+                                              workers=settings.get('download_workers', 4),
+                                              max_bytes=int(settings.get('download_cache_mb', 0)) * 1024 * 1024)
+        return _shared_manager
+
+
+def shutdown_download_manager():
+    """程序退出时取消下载并保存下载索引"""
+    global _shared_manager
+    with _shared_lock:
+        manager, _shared_manager = _shared_manager, None
+    if manager is not None:
+        manager.shutdown()
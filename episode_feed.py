@@ -0,0 +1,94 @@
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+
+class EpisodeIndex:
+    """单个订阅的已知剧集索引，以剧集URL为键"""
+
+    def __init__(self, episodes: List[Dict]):
+        self.titles: Dict[str, str] = {ep['url']: ep.get('title', '') for ep in episodes if ep.get('url')}
+        self.urls = set(self.titles)
+
+    def diff(self, episodes: List[Dict]) -> Dict[str, List[Dict]]:
+        """与最新剧集列表比较
+
+        返回:
+            {'added': 新增剧集, 'removed': 已下架剧集, 'retitled': 标题变化的剧集}
+        """
+        new_titles = {ep['url']: ep.get('title', '') for ep in episodes if ep.get('url')}
+
+        added = [ep for ep in episodes if ep.get('url') and ep['url'] not in self.urls]
+        removed = [
+            {'title': title, 'url': url}
+            for url, title in self.titles.items() if url not in new_titles
+        ]
+        retitled = [
+            {'url': url, 'old_title': self.titles[url], 'title': title}
+            for url, title in new_titles.items()
+            if url in self.urls and self.titles[url] != title
+        ]
+        return {'added': added, 'removed': removed, 'retitled': retitled}
+
+
+def is_empty_diff(diff: Dict[str, List[Dict]]) -> bool:
+    """判断剧集差异是否为空"""
+    return not (diff['added'] or diff['removed'] or diff['retitled'])
+
+
+class ChangeFeed:
+    """剧集变更记录（JSONL），每行一个订阅的一次变更"""
+
+    def __init__(self, feed_file: str = 'episode_changes.jsonl'):
+        self.logger = logging.getLogger(__name__)
+        self.feed_file = feed_file
+        self._lock = threading.Lock()
+
+    def offset(self) -> int:
+        """当前记录末尾位置，配合read_since读取之后追加的记录"""
+        try:
+            return os.path.getsize(self.feed_file)
+        except OSError:
+            return 0
+
+    def append(self, url: str, title: str, diff: Dict[str, List[Dict]]):
+        """追加一条变更记录"""
+        entry = {
+            'time': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'url': url,
+            'title': title,
+            'added': diff['added'],
+            'removed': diff['removed'],
+            'retitled': diff['retitled']
+        }
+        with self._lock:
+            with open(self.feed_file, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+    def read_since(self, offset: int = 0) -> Tuple[List[Dict], int]:
+        """读取指定位置之后的变更记录
+
+        返回:
+            (记录列表, 新的读取位置)
+        """
+        entries = []
+        try:
+            with open(self.feed_file, 'rb') as f:
+                f.seek(offset)
+                data = f.read()
+        except OSError:
+            return entries, offset
+
+        # 只处理完整的行，未写完的行留到下次读取
+        complete = data[:data.rfind(b'\n') + 1]
+        for line in complete.decode('utf-8').splitlines():
+            if not line.strip():
+                continue
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError as e:
+                self.logger.warning(f"跳过损坏的变更记录: {str(e)}")
+        return entries, offset + len(complete)
@@ -0,0 +1,246 @@
+import html as html_lib
+import re
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from bs4 import BeautifulSoup
+
+
+def _build_info(title, update_status, update_time, image_url, episode_texts) -> Dict:
+    """根据提取到的原始字段组装与parse_video_info一致的结果"""
+    episodes = []
+    for text in episode_texts:
+        # 解析形如 "第01集$https://play.modujx10.com/xxx/index.m3u8" 的文本
+        parts = text.strip().split('$')
+        if len(parts) == 2:
+            episodes.append({
+                'title': parts[0].strip(),
+                'url': parts[1].strip()
+            })
+
+    return {
+        'title': title,
+        'update_status': update_status,
+        'update_time': update_time,
+        'image_url': image_url,
+        'episodes': episodes,
+        'total_episodes': len(episodes)
+    }
+
+
+class SoupExtractor:
+    """基于BeautifulSoup完整解析的提取器（兜底实现）"""
+
+    name = 'soup'
+
+    def extract(self, html: str) -> Optional[Dict]:
+        soup = BeautifulSoup(html, 'html.parser')
+
+        # 提取剧名和更新状态
+        title_elem = soup.select_one('.content__detail h1.title')
+        if title_elem:
+            # 获取主标题（第一个文本节点）
+            title = next(title_elem.stripped_strings)
+            # 获取更新状态（small标签）
+            status_elem = title_elem.select_one('small')
+            update_status = status_elem.text.strip() if status_elem else ""
+        else:
+            title = "未知剧名"
+            update_status = ""
+
+        # 提取更新时间
+        update_time_elem = soup.select_one('.text-light')
+        if update_time_elem:
+            update_time = update_time_elem.text.replace('更新时间：', '').strip()
+        else:
+            update_time = datetime.now().strftime("%Y-%m-%d")
+
+        # 提取图片地址
+        image_elem = soup.select_one('.content__thumb .thumb img')
+        image_url = image_elem['src'] if image_elem else ""
+
+        # 提取剧集列表
+        episode_texts = [ep.text for ep in soup.select('.content__playlist li a')]
+
+        return _build_info(title, update_status, update_time, image_url, episode_texts)
+
+
+class FastExtractor:
+    """定向扫描提取器
+
+    不构建完整DOM树，只按class标记定位标题、更新时间、封面和播放列表所在区域，
+    再在区域内做小范围匹配。找不到必要标记或结构不符合预期时返回None，
+    由调用方回退到SoupExtractor。
+    """
+
+    name = 'fast'
+
+    # 流式下载时，最后一个播放列表结束后继续读取的字符数
+    STREAM_LOOKAHEAD = 8192
+
+    _START_TAG = re.compile(r'<([a-zA-Z][\w-]*)((?:"[^"]*"|\'[^\']*\'|[^\'">])*)>')
+    _CLASS_ATTR = re.compile(r'''(?<![\w-])class\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))''', re.I)
+    _SRC_ATTR = re.compile(r'''(?<![\w-])src\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))''', re.I)
+    _TAG = re.compile(r'<[^>]*>')
+    _ANCHOR = re.compile(r'<a\b[^>]*>(.*?)</a\s*>', re.S | re.I)
+    _VOID_TAGS = {'img', 'br', 'hr', 'input', 'meta', 'link', 'source', 'area', 'base', 'col', 'embed', 'wbr'}
+
+    def extract(self, html: str) -> Optional[Dict]:
+        playlists = self._find_elements(html, 'content__playlist')
+        if not playlists:
+            return None
+
+        details = self._find_elements(html, 'content__detail')
+        if not details:
+            return None
+
+        # 剧名与更新状态: .content__detail h1.title
+        title_elem = None
+        for _, detail_start, detail_end in details:
+            title_elem = self._find_first(html, 'title', detail_start, detail_end, tag='h1')
+            if title_elem:
+                break
+        if title_elem:
+            inner = html[title_elem[1]:title_elem[2]]
+            title = self._first_text(inner)
+            if title is None:
+                return None
+            small = self._find_first(inner, None, tag='small')
+            update_status = self._text(inner[small[1]:small[2]]).strip() if small else ""
+        else:
+            title = "未知剧名"
+            update_status = ""
+
+        # 更新时间: .text-light
+        time_elem = self._find_first(html, 'text-light')
+        if time_elem:
+            update_time = self._text(html[time_elem[1]:time_elem[2]]).replace('更新时间：', '').strip()
+        else:
+            update_time = datetime.now().strftime("%Y-%m-%d")
+
+        # 封面: .content__thumb .thumb img
+        image_url = ""
+        for _, thumb_start, thumb_end in self._find_elements(html, 'content__thumb'):
+            thumb = self._find_first(html, 'thumb', thumb_start, thumb_end)
+            if thumb:
+                src = self._find_img_src(html, thumb[1], thumb[2])
+                if src is not None:
+                    image_url = src
+                    break
+
+        # 剧集列表: .content__playlist li a
+        episode_texts: List[str] = []
+        for _, start, end in playlists:
+            region = html[start:end]
+            li_pos = region.find('<li')
+            if li_pos < 0:
+                continue
+            episode_texts.extend(self._text(m.group(1)) for m in self._ANCHOR.finditer(region, li_pos))
+
+        return _build_info(title, update_status, update_time, image_url, episode_texts)
+
+    def is_complete(self, html: str) -> bool:
+        """判断已下载的页面前缀是否已包含提取所需的全部内容
+
+        要求标题区、更新时间和播放列表都已完整出现，且最后一个播放列表结束后
+        还多读了STREAM_LOOKAHEAD个字符，以免遗漏紧随其后的其他播放源。
+        """
+        try:
+            playlists = self._find_elements(html, 'content__playlist')
+            if not playlists or self._find_first(html, 'text-light') is None:
+                return False
+            if not self._find_elements(html, 'content__detail'):
+                return False
+        except ValueError:
+            # 元素尚未闭合，继续读取
+            return False
+        return playlists[-1][2] + self.STREAM_LOOKAHEAD <= len(html)
+
+    def _find_elements(self, html: str, cls: Optional[str], start: int = 0, end: Optional[int] = None,
+                       tag: Optional[str] = None, first: bool = False) -> List[Tuple[str, int, int]]:
+        """查找区域内带指定class（及标签名）的元素
+
+        返回:
+            [(标签名, 内容起始位置, 内容结束位置)]，嵌套的同类元素只保留最外层
+        """
+        end = len(html) if end is None else end
+        needle = cls if cls else f'<{tag}'
+        results = []
+        pos = start
+        while True:
+            idx = html.find(needle, pos, end)
+            if idx < 0:
+                break
+            tag_start = idx if not cls else html.rfind('<', start, idx)
+            match = self._START_TAG.match(html, tag_start) if tag_start >= 0 else None
+            if not match or match.end() <= idx or match.end() > end:
+                pos = idx + len(needle)
+                continue
+
+            name = match.group(1).lower()
+            if (tag and name != tag) or (cls and cls not in self._classes(match.group(2))):
+                pos = match.end()
+                continue
+
+            close_start, close_end = self._element_end(html, name, match.end(), end)
+            results.append((name, match.end(), close_start))
+            if first:
+                break
+            pos = close_end
+        return results
+
+    def _find_first(self, html: str, cls: Optional[str], start: int = 0, end: Optional[int] = None,
+                    tag: Optional[str] = None) -> Optional[Tuple[str, int, int]]:
+        found = self._find_elements(html, cls, start, end, tag, first=True)
+        return found[0] if found else None
+
+    def _classes(self, attrs: str) -> List[str]:
+        match = self._CLASS_ATTR.search(attrs)
+        if not match:
+            return []
+        return next(g for g in match.groups() if g is not None).split()
+
+    def _element_end(self, html: str, name: str, pos: int, end: int) -> Tuple[int, int]:
+        """按同名标签的嵌套深度找到元素结束位置"""
+        if name in self._VOID_TAGS:
+            return pos, pos
+        pattern = re.compile(rf'<(/?){name}\b[^>]*>', re.I)
+        depth = 1
+        for match in pattern.finditer(html, pos, end):
+            depth += -1 if match.group(1) else 1
+            if depth == 0:
+                return match.start(), match.end()
+        raise ValueError(f"未找到</{name}>结束标签")
+
+    def _find_img_src(self, html: str, start: int, end: int) -> Optional[str]:
+        for match in self._START_TAG.finditer(html, start, end):
+            if match.group(1).lower() == 'img':
+                src = self._SRC_ATTR.search(match.group(2))
+                if not src:
+                    # 与BeautifulSoup行为一致: 缺少src时交由兜底解析处理
+                    raise KeyError('src')
+                return html_lib.unescape(next(g for g in src.groups() if g is not None))
+        return None
+
+    def _text(self, fragment: str) -> str:
+        """去掉标签并反转义，得到与BeautifulSoup .text相同的文本"""
+        return html_lib.unescape(self._TAG.sub('', fragment))
+
+    def _first_text(self, fragment: str) -> Optional[str]:
+        """第一个非空文本节点（与stripped_strings的第一个元素一致）"""
+        for piece in self._TAG.split(fragment):
+            text = html_lib.unescape(piece).strip()
+            if text:
+                return text
+        return None
+
+
+EXTRACTORS = {
+    FastExtractor.name: FastExtractor,
+    SoupExtractor.name: SoupExtractor
+}
+
+
+def get_extractor(name: str = 'fast'):
+    """按名称创建提取器，未知名称时使用BeautifulSoup实现"""
+    return EXTRACTORS.get(name, SoupExtractor)()
@@ -0,0 +1,271 @@
+"""HLS播放列表解析与分片索引缓存
+
+解析主播放列表（EXT-X-STREAM-INF）和媒体播放列表（EXTINF / EXT-X-KEY），
+为每集保存一份精简的分片索引，供播放器跳过主列表请求、显示时长和把跳转
+时间换算为分片位置。
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urljoin
+
+from http_client import get_session
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_attributes(text: str) -> Dict[str, str]:
+    """解析形如 BANDWIDTH=800000,RESOLUTION=1280x720,CODECS="a,b" 的属性列表"""
+    attrs = {}
+    key, value, in_quotes, reading_key = '', '', False, True
+    for ch in text + ',':
+        if reading_key:
+            if ch == '=':
+                reading_key = False
+            elif ch != ',':
+                key += ch
+            continue
+        if ch == '"':
+            in_quotes = not in_quotes
+        elif ch == ',' and not in_quotes:
+            attrs[key.strip().upper()] = value
+            key, value, reading_key = '', '', True
+        else:
+            value += ch
+    return attrs
+
+
+def parse_key_tag(line: str, base_url: str) -> Optional[Dict]:
+    """解析#EXT-X-KEY标签，METHOD=NONE时返回None
+
+    返回:
+        {'method', 'uri', 'iv', 'keyformat'}，uri为完整地址，iv为原始的十六进制文本（可能为空）
+    """
+    attrs = _parse_attributes(line.split(':', 1)[1] if ':' in line else '')
+    method = attrs.get('METHOD', 'NONE').upper()
+    if method == 'NONE':
+        return None
+    return {
+        'method': method,
+        'uri': urljoin(base_url, attrs.get('URI', '')),
+        'iv': attrs.get('IV', ''),
+        'keyformat': attrs.get('KEYFORMAT', 'identity')
+    }
+
+
+def parse_playlist(text: str, base_url: str) -> Dict:
+    """解析m3u8文本
+
+    返回:
+        主播放列表: {'type': 'master', 'variants': [{'url', 'bandwidth', 'resolution'}]}
+        媒体播放列表: {'type': 'media', 'segments': [{'uri', 'duration', 'key'}], 'keys': [...],
+                     'map': 初始化分片, 'target_duration', 'media_sequence', 'total_duration', 'endlist'}
+    """
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    if not lines or not lines[0].startswith('#EXTM3U'):
+        raise ValueError("不是有效的m3u8播放列表")
+
+    if any(line.startswith('#EXT-X-STREAM-INF') for line in lines):
+        variants = []
+        pending = None
+        for line in lines:
+            if line.startswith('#EXT-X-STREAM-INF:'):
+                pending = _parse_attributes(line.split(':', 1)[1])
+            elif not line.startswith('#') and pending is not None:
+                variants.append({
+                    'url': urljoin(base_url, line),
+                    'bandwidth': int(pending.get('BANDWIDTH', 0) or 0),
+                    'resolution': pending.get('RESOLUTION', '')
+                })
+                pending = None
+        return {'type': 'master', 'variants': variants}
+
+    segments, keys = [], []
+    current_key = None
+    duration = None
+    playlist = {'type': 'media', 'map': None, 'target_duration': 0, 'media_sequence': 0, 'endlist': False}
+    for line in lines:
+        if line.startswith('#EXTINF:'):
+            duration = float(line.split(':', 1)[1].split(',', 1)[0] or 0)
+        elif line.startswith('#EXT-X-KEY:'):
+            key = parse_key_tag(line, base_url)
+            if key is None:
+                current_key = None
+            else:
+                keys.append(key)
+                current_key = len(keys) - 1
+        elif line.startswith('#EXT-X-MAP:'):
+            playlist['map'] = urljoin(base_url, _parse_attributes(line.split(':', 1)[1]).get('URI', ''))
+        elif line.startswith('#EXT-X-TARGETDURATION:'):
+            playlist['target_duration'] = int(float(line.split(':', 1)[1]))
+        elif line.startswith('#EXT-X-MEDIA-SEQUENCE:'):
+            playlist['media_sequence'] = int(line.split(':', 1)[1])
+        elif line.startswith('#EXT-X-ENDLIST'):
+            playlist['endlist'] = True
+        elif not line.startswith('#'):
+            segments.append({'uri': line, 'duration': duration or 0.0, 'key': current_key})
+            duration = None
+
+    playlist['segments'] = segments
+    playlist['keys'] = keys
+    playlist['total_duration'] = round(sum(seg['duration'] for seg in segments), 3)
+    return playlist
+
+
+def segment_url(index: Dict, i: int) -> str:
+    """分片索引中第i个分片的完整地址"""
+    return urljoin(index['variant_url'], index['segments'][i][0])
+
+
+def segment_at(index: Dict, position_ms: int) -> Tuple[int, int]:
+    """把播放时间换算为(分片序号, 分片内偏移毫秒)"""
+    elapsed = 0.0
+    target = max(0, position_ms) / 1000
+    for i, (_, duration, _) in enumerate(index['segments']):
+        if target < elapsed + duration:
+            return i, int((target - elapsed) * 1000)
+        elapsed += duration
+    last = len(index['segments']) - 1
+    return max(0, last), 0
+
+
+class HLSResolver:
+    """解析剧集播放列表并持久化分片索引
+
+    每集一个JSON文件，内容为选中的码率地址、分片相对地址与时长、密钥信息和总时长。
+    已结束（EXT-X-ENDLIST）的点播列表缓存vod_max_age秒，其他列表live_max_age秒。
+    """
+
+    def __init__(self, cache_dir: str = 'hls_cache', vod_max_age: float = 7 * 24 * 3600,
+                 live_max_age: float = 60, timeout: float = 10):
+        self.cache_dir = cache_dir
+        self.vod_max_age = vod_max_age
+        self.live_max_age = live_max_age
+        self.timeout = timeout
+        self.session = get_session()
+        self._memory: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def _cache_path(self, url: str) -> str:
+        return os.path.join(self.cache_dir, hashlib.sha1(url.encode('utf-8')).hexdigest() + '.json')
+
+    def _is_fresh(self, index: Dict, max_age: Optional[float] = None) -> bool:
+        if max_age is None:
+            max_age = self.vod_max_age if index.get('endlist') else self.live_max_age
+        return time.time() - index.get('fetched_at', 0) < max_age
+
+    def cached(self, url: str, max_age: Optional[float] = None) -> Optional[Dict]:
+        """读取未过期的分片索引，不发起网络请求"""
+        with self._lock:
+            index = self._memory.get(url)
+        if index is None:
+            try:
+                with open(self._cache_path(url), 'r', encoding='utf-8') as f:
+                    index = json.load(f)
+                with self._lock:
+                    self._memory[url] = index
+            except (OSError, ValueError):
+                return None
+        return index if self._is_fresh(index, max_age) else None
+
+    def invalidate(self, url: str):
+        """删除指定剧集的分片索引"""
+        with self._lock:
+            self._memory.pop(url, None)
+        try:
+            os.remove(self._cache_path(url))
+        except OSError:
+            pass
+
+    def _fetch(self, url: str) -> str:
+        response = self.session.get(url, timeout=self.timeout)
+        response.raise_for_status()
+        return response.text
+
+    def choose_variant(self, variants: List[Dict]) -> Dict:
+        """选择码率，默认最高码率"""
+        return max(variants, key=lambda v: v['bandwidth'])
+
+    def resolve(self, url: str, max_age: Optional[float] = None, raise_errors: bool = False) -> Optional[Dict]:
+        """获取剧集的分片索引，缓存有效时直接返回
+
+        参数:
+            raise_errors: 失败时抛出异常，默认记录日志并返回None
+        """
+        index = self.cached(url, max_age)
+        if index is not None:
+            return index
+
+        try:
+            playlist = parse_playlist(self._fetch(url), url)
+            variant_url, bandwidth, variants = url, 0, []
+            if playlist['type'] == 'master':
+                if not playlist['variants']:
+                    raise ValueError("主播放列表中没有可用码率")
+                variants = playlist['variants']
+                variant = self.choose_variant(variants)
+                variant_url, bandwidth = variant['url'], variant['bandwidth']
+                playlist = parse_playlist(self._fetch(variant_url), variant_url)
+                if playlist['type'] != 'media':
+                    raise ValueError("不支持多级主播放列表")
+
+            index = {
+                'url': url,
+                'variant_url': variant_url,
+                'bandwidth': bandwidth,
+                'variants': variants,
+                'segments': [[seg['uri'], seg['duration'], seg['key']] for seg in playlist['segments']],
+                'keys': playlist['keys'],
+                'map': playlist['map'],
+                'target_duration': playlist['target_duration'],
+                'media_sequence': playlist['media_sequence'],
+                'total_duration': playlist['total_duration'],
+                'endlist': playlist['endlist'],
+                'fetched_at': time.time()
+            }
+        except Exception as e:
+            if raise_errors:
+                raise
+            logger.warning(f"解析播放列表失败 {url}: {str(e)}")
+            return None
+
+        with self._lock:
+            self._memory[url] = index
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            temp_file = self._cache_path(url) + '.tmp'
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(index, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(temp_file, self._cache_path(url))
+        except OSError as e:
+            logger.warning(f"保存分片索引失败: {str(e)}")
+        return index
+
+    def resolve_async(self, urls: List[str], callback=None):
+        """后台线程依次解析多集，callback(url, index)在后台线程中调用"""
+        def task():
+            for url in urls:
+                index = self.resolve(url)
+                if callback and index is not None:
+                    callback(url, index)
+
+        thread = threading.Thread(target=task, daemon=True)
+        thread.start()
+        return thread
+
+
+_shared_resolver: Optional[HLSResolver] = None
+_shared_lock = threading.Lock()
+
+
+def get_hls_resolver() -> HLSResolver:
+    """获取进程共享的解析器"""
+    global _shared_resolver
+    with _shared_lock:
+        if _shared_resolver is None:
+            _shared_resolver = HLSResolver()
+        return _shared_resolver
@@ -0,0 +1,194 @@
+"""HLS分片加密（EXT-X-KEY METHOD=AES-128）
+
+密钥标签由hls.parse_key_tag解析。这里按密钥地址缓存密钥（每个地址只请求一次，按最近最少使用淘汰），
+并以分块流式的方式解密AES-128-CBC分片，不需要把整个分片读入内存。
+
+解密依赖cryptography（pip install cryptography），未安装时HAS_AES为False，
+调用方应保留原始密文交给播放器自行解密。
+"""
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, Iterable, Iterator, Optional
+
+from http_client import get_session
+
+try:
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+    HAS_AES = True
+except ImportError:
+    HAS_AES = False
+
+logger = logging.getLogger(__name__)
+
+BLOCK_SIZE = 16
+KEY_SIZE = 16
+
+# 可以在本地解密的加密方式
+METHOD_AES_128 = 'AES-128'
+
+
+def can_decrypt(key: Optional[Dict]) -> bool:
+    """该密钥加密的分片能否在本地解密"""
+    return (HAS_AES and key is not None and key.get('method', '').upper() == METHOD_AES_128
+            and key.get('keyformat', 'identity') == 'identity')
+
+
+def segment_iv(key: Dict, sequence: int) -> bytes:
+    """分片的IV：标签中给出IV时使用该值，否则为分片的媒体序号（16字节大端）"""
+    iv = key.get('iv') or ''
+    if iv:
+        text = iv[2:] if iv.lower().startswith('0x') else iv
+        value = bytes.fromhex(text.rjust(BLOCK_SIZE * 2, '0'))
+        if len(value) != BLOCK_SIZE:
+            raise ValueError(f"IV长度错误: {iv}")
+        return value
+    return sequence.to_bytes(BLOCK_SIZE, 'big')
+
+
+class SegmentDecryptor:
+    """AES-128-CBC流式解密
+
+    update()可以传入任意长度的分块，返回目前能确定的明文；最后一个块要等finalize()
+    去掉PKCS#7填充后才返回。
+    """
+
+    def __init__(self, key: bytes, iv: bytes):
+        if not HAS_AES:
+            raise RuntimeError("未安装cryptography，无法解密AES-128分片")
+        if len(key) != KEY_SIZE or len(iv) != BLOCK_SIZE:
+            raise ValueError("AES-128的密钥和IV都必须是16字节")
+        self._decryptor = Cipher(algorithms.AES(key), modes.CBC(iv)).decryptor()
+        self._pending = b''
+        self.bytes_in = 0
+
+    def update(self, chunk: bytes) -> bytes:
+        self.bytes_in += len(chunk)
+        data = self._pending + chunk
+        # 保留末尾至少一个完整块，可能是带填充的最后一块
+        usable = max(0, (len(data) - 1) // BLOCK_SIZE * BLOCK_SIZE)
+        self._pending = data[usable:]
+        return self._decryptor.update(data[:usable]) if usable else b''
+
+    def finalize(self) -> bytes:
+        if len(self._pending) != BLOCK_SIZE:
+            raise ValueError(f"密文长度{self.bytes_in}不是{BLOCK_SIZE}的整数倍")
+        last = self._decryptor.update(self._pending) + self._decryptor.finalize()
+        self._pending = b''
+        padding = last[-1]
+        if not 1 <= padding <= BLOCK_SIZE or last[-padding:] != bytes([padding]) * padding:
+            raise ValueError("填充错误，密钥或IV可能不正确")
+        return last[:-padding]
+
+
+def decrypt_stream(chunks: Iterable[bytes], key: bytes, iv: bytes) -> Iterator[bytes]:
+    """逐块解密，产出明文分块"""
+    decryptor = SegmentDecryptor(key, iv)
+    for chunk in chunks:
+        data = decryptor.update(chunk)
+        if data:
+            yield data
+    yield decryptor.finalize()
+
+
+def decrypt_file(source: str, target: str, key: bytes, iv: bytes, chunk_size: int = 64 * 1024) -> int:
+    """解密文件，返回明文字节数"""
+    def read_chunks(f):
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    written = 0
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        for data in decrypt_stream(read_chunks(src), key, iv):
+            dst.write(data)
+            written += len(data)
+    return written
+
+
+def encrypt_segment(data: bytes, key: bytes, iv: bytes) -> bytes:
+    """AES-128-CBC加密并加PKCS#7填充，用于生成本地测试数据"""
+    if not HAS_AES:
+        raise RuntimeError("未安装cryptography，无法加密分片")
+    padding = BLOCK_SIZE - len(data) % BLOCK_SIZE
+    encryptor = Cipher(algorithms.AES(key), modes.CBC(iv)).encryptor()
+    return encryptor.update(data + bytes([padding]) * padding) + encryptor.finalize()
+
+
+class KeyCache:
+    """密钥缓存
+
+    每个密钥地址只请求一次：同一密钥正在下载时，其他线程等待该请求的结果。
+    最多保留max_keys个密钥，超过时淘汰最近最少使用的；密钥只保存在内存中。
+    """
+
+    def __init__(self, max_keys: int = 64, timeout: float = 10):
+        self.max_keys = max_keys
+        self.timeout = timeout
+        self.session = get_session()
+        self._keys: 'OrderedDict[str, bytes]' = OrderedDict()
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'fetches': 0, 'evicted': 0}
+
+    def get(self, url: str) -> bytes:
+        """读取密钥，缓存中没有时请求一次"""
+        with self._lock:
+            key = self._keys.get(url)
+            if key is not None:
+                self._keys.move_to_end(url)
+                self.stats['hits'] += 1
+                return key
+            future = self._inflight.get(url)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[url] = future
+
+        if not owner:
+            key = future.result(timeout=self.timeout * 2)
+            with self._lock:
+                self.stats['hits'] += 1
+            return key
+
+        try:
+            response = self.session.get(url, timeout=self.timeout)
+            response.raise_for_status()
+            key = response.content
+            if len(key) != KEY_SIZE:
+                raise ValueError(f"密钥长度为{len(key)}字节，应为{KEY_SIZE}字节")
+            with self._lock:
+                self.stats['fetches'] += 1
+                self._keys[url] = key
+                while len(self._keys) > self.max_keys:
+                    self._keys.popitem(last=False)
+                    self.stats['evicted'] += 1
+            future.set_result(key)
+            return key
+        except Exception as e:
+            logger.warning(f"获取密钥失败 {url}: {str(e)}")
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(url, None)
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return dict(self.stats, keys=len(self._keys))
+
+
+_shared_cache: Optional[KeyCache] = None
+_shared_lock = threading.Lock()
+
+
+def get_key_cache() -> KeyCache:
+    """获取进程共享的密钥缓存"""
+    global _shared_cache
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = KeyCache()
+        return _shared_cache
@@ -0,0 +1,503 @@
+"""本地HLS源站模拟器
+
+在127.0.0.1上生成并提供HLS播放列表和分片（MPEG-TS或fMP4），按场景脚本模拟网络状况：
+吞吐量上限、延迟与抖动、连接中途断开、连续5xx错误，以及播放中途的播放列表变化
+（追加分片、直播滑动窗口、插入不连续点、结束列表）。随机数使用场景中的seed，
+同样的请求顺序得到同样的结果，可以离线、可重复地测试缓冲和恢复逻辑。
+
+场景格式（JSON）:
+    {
+        "name": "带宽骤降",
+        "seed": 1,
+        "format": "ts",                       # ts 或 fmp4
+        "segment_duration": 1.0,
+        "segments": 20,
+        "endlist": true,                      # false 时为直播列表，配合 playlist 步骤追加分片
+        "variants": [{"name": "mid", "bandwidth": 800000}],
+        "network": {"throughput_kbps": 8000, "latency_ms": 20, "jitter_ms": 5, "drop_rate": 0},
+        "steps": [                            # segment: 第几个分片请求（从0开始）到达时生效
+            {"segment": 5, "network": {"throughput_kbps": 300}},
+            {"segment": 8, "errors": {"status": 503, "count": 3}},
+            {"segment": 10, "drop": 1},
+            {"segment": 12, "playlist": {"append": 5, "discontinuity": true, "window": 6, "endlist": true}}
+        ],
+        "player": {"startup_buffer": 2, "resume_buffer": 3, "max_buffer": 30, "retries": 3},
+        "expect": {"completed": true, "max_rebuffers": 1, "max_stall_ms": 6000, "max_recoveries": 3},
+        "media_dir": null,                    # 可选：用目录中的真实TS分片（按文件名排序循环使用）代替生成的分片
+        "encryption": {"rotate": 8, "iv": "sequence"}  # 可选：AES-128加密分片（需要cryptography），
+                                              # 每rotate个分片换一个密钥（0为全程一个），
+                                              # iv为explicit时在标签中写IV，否则按媒体序号
+    }
+
+用法:
+    python hls_origin.py [--scenario 场景名或JSON文件] [--port 8090]
+"""
+import argparse
+import glob
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import shutil
+import struct
+import subprocess
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+from hls_crypto import encrypt_segment
+
+logger = logging.getLogger(__name__)
+
+TS_PACKET_SIZE = 188
+
+DEFAULT_SCENARIO = {
+    'name': '默认',
+    'seed': 1,
+    'format': 'ts',
+    'segment_duration': 1.0,
+    'segments': 20,
+    'endlist': True,
+    'variants': [{'name': 'mid', 'bandwidth': 800000}],
+    'network': {'throughput_kbps': None, 'latency_ms': 10, 'jitter_ms': 0, 'drop_rate': 0},
+    'steps': [],
+    'player': {'startup_buffer': 2, 'resume_buffer': 3, 'max_buffer': 30, 'retries': 3},
+    'expect': {},
+    'media_dir': None,
+    'encryption': None
+}
+
+# 内置场景，只列出与默认值不同的部分
+SCENARIOS = {
+    'steady': {
+        'name': '网络稳定',
+        'network': {'throughput_kbps': 8000},
+        'expect': {'completed': True, 'max_rebuffers': 0, 'max_recoveries': 0}
+    },
+    'bandwidth_drop': {
+        'name': '带宽骤降到码率以下',
+        'network': {'throughput_kbps': 8000},
+        'steps': [{'segment': 6, 'network': {'throughput_kbps': 400}},
+                  {'segment': 14, 'network': {'throughput_kbps': 8000}}],
+        'expect': {'completed': True, 'min_rebuffers': 1, 'max_recoveries': 0}
+    },
+    'jitter': {
+        'name': '高延迟抖动',
+        'network': {'throughput_kbps': 4000, 'latency_ms': 150, 'jitter_ms': 120},
+        'expect': {'completed': True, 'max_recoveries': 0}
+    },
+    'error_burst': {
+        'name': '连续503',
+        'network': {'throughput_kbps': 8000},
+        'steps': [{'segment': 8, 'errors': {'status': 503, 'count': 2}}],
+        'expect': {'completed': True, 'min_recoveries': 2, 'max_rebuffers': 1}
+    },
+    'outage': {
+        'name': '源站持续故障',
+        'network': {'throughput_kbps': 8000},
+        'steps': [{'segment': 5, 'errors': {'status': 502, 'count': 100}}],
+        'expect': {'completed': False}
+    },
+    'dropped_connections': {
+        'name': '分片传输中断开',
+        'network': {'throughput_kbps': 6000},
+        'steps': [{'segment': 4, 'drop': 2}, {'segment': 12, 'drop': 1}],
+        'expect': {'completed': True, 'min_recoveries': 3}
+    },
+    'live_append': {
+        'name': '直播列表中途追加并结束',
+        'segments': 8,
+        'endlist': False,
+        'network': {'throughput_kbps': 8000},
+        'steps': [{'segment': 6, 'playlist': {'append': 6, 'discontinuity': True}},
+                  {'segment': 12, 'playlist': {'endlist': True}}],
+        'expect': {'completed': True, 'min_segments': 14}
+    },
+    'fmp4': {
+        'name': 'fMP4分片',
+        'format': 'fmp4',
+        'network': {'throughput_kbps': 8000},
+        'expect': {'completed': True, 'max_rebuffers': 0}
+    },
+}
+
+
+def load_scenario(spec) -> Dict:
+    """读取场景：内置场景名、JSON文件路径或字典，缺少的字段用默认值补齐"""
+    if isinstance(spec, str):
+        if spec in SCENARIOS:
+            spec = SCENARIOS[spec]
+        else:
+            with open(spec, 'r', encoding='utf-8') as f:
+                spec = json.load(f)
+    scenario = json.loads(json.dumps(DEFAULT_SCENARIO))
+    for key, value in spec.items():
+        if isinstance(value, dict) and isinstance(scenario.get(key), dict):
+            scenario[key].update(value)
+        else:
+            scenario[key] = value
+    if scenario['format'] not in ('ts', 'fmp4'):
+        raise ValueError(f"不支持的分片格式: {scenario['format']}")
+    if not scenario['variants']:
+        raise ValueError("场景中没有码率")
+    return scenario
+
+
+def mpeg_crc32(data: bytes) -> int:
+    """MPEG-2 PSI使用的CRC32（多项式0x04C11DB7，不反转）"""
+    crc = 0xFFFFFFFF
+    for byte in data:
+        crc ^= byte << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) if crc & 0x80000000 else crc << 1
+            crc &= 0xFFFFFFFF
+    return crc
+
+
+def _ts_packet(pid: int, payload: bytes, counter: int, start: bool) -> bytes:
+    header = struct.pack('>BHB', 0x47, (0x4000 if start else 0) | pid, 0x10 | (counter & 0x0F))
+    return (header + payload).ljust(TS_PACKET_SIZE, b'\xff')
+
+
+def _psi_packet(pid: int, table: bytes) -> bytes:
+    section = table + struct.pack('>I', mpeg_crc32(table))
+    return _ts_packet(pid, b'\x00' + section, 0, True)
+
+
+# PAT：节目1的PMT在PID 0x1000；PMT：一路H.264视频，PID 0x100
+_PAT = _psi_packet(0x0000, bytes([0x00, 0xB0, 0x0D, 0x00, 0x01, 0xC1, 0x00, 0x00, 0x00, 0x01, 0xF0, 0x00]))
+_PMT = _psi_packet(0x1000, bytes([0x02, 0xB0, 0x12, 0x00, 0x01, 0xC1, 0x00, 0x00, 0xE1, 0x00, 0xF0, 0x00,
+                                  0x1B, 0xE1, 0x00, 0xF0, 0x00]))
+
+
+def make_ts_segment(size: int, sequence: int, duration: float) -> bytes:
+    """生成结构合法的MPEG-TS分片：PAT、PMT和带PTS的PES包，载荷为填充数据，大小按188字节对齐"""
+    packets = max(3, size // TS_PACKET_SIZE)
+    pts = int(sequence * duration * 90000) & 0x1FFFFFFFF
+    pes_header = bytes([0x00, 0x00, 0x01, 0xE0, 0x00, 0x00, 0x80, 0x80, 0x05,
+                        0x21 | ((pts >> 29) & 0x0E), (pts >> 22) & 0xFF, 0x01 | ((pts >> 14) & 0xFE),
+                        (pts >> 7) & 0xFF, 0x01 | ((pts << 1) & 0xFE)])
+    marker = f"segment:{sequence}:".encode('ascii')
+    chunks = [_PAT, _PMT, _ts_packet(0x100, pes_header + marker, 0, True)]
+    filler = b'\x00' * (TS_PACKET_SIZE - 4)
+    for counter in range(1, packets - 2):
+        chunks.append(_ts_packet(0x100, filler, counter, False))
+    return b''.join(chunks)
+
+
+def make_test_media(directory: str, seconds: int = 60, segment_duration: float = 1.0) -> bool:
+    """用ffmpeg生成可解码的测试TS分片（彩条画面+正弦音），没有ffmpeg时返回False"""
+    ffmpeg = shutil.which('ffmpeg')
+    if not ffmpeg:
+        return False
+    os.makedirs(directory, exist_ok=True)
+    command = [
+        ffmpeg, '-loglevel', 'error', '-y',
+        '-f', 'lavfi', '-i', f'testsrc=size=640x360:rate=25:duration={seconds}',
+        '-f', 'lavfi', '-i', f'sine=frequency=440:duration={seconds}',
+        '-c:v', 'libx264', '-preset', 'veryfast', '-g', str(int(25 * segment_duration)), '-c:a', 'aac',
+        '-f', 'segment', '-segment_time', str(segment_duration), '-segment_format', 'mpegts',
+        os.path.join(directory, '%05d.ts')
+    ]
+    try:
+        subprocess.run(command, check=True, timeout=300)
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.error(f"生成测试分片失败: {str(e)}")
+        return False
+    return bool(glob.glob(os.path.join(directory, '*.ts')))
+
+
+def _box(kind: bytes, payload: bytes) -> bytes:
+    return struct.pack('>I', 8 + len(payload)) + kind + payload
+
+
+def make_fmp4_init() -> bytes:
+    """生成fMP4初始化分片（ftyp + moov/mvhd + mvex），只保证盒子结构合法"""
+    ftyp = _box(b'ftyp', b'iso6' + struct.pack('>I', 0) + b'iso6mp41')
+    mvhd = _box(b'mvhd', struct.pack('>I', 0) + struct.pack('>IIII', 0, 0, 90000, 0) + b'\x00\x01\x00\x00'
+                + b'\x01\x00' + b'\x00' * 10 + b'\x00' * 36 + b'\x00' * 24 + struct.pack('>I', 2))
+    trex = _box(b'trex', struct.pack('>I', 0) + struct.pack('>IIIII', 1, 1, 0, 0, 0))
+    return ftyp + _box(b'moov', mvhd + _box(b'mvex', trex))
+
+
+def make_fmp4_segment(size: int, sequence: int) -> bytes:
+    """生成fMP4媒体分片（styp + moof/mfhd + mdat），mdat为填充数据"""
+    styp = _box(b'styp', b'msdh' + struct.pack('>I', 0) + b'msdhmsix')
+    moof = _box(b'moof', _box(b'mfhd', struct.pack('>II', 0, sequence + 1)))
+    marker = f"segment:{sequence}:".encode('ascii')
+    mdat_size = max(len(marker), size - len(styp) - len(moof) - 8)
+    return styp + moof + _box(b'mdat', marker.ljust(mdat_size, b'\x00'))
+
+
+class HLSOrigin:
+    """按场景提供HLS内容的本地HTTP服务
+
+    地址:
+        /master.m3u8                 主播放列表
+        /<码率名>/index.m3u8          媒体播放列表
+        /<码率名>/init.mp4            fMP4初始化分片
+        /<码率名>/<n>.ts | <n>.m4s    第n个分片（n为媒体序号）
+    """
+
+    def __init__(self, scenario, port: int = 0):
+        self.scenario = load_scenario(scenario)
+        self.network = dict(self.scenario['network'])
+        self.segment_count = self.scenario['segments']
+        self.endlist = self.scenario['endlist']
+        self.window: Optional[int] = None
+        self.discontinuities: List[int] = []
+        self.variants = {v['name']: v['bandwidth'] for v in self.scenario['variants']}
+        self.segment_requests = 0
+        self.key_requests = 0
+        self.log: List[Dict] = []
+        self._errors_left = 0
+        self._error_status = 503
+        self._drops_left = 0
+        self._steps = sorted(self.scenario['steps'], key=lambda step: step.get('segment', 0))
+        self._random = random.Random(self.scenario['seed'])
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self._init = make_fmp4_init()
+        self._media_files = sorted(glob.glob(os.path.join(self.scenario['media_dir'], '*.ts'))) \
+            if self.scenario['media_dir'] else []
+        if self.scenario['media_dir'] and not self._media_files:
+            raise ValueError(f"目录中没有TS分片: {self.scenario['media_dir']}")
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self._make_handler())
+        self.server.daemon_threads = True
+        self.server.handle_error = lambda request, client_address: None
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    @property
+    def master_url(self) -> str:
+        return f"{self.base_url}/master.m3u8"
+
+    def variant_url(self, name: Optional[str] = None) -> str:
+        return f"{self.base_url}/{name or next(iter(self.variants))}/index.m3u8"
+
+    def start(self):
+        self._thread.start()
+        logger.info(f"HLS模拟源站已启动: {self.master_url}（场景: {self.scenario['name']}）")
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _apply_step(self, step: Dict):
+        """应用一条场景步骤，调用方持有锁"""
+        if 'network' in step:
+            self.network.update(step['network'])
+        if 'errors' in step:
+            self._errors_left = step['errors'].get('count', 1)
+            self._error_status = step['errors'].get('status', 503)
+        if 'drop' in step:
+            self._drops_left = step['drop']
+        playlist = step.get('playlist', {})
+        if playlist.get('discontinuity'):
+            self.discontinuities.append(self.segment_count)
+        if playlist.get('append'):
+            self.segment_count += playlist['append']
+        if 'window' in playlist:
+            self.window = playlist['window']
+        if 'endlist' in playlist:
+            self.endlist = playlist['endlist']
+        self.log.append({'t': round(time.perf_counter() - self._start, 3), 'step': step})
+        logger.info(f"场景步骤生效: {step}")
+
+    def _on_segment_request(self) -> Dict:
+        """分片请求到达：应用到期的步骤，决定本次请求的延迟、错误和断开"""
+        with self._lock:
+            while self._steps and self._steps[0].get('segment', 0) <= self.segment_requests:
+                self._apply_step(self._steps.pop(0))
+            self.segment_requests += 1
+            network = dict(self.network)
+            jitter = network.get('jitter_ms') or 0
+            action = {
+                'latency': max(0, (network.get('latency_ms') or 0) + self._random.uniform(-jitter, jitter)) / 1000,
+                'throughput_kbps': network.get('throughput_kbps'),
+                'status': None,
+                'drop': False
+            }
+            if self._errors_left > 0:
+                self._errors_left -= 1
+                action['status'] = self._error_status
+            elif self._drops_left > 0:
+                self._drops_left -= 1
+                action['drop'] = True
+            elif network.get('drop_rate') and self._random.random() < network['drop_rate']:
+                action['drop'] = True
+            return action
+
+    def _key_index(self, sequence: int) -> int:
+        rotate = self.scenario['encryption'].get('rotate') or 0
+        return sequence // rotate if rotate else 0
+
+    def key_bytes(self, index: int) -> bytes:
+        """第index个密钥（由seed确定）"""
+        return hashlib.md5(f"{self.scenario['seed']}:key:{index}".encode('ascii')).digest()
+
+    def key_iv(self, sequence: int) -> bytes:
+        """分片的IV：explicit时每个密钥一个固定IV，否则为媒体序号"""
+        if self.scenario['encryption'].get('iv') == 'explicit':
+            return hashlib.md5(f"{self.scenario['seed']}:iv:{self._key_index(sequence)}".encode('ascii')).digest()
+        return sequence.to_bytes(16, 'big')
+
+    def _key_tag(self, sequence: int) -> str:
+        index = self._key_index(sequence)
+        tag = f'#EXT-X-KEY:METHOD=AES-128,URI="/keys/{index}.key"'
+        if self.scenario['encryption'].get('iv') == 'explicit':
+            tag += f",IV=0x{self.key_iv(sequence).hex().upper()}"
+        return tag
+
+    def media_playlist(self, variant: str) -> str:
+        duration = self.scenario['segment_duration']
+        with self._lock:
+            window = self.window
+            first = max(0, self.segment_count - window) if window else 0
+            count, endlist, discontinuities = self.segment_count, self.endlist, list(self.discontinuities)
+        extension = 'm4s' if self.scenario['format'] == 'fmp4' else 'ts'
+        lines = ["#EXTM3U", "#EXT-X-VERSION:7", f"#EXT-X-TARGETDURATION:{int(duration + 0.999)}",
+                 f"#EXT-X-MEDIA-SEQUENCE:{first}"]
+        if not endlist and not window:
+            lines.append("#EXT-X-PLAYLIST-TYPE:EVENT")
+        if self.scenario['format'] == 'fmp4':
+            lines.append('#EXT-X-MAP:URI="init.mp4"')
+        encryption = self.scenario['encryption']
+        for n in range(first, count):
+            if n in discontinuities:
+                lines.append("#EXT-X-DISCONTINUITY")
+            if encryption and (n == first or self._key_index(n) != self._key_index(n - 1)):
+                lines.append(self._key_tag(n))
+            lines += [f"#EXTINF:{duration:.3f},", f"{n}.{extension}"]
+        if endlist:
+            lines.append("#EXT-X-ENDLIST")
+        return "\n".join(lines) + "\n"
+
+    def master_playlist(self) -> str:
+        lines = ["#EXTM3U"]
+        for name, bandwidth in self.variants.items():
+            lines += [f"#EXT-X-STREAM-INF:BANDWIDTH={bandwidth}", f"{name}/index.m3u8"]
+        return "\n".join(lines) + "\n"
+
+    def segment_body(self, variant: str, sequence: int) -> bytes:
+        if self._media_files:
+            with open(self._media_files[sequence % len(self._media_files)], 'rb') as f:
+                return f.read()
+        size = int(self.variants[variant] * self.scenario['segment_duration'] / 8)
+        if self.scenario['format'] == 'fmp4':
+            return make_fmp4_segment(size, sequence)
+        return make_ts_segment(size, sequence, self.scenario['segment_duration'])
+
+    def _make_handler(self):
+        origin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _send(self, status: int, body: bytes, content_type: str):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                path = self.path.split('?', 1)[0]
+                try:
+                    if path == '/master.m3u8':
+                        self._send(200, origin.master_playlist().encode('ascii'), 'application/vnd.apple.mpegurl')
+                        return
+                    key_match = re.match(r'^/keys/(\d+)\.key$', path)
+                    if key_match and origin.scenario['encryption']:
+                        with origin._lock:
+                            origin.key_requests += 1
+                        self._send(200, origin.key_bytes(int(key_match.group(1))), 'application/octet-stream')
+                        return
+                    match = re.match(r'^/(\w+)/(index\.m3u8|init\.mp4|(\d+)\.(ts|m4s))$', path)
+                    if not match or match.group(1) not in origin.variants:
+                        self.send_error(404)
+                        return
+                    variant = match.group(1)
+                    if match.group(2) == 'index.m3u8':
+                        self._send(200, origin.media_playlist(variant).encode('ascii'), 'application/vnd.apple.mpegurl')
+                    elif match.group(2) == 'init.mp4':
+                        self._send(200, origin._init, 'video/mp4')
+                    else:
+                        self._serve_segment(variant, int(match.group(3)))
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def _serve_segment(self, variant: str, sequence: int):
+                action = origin._on_segment_request()
+                time.sleep(action['latency'])
+                if sequence >= origin.segment_count:
+                    self.send_error(404)
+                    return
+                if action['status']:
+                    self.send_error(action['status'])
+                    return
+
+                body = origin.segment_body(variant, sequence)
+                if origin.scenario['encryption']:
+                    body = encrypt_segment(body, origin.key_bytes(origin._key_index(sequence)), origin.key_iv(sequence))
+                self.send_response(200)
+                self.send_header('Content-Type', 'video/mp4' if origin.scenario['format'] == 'fmp4' else 'video/mp2t')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+
+                # 断开时只发送一半内容；按吞吐量上限分块发送
+                limit = len(body) // 2 if action['drop'] else len(body)
+                rate = action['throughput_kbps']
+                chunk = 16 * 1024 if not rate else max(1024, int(rate * 1000 / 8 / 20))
+                sent, start = 0, time.perf_counter()
+                while sent < limit:
+                    data = body[sent:min(limit, sent + chunk)]
+                    self.wfile.write(data)
+                    sent += len(data)
+                    if rate:
+                        ahead = sent * 8 / 1000 / rate - (time.perf_counter() - start)
+                        if ahead > 0:
+                            time.sleep(ahead)
+                if action['drop']:
+                    self.close_connection = True
+                    self.connection.shutdown(2)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地HLS源站模拟器")
+    parser.add_argument('--scenario', default='steady', help=f"内置场景（{', '.join(SCENARIOS)}）或JSON文件")
+    parser.add_argument('--port', type=int, default=8090)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    with HLSOrigin(args.scenario, port=args.port) as origin:
+        print(f"主播放列表: {origin.master_url}")
+        print(f"媒体播放列表: {origin.variant_url()}")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
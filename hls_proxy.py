@@ -0,0 +1,581 @@
+"""本地HLS缓存代理
+
+在127.0.0.1上启动HTTP服务，VLC通过它播放剧集：播放列表中的分片、密钥地址被改写为
+代理地址，分片保存在磁盘LRU缓存中，并按播放位置在线程池中预取后续分片。
+重看、回退跳转和断线恢复时直接从本地缓存读取。
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, quote, urljoin, urlparse
+
+import requests
+
+from abr import ABRSelector
+from cache_store import CacheStore, WatchHistory
+from hls import get_hls_resolver, parse_key_tag, parse_playlist, segment_at, segment_url
+from hls_crypto import get_key_cache
+from http_client import get_session
+
+logger = logging.getLogger(__name__)
+
+_URI_ATTR = re.compile(r'URI="([^"]+)"')
+
+
+def load_playback_settings(settings_file: str = 'settings.json') -> Dict:
+    """读取settings.json中的playback_settings，文件缺失或损坏时返回空字典"""
+    try:
+        with open(settings_file, 'r', encoding='utf-8') as f:
+            return json.load(f).get('playback_settings', {}) or {}
+    except (OSError, ValueError, AttributeError):
+        return {}
+
+
+class SegmentCache:
+    """磁盘分片缓存
+
+    文件的大小、最后访问时间和所属剧集记录在CacheStore的索引（index.json）中，启动时不必等待扫描目录。
+    超过容量时由后台线程淘汰：先淘汰已看完的剧集，再按最近最少使用，不淘汰正在播放的剧集。
+    """
+
+    INDEX_NAME = 'index.json'
+
+    def __init__(self, cache_dir: str = 'segment_cache', max_bytes: int = 2 * 1024 ** 3,
+                 history: Optional[WatchHistory] = None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.store = CacheStore(os.path.join(cache_dir, self.INDEX_NAME), max_bytes, self._remove_file,
+                                history=history, batch_size=50, scan=self._scan_files)
+        self.store.start()
+
+    @property
+    def total_bytes(self) -> int:
+        return self.store.total_bytes
+
+    def _scan_files(self):
+        """列出目录中已有的分片供索引核对，按修改时间作为最后访问时间"""
+        with os.scandir(self.cache_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith('.tmp') or entry.name.startswith(self.INDEX_NAME) or not entry.is_file():
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                yield entry.name, stat.st_size, stat.st_mtime, {}
+
+    @staticmethod
+    def key(url: str) -> str:
+        return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def _remove_file(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def __contains__(self, url: str) -> bool:
+        return self.key(url) in self.store
+
+    def get(self, url: str) -> Optional[bytes]:
+        key = self.key(url)
+        if key not in self.store:
+            return None
+        try:
+            with open(self._path(key), 'rb') as f:
+                data = f.read()
+            self.store.touch(key)
+            return data
+        except OSError:
+            self.store.discard(key)
+            return None
+
+    def put(self, url: str, data: bytes, episode: Optional[Dict] = None):
+        """写入分片，episode为所属剧集{'url', 'series', 'episode'}"""
+        key = self.key(url)
+        temp_file = self._path(key) + '.tmp'
+        try:
+            with open(temp_file, 'wb') as f:
+                f.write(data)
+            os.replace(temp_file, self._path(key))
+        except OSError as e:
+            logger.warning(f"写入分片缓存失败: {str(e)}")
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            return
+        self.store.record(key, len(data), **(episode or {}))
+
+    def get_stats(self) -> Dict:
+        stats = self.store.get_stats()
+        return {'entries': stats['entries'], 'bytes': stats['bytes'], 'max_bytes': self.max_bytes,
+                'evicted': stats['evicted'], 'evicted_watched': stats['evicted_watched']}
+
+
+class HLSProxy:
+    """本地HLS缓存代理
+
+    /playlist?url=<地址> 返回改写后的播放列表，/segment?url=<地址> 返回分片（优先读缓存）。
+    AES-128密钥经 /key?url=<地址> 从共享的密钥缓存读取，每个密钥只请求一次，且不写入磁盘。
+    每次播放器请求分片后，预取其后prefetch_segments个分片；已落后于播放位置的预取任务直接跳过。
+    已结束的点播列表在内存中缓存playlist_ttl秒。
+
+    多码率剧集可经 /abr?url=<主列表> 播放：返回的分片地址只带序号，实际码率在请求分片时才确定，
+    set_variant切换码率后从下一个分片开始生效，播放器无需重新打开媒体。各码率的分片数、密钥或
+    初始化分片（EXT-X-MAP）不一致时无法这样互换分片，此时固定播放起始码率。
+    """
+
+    def __init__(self, cache: Optional[SegmentCache] = None, prefetch_segments: int = 5,
+                 workers: int = 4, timeout: float = 15, port: int = 0, playlist_ttl: float = 600):
+        self.cache = cache or SegmentCache()
+        self.prefetch_segments = prefetch_segments
+        self.timeout = timeout
+        self.playlist_ttl = playlist_ttl
+        self._playlist_cache: Dict[str, Tuple[float, str]] = {}
+        self.session = get_session()
+        self.resolver = get_hls_resolver()
+        self.keys = get_key_cache()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='hls-prefetch')
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+        self._playlists: Dict[str, List[str]] = {}
+        self._positions: Dict[str, Tuple[str, int]] = {}
+        self._playheads: Dict[str, int] = {}
+        self._abr_variants: Dict[str, str] = {}
+        # 主列表 -> 各码率能否按分片序号互换
+        self._abr_switchable: Dict[str, bool] = {}
+        # 下一集预取时按码率选择规则选中的码率，播放时从该码率起播
+        self._prefetched_variants: Dict[str, str] = {}
+        # 播放列表所属的剧集，以及码率列表到主列表的对应关系，用于给缓存的分片标记剧集
+        self._episodes: Dict[str, Dict] = {}
+        self._parents: Dict[str, str] = {}
+        # 最近的源站分片下载记录(字节数, 耗时秒)，用于估算带宽
+        self._throughput = deque(maxlen=20)
+        self._stats = {'playlists': 0, 'hits': 0, 'misses': 0, 'prefetched': 0, 'next_prefetched': 0,
+                       'bytes_from_cache': 0, 'bytes_from_origin': 0}
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self._make_handler())
+        self.server.daemon_threads = True
+        self._thread = threading.Thread(target=self.server.serve_forever, name='hls-proxy', daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        self._thread.start()
+        logger.info(f"HLS缓存代理已启动: {self.base_url}")
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self.cache.store.save()
+
+    def proxy_url(self, url: str) -> str:
+        """剧集播放列表对应的代理地址"""
+        return f"{self.base_url}/playlist?url={quote(url, safe='')}"
+
+    def _segment_proxy_url(self, url: str) -> str:
+        return f"{self.base_url}/segment?url={quote(url, safe='')}"
+
+    def _key_proxy_url(self, url: str) -> str:
+        return f"{self.base_url}/key?url={quote(url, safe='')}"
+
+    def _count(self, **values):
+        with self._lock:
+            for name, value in values.items():
+                self._stats[name] += value
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats['cache'] = self.cache.get_stats()
+        stats['keys'] = self.keys.get_stats()
+        return stats
+
+    def measured_kbps(self) -> Optional[float]:
+        """最近源站分片下载的单连接带宽（kbit/s），没有记录时返回None"""
+        with self._lock:
+            total_bytes = sum(size for size, _ in self._throughput)
+            total_time = sum(elapsed for _, elapsed in self._throughput)
+        if not total_bytes or total_time <= 0:
+            return None
+        return total_bytes * 8 / 1000 / total_time
+
+    def register_episode(self, playlist_url: str, url: str, series: str = '', episode: str = ''):
+        """记录播放列表所属的剧集（url为剧集地址），其分片写入缓存时带上剧集信息"""
+        with self._lock:
+            self._episodes[playlist_url] = {'url': url, 'series': series, 'episode': episode}
+
+    def _episode_for(self, segment_url: str) -> Optional[Dict]:
+        with self._lock:
+            position = self._positions.get(segment_url)
+            playlist_url = position[0] if position else None
+            # 码率列表 -> 主列表，最多向上找几层
+            for _ in range(3):
+                if playlist_url is None or playlist_url in self._episodes:
+                    break
+                playlist_url = self._parents.get(playlist_url)
+            return self._episodes.get(playlist_url) if playlist_url else None
+
+    def rewrite_playlist(self, text: str, playlist_url: str) -> str:
+        """把播放列表中的地址改写为代理地址，并记录分片顺序用于预取"""
+        is_master = '#EXT-X-STREAM-INF' in text
+        lines, segments = [], []
+        for line in text.splitlines():
+            stripped = line.strip()
+            if stripped.startswith('#EXT-X-KEY:'):
+                key = parse_key_tag(stripped, playlist_url)
+                if key and key['keyformat'] == 'identity':
+                    line = _URI_ATTR.sub(lambda m: f'URI="{self._key_proxy_url(key["uri"])}"', line)
+            elif stripped.startswith('#'):
+                line = _URI_ATTR.sub(
+                    lambda m: f'URI="{self._segment_proxy_url(urljoin(playlist_url, m.group(1)))}"', line)
+            elif stripped:
+                url = urljoin(playlist_url, stripped)
+                if is_master or urlparse(url).path.endswith('.m3u8'):
+                    with self._lock:
+                        self._parents[url] = playlist_url
+                    line = self.proxy_url(url)
+                else:
+                    segments.append(url)
+                    line = self._segment_proxy_url(url)
+            lines.append(line)
+
+        if segments:
+            with self._lock:
+                self._playlists[playlist_url] = segments
+                for i, url in enumerate(segments):
+                    self._positions[url] = (playlist_url, i)
+        return "\n".join(lines) + "\n"
+
+    def fetch_playlist(self, url: str) -> str:
+        with self._lock:
+            cached = self._playlist_cache.get(url)
+        if cached and time.monotonic() - cached[0] < self.playlist_ttl:
+            return cached[1]
+
+        response = self.session.get(url, timeout=self.timeout)
+        response.raise_for_status()
+        self._count(playlists=1)
+        text = self.rewrite_playlist(response.text, url)
+        if '#EXT-X-STREAM-INF' in text or '#EXT-X-ENDLIST' in text:
+            with self._lock:
+                self._playlist_cache[url] = (time.monotonic(), text)
+        return text
+
+    def fetch_segment(self, url: str, prefetch: bool = False) -> bytes:
+        """读取分片：缓存命中直接返回，同一分片正在下载时等待该下载完成"""
+        data = self.cache.get(url)
+        if data is not None:
+            if not prefetch:
+                self._count(hits=1, bytes_from_cache=len(data))
+            return data
+
+        with self._lock:
+            future = self._inflight.get(url)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[url] = future
+
+        if not owner:
+            data = future.result(timeout=self.timeout * 2)
+            if not prefetch:
+                self._count(hits=1, bytes_from_cache=len(data))
+            return data
+
+        try:
+            start = time.perf_counter()
+            response = self.session.get(url, timeout=self.timeout)
+            response.raise_for_status()
+            data = response.content
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._throughput.append((len(data), elapsed))
+            self.cache.put(url, data, self._episode_for(url))
+            self._count(bytes_from_origin=len(data), **({'prefetched': 1} if prefetch else {'misses': 1}))
+            future.set_result(data)
+            return data
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(url, None)
+
+    def on_segment_requested(self, url: str):
+        """播放器请求分片后更新播放位置，并安排预取后续分片"""
+        with self._lock:
+            position = self._positions.get(url)
+            if position is None:
+                return
+            playlist_url, index = position
+            self._playheads[playlist_url] = index
+            segments = self._playlists[playlist_url]
+            upcoming = [(i, segments[i]) for i in range(index + 1, min(len(segments), index + 1 + self.prefetch_segments))
+                        if segments[i] not in self._inflight]
+
+        for i, segment_url in upcoming:
+            if segment_url not in self.cache:
+                self._executor.submit(self._prefetch, playlist_url, i, segment_url)
+
+    def _prefetch(self, playlist_url: str, index: int, url: str):
+        with self._lock:
+            playhead = self._playheads.get(playlist_url, 0)
+        # 播放位置已越过或跳转到别处，放弃该预取
+        if not playhead < index <= playhead + self.prefetch_segments:
+            return
+        try:
+            self.fetch_segment(url, prefetch=True)
+        except Exception as e:
+            logger.debug(f"预取分片失败 {url}: {str(e)}")
+
+    def prefetch_episode(self, url: str, start_seconds: float = 0, seconds: float = 30,
+                         rate_kbps: float = 2048, abr: bool = False) -> int:
+        """预取一集的播放列表、首个分片和从start_seconds起seconds秒的分片，返回下载字节数
+
+        逐个分片下载，平均速率不超过rate_kbps；当前播放的分片请求或预取进行中时先等待，
+        避免抢占正在播放的剧集的带宽。abr为True时多码率剧集按实测带宽选择码率
+        （与起播时的规则相同），并记录下来，播放时从该码率起播。
+        """
+        index = self.resolver.resolve(url)
+        if index is None or not index['segments']:
+            return 0
+        if abr and len(index['variants']) > 1:
+            variant_url = ABRSelector(index['variants']).select(self.measured_kbps())['url']
+            if variant_url != index['variant_url']:
+                index = self.resolver.resolve(variant_url)
+                if index is None or not index['segments']:
+                    return 0
+            with self._lock:
+                self._prefetched_variants[url] = variant_url
+                self._parents[variant_url] = url
+        elif index['variant_url'] != url:
+            with self._lock:
+                self._parents[index['variant_url']] = url
+        self.fetch_playlist(index['variant_url'])
+
+        first, _ = segment_at(index, int(start_seconds * 1000))
+        last, _ = segment_at(index, int((start_seconds + seconds) * 1000))
+        targets = [0] + list(range(max(first, 1), last + 1))
+
+        downloaded = 0
+        start = time.monotonic()
+        for i in targets:
+            target_url = segment_url(index, i)
+            if target_url in self.cache:
+                continue
+            # 让路给当前剧集的请求
+            deadline = time.monotonic() + self.timeout
+            while time.monotonic() < deadline:
+                with self._lock:
+                    busy = bool(self._inflight)
+                if not busy:
+                    break
+                time.sleep(0.1)
+            try:
+                downloaded += len(self.fetch_segment(target_url, prefetch=True))
+                self._count(next_prefetched=1)
+            except Exception as e:
+                logger.warning(f"预取下一集分片失败 {target_url}: {str(e)}")
+                break
+            # 按限速补足等待时间
+            wait = downloaded / (rate_kbps * 1024) - (time.monotonic() - start)
+            if wait > 0:
+                time.sleep(wait)
+
+        logger.info(f"下一集预取完成: {url} 分片 {len(targets)} 个，下载 {downloaded / 1024:.0f} KB，"
+                    f"耗时 {time.monotonic() - start:.1f}s")
+        return downloaded
+
+    def abr_url(self, master_url: str) -> str:
+        """多码率剧集的代理地址（码率可在播放中切换）"""
+        return f"{self.base_url}/abr?url={quote(master_url, safe='')}"
+
+    def set_variant(self, master_url: str, variant_url: str):
+        """切换码率，从下一个分片开始生效"""
+        with self._lock:
+            previous = self._abr_variants.get(master_url)
+            self._abr_variants[master_url] = variant_url
+            self._parents[variant_url] = master_url
+        if previous != variant_url:
+            logger.info(f"切换码率: {previous} -> {variant_url}")
+
+    def current_variant(self, master_url: str) -> Optional[str]:
+        with self._lock:
+            return self._abr_variants.get(master_url)
+
+    def prefetched_variant(self, master_url: str) -> Optional[str]:
+        """下一集预取所用的码率，没有按码率预取过时返回None"""
+        with self._lock:
+            return self._prefetched_variants.get(master_url)
+
+    def abr_switchable(self, master_url: str) -> Optional[bool]:
+        """各码率能否在播放中互换，还没检查过时返回None"""
+        with self._lock:
+            return self._abr_switchable.get(master_url)
+
+    def check_abr_switchable(self, master_url: str) -> bool:
+        """读取各码率的播放列表，分片数、媒体序号、每个分片的密钥和IV以及初始化分片都一致时才能互换
+
+        /abr列表里的密钥和EXT-X-MAP标签来自起始码率，换到密钥或初始化分片不同的码率后播放器无法解码。
+        """
+        switchable = self.abr_switchable(master_url)
+        if switchable is not None:
+            return switchable
+        index = self.resolver.resolve(master_url, raise_errors=True)
+        layouts = set()
+        for variant in index['variants']:
+            playlist = parse_playlist(self.fetch_playlist(variant['url']), variant['url'])
+            segment_keys = []
+            for segment in playlist['segments']:
+                key = playlist['keys'][segment['key']] if segment['key'] is not None else None
+                segment_keys.append(key and (key['method'], key['uri'], key['iv']))
+            layouts.add((len(playlist['segments']), playlist['media_sequence'], playlist['map'], tuple(segment_keys)))
+        switchable = len(layouts) <= 1
+        if not switchable:
+            logger.warning(f"各码率的分片数、密钥或初始化分片不一致，播放中不切换码率: {master_url}")
+        with self._lock:
+            self._abr_switchable[master_url] = switchable
+        return switchable
+
+    def abr_playlist(self, master_url: str) -> str:
+        """生成以分片序号寻址的媒体播放列表，首次请求时从预取的码率或按实测带宽选择码率"""
+        variant_url = self.current_variant(master_url)
+        if variant_url is None:
+            # 预取过下一集时从预取的码率起播
+            variant_url = self.prefetched_variant(master_url)
+        if variant_url is None:
+            index = self.resolver.resolve(master_url, raise_errors=True)
+            if index['variants']:
+                variant_url = ABRSelector(index['variants']).select(self.measured_kbps())['url']
+            else:
+                variant_url = index['variant_url']
+        if self.current_variant(master_url) is None:
+            self.set_variant(master_url, variant_url)
+        if not self.check_abr_switchable(master_url):
+            # 分片地址直接指向起始码率，之后的set_variant不再生效
+            return self.fetch_playlist(variant_url)
+
+        segment_prefix = f"{self.base_url}/segment?url="
+        lines, i = [], 0
+        for line in self.fetch_playlist(variant_url).splitlines():
+            if line.startswith(segment_prefix):
+                line = f"{self.base_url}/abrseg?url={quote(master_url, safe='')}&i={i}"
+                i += 1
+            lines.append(line)
+        return "\n".join(lines) + "\n"
+
+    def abr_segment(self, master_url: str, i: int) -> bytes:
+        """按当前码率读取第i个分片"""
+        variant_url = self.current_variant(master_url)
+        if variant_url is None:
+            raise ValueError("未选择码率")
+        with self._lock:
+            segments = self._playlists.get(variant_url)
+        if segments is None:
+            # 切换后首次使用该码率，先读取其播放列表
+            self.fetch_playlist(variant_url)
+            with self._lock:
+                segments = self._playlists[variant_url]
+        url = segments[min(i, len(segments) - 1)]
+        data = self.fetch_segment(url)
+        self.on_segment_requested(url)
+        return data
+
+    def _make_handler(self):
+        proxy = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                query = parse_qs(parsed.query)
+                target = query.get('url', [''])[0]
+                if not target.startswith(('http://', 'https://')):
+                    self.send_error(400)
+                    return
+                try:
+                    if parsed.path == '/playlist':
+                        body = proxy.fetch_playlist(target).encode('utf-8')
+                        content_type = 'application/vnd.apple.mpegurl'
+                    elif parsed.path == '/segment':
+                        body = proxy.fetch_segment(target)
+                        proxy.on_segment_requested(target)
+                        content_type = 'video/mp2t' if urlparse(target).path.endswith('.ts') else 'application/octet-stream'
+                    elif parsed.path == '/key':
+                        body = proxy.keys.get(target)
+                        content_type = 'application/octet-stream'
+                    elif parsed.path == '/abr':
+                        body = proxy.abr_playlist(target).encode('utf-8')
+                        content_type = 'application/vnd.apple.mpegurl'
+                    elif parsed.path == '/abrseg':
+                        body = proxy.abr_segment(target, int(query.get('i', ['0'])[0]))
+                        content_type = 'video/mp2t'
+                    else:
+                        self.send_error(404)
+                        return
+                except requests.HTTPError as e:
+                    code = e.response.status_code if e.response is not None else 502
+                    logger.warning(f"代理请求失败 {target}: HTTP {code}")
+                    self.send_error(code)
+                    return
+                except Exception as e:
+                    logger.warning(f"代理请求失败 {target}: {str(e)}")
+                    self.send_error(502)
+                    return
+
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    # 播放器跳转或停止时会提前断开
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+_shared_proxy: Optional[HLSProxy] = None
+_shared_lock = threading.Lock()
+
+
+def get_proxy() -> HLSProxy:
+    """获取进程共享的代理（首次调用时按playback_settings创建并启动）"""
+    global _shared_proxy
+    with _shared_lock:
+        if _shared_proxy is None:
+            settings = load_playback_settings()
+            cache = SegmentCache(max_bytes=int(settings.get('segment_cache_mb', 2048)) * 1024 * 1024)
+            _shared_proxy = HLSProxy(cache, prefetch_segments=settings.get('prefetch_segments', 5),
+                                     workers=settings.get('prefetch_workers', 4))
+            _shared_proxy.start()
+        return _shared_proxy
+
+
+def shutdown_proxy():
+    """程序退出时停止共享代理并保存分片缓存索引，没有创建过代理时什么也不做"""
+    global _shared_proxy
+    with _shared_lock:
+        proxy, _shared_proxy = _shared_proxy, None
+    if proxy is not None:
+        proxy.stop()
+        proxy.cache.store.stop()
@@ -0,0 +1,130 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Dict
+
+
+class ValidatorCache:
+    """HTTP条件请求校验信息缓存
+
+    按URL持久化ETag、Last-Modified和页面内容哈希，用于发送
+    If-None-Match / If-Modified-Since 条件请求，并统计命中情况。
+    """
+
+    def __init__(self, cache_file: str = 'http_cache.json'):
+        self.logger = logging.getLogger(__name__)
+        self.cache_file = cache_file
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._entries: Dict[str, Dict] = self._load()
+        self.stats = {
+            'hits': 0,           # 有校验信息，发送了条件请求
+            'misses': 0,         # 无校验信息，普通请求
+            'not_modified': 0,   # 服务器返回304
+            'unchanged': 0,      # 返回200但内容哈希未变化
+            'bytes_saved': 0     # 因304而少下载的字节数（按上次页面大小估算）
+        }
+
+    def _load(self) -> Dict[str, Dict]:
+        """读取缓存文件，文件缺失或损坏时从空缓存开始"""
+        try:
+            if os.path.exists(self.cache_file):
+                with open(self.cache_file, 'r', encoding='utf-8') as f:
+                    entries = json.load(f)
+                    if isinstance(entries, dict):
+                        return entries
+        except Exception as e:
+            self.logger.warning(f"读取校验缓存失败，将重新创建: {str(e)}")
+        return {}
+
+    def conditional_headers(self, url: str) -> Dict[str, str]:
+        """生成条件请求头，并记录命中/未命中"""
+        with self._lock:
+            entry = self._entries.get(url)
+            if not entry:
+                self.stats['misses'] += 1
+                return {}
+
+            self.stats['hits'] += 1
+            headers = {}
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+            return headers
+
+    def invalidate(self, url: str):
+        """删除指定URL的校验信息"""
+        with self._lock:
+            if self._entries.pop(url, None) is not None:
+                self._dirty = True
+
+    def record_not_modified(self, url: str):
+        """记录一次304响应"""
+        with self._lock:
+            self.stats['not_modified'] += 1
+            self.stats['bytes_saved'] += self._entries.get(url, {}).get('size', 0)
+
+    @staticmethod
+    def build_entry(headers, body: str) -> Dict:
+        """根据响应头和页面内容生成校验信息（尚未保存）"""
+        data = body.encode('utf-8')
+        return {
+            'etag': headers.get('ETag', ''),
+            'last_modified': headers.get('Last-Modified', ''),
+            'body_hash': hashlib.sha1(data).hexdigest(),
+            'size': len(data)
+        }
+
+    def is_unchanged(self, url: str, entry: Dict) -> bool:
+        """页面内容哈希与已保存的相同时返回True，并计入统计"""
+        with self._lock:
+            unchanged = self._entries.get(url, {}).get('body_hash') == entry['body_hash']
+            if unchanged:
+                self.stats['unchanged'] += 1
+            return unchanged
+
+    def commit(self, url: str, entry: Dict):
+        """保存校验信息
+
+        只应在页面内容已经成功应用后调用：保存后同样的内容会被当作未变化跳过。
+        """
+        with self._lock:
+            self._entries[url] = entry
+            self._dirty = True
+
+    def store(self, url: str, headers, body: str) -> bool:
+        """保存最新的校验信息
+
+        返回:
+            页面内容哈希与上次相同时返回True
+        """
+        entry = self.build_entry(headers, body)
+        unchanged = self.is_unchanged(url, entry)
+        self.commit(url, entry)
+        return unchanged
+
+    def save(self):
+        """将缓存写回磁盘（仅在有变化时）"""
+        with self._lock:
+            if not self._dirty:
+                return
+            entries = dict(self._entries)
+            self._dirty = False
+
+        temp_file = f"{self.cache_file}.tmp"
+        try:
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(entries, f, ensure_ascii=False, indent=4)
+            os.replace(temp_file, self.cache_file)
+        except Exception as e:
+            self.logger.error(f"保存校验缓存失败: {str(e)}")
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+
+    def get_stats(self) -> Dict[str, int]:
+        """获取命中统计"""
+        with self._lock:
+            return dict(self.stats)
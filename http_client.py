@@ -0,0 +1,159 @@
+"""进程共享的HTTP客户端
+
+主窗口、订阅管理和爬虫使用同一个requests.Session：按主机配置连接池大小，
+保持长连接复用，并在进程内缓存DNS解析结果。提供连接复用统计用于确认复用率。
+"""
+import logging
+import socket
+import threading
+import time
+from typing import Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+logger = logging.getLogger(__name__)
+
+# 各主机连接池大小（同时保持的长连接数），其余主机使用DEFAULT_POOL_SIZE
+HOST_POOL_SIZES = {
+    'https://www.moduzy5.com': 8,
+    'https://play.modujx10.com': 16,
+}
+DEFAULT_POOL_SIZE = 10
+
+# DNS缓存有效期（秒）
+DNS_CACHE_TTL = 300
+
+
+class _ClientStats:
+    """连接统计（线程安全）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections_opened = 0
+        self.connect_time = 0.0
+        self.dns_hits = 0
+        self.dns_misses = 0
+
+    def add(self, **values):
+        with self._lock:
+            for name, value in values.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            opened = self.connections_opened
+            return {
+                'requests': self.requests,
+                'connections_opened': opened,
+                'connections_reused': max(0, self.requests - opened),
+                'reuse_rate': round(1 - opened / self.requests, 3) if self.requests else 0.0,
+                'avg_handshake_ms': round(self.connect_time / opened * 1000, 1) if opened else 0.0,
+                'dns_hits': self.dns_hits,
+                'dns_misses': self.dns_misses
+            }
+
+
+_stats = _ClientStats()
+
+
+class _TimedHTTPConnection(HTTPConnection):
+    """记录建连耗时的HTTP连接"""
+
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        _stats.add(connections_opened=1, connect_time=time.perf_counter() - start)
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    """记录建连（TCP + TLS握手）耗时的HTTPS连接"""
+
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        _stats.add(connections_opened=1, connect_time=time.perf_counter() - start)
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class _PooledAdapter(HTTPAdapter):
+    """使用计时连接类并统计请求数的适配器"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _TimedHTTPConnectionPool,
+            'https': _TimedHTTPSConnectionPool
+        }
+
+    def send(self, request, **kwargs):
+        _stats.add(requests=1)
+        return super().send(request, **kwargs)
+
+
+class _DNSCache:
+    """进程内DNS缓存，包装socket.getaddrinfo"""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._resolve = socket.getaddrinfo
+
+    def getaddrinfo(self, host, port, family=0, type=0, proto=0, flags=0):
+        key = (host, port, family, type, proto, flags)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                _stats.add(dns_hits=1)
+                return entry[1]
+
+        result = self._resolve(host, port, family, type, proto, flags)
+        with self._lock:
+            self._entries[key] = (now + self.ttl, result)
+        _stats.add(dns_misses=1)
+        return result
+
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def _install_dns_cache():
+    """安装DNS缓存（进程内只安装一次）"""
+    if not isinstance(getattr(socket.getaddrinfo, '__self__', None), _DNSCache):
+        socket.getaddrinfo = _DNSCache(DNS_CACHE_TTL).getaddrinfo
+
+
+def get_session() -> requests.Session:
+    """获取进程共享的Session"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _install_dns_cache()
+            session = requests.Session()
+            default_adapter = _PooledAdapter(pool_connections=len(HOST_POOL_SIZES) + 4,
+                                             pool_maxsize=DEFAULT_POOL_SIZE)
+            session.mount('http://', default_adapter)
+            session.mount('https://', default_adapter)
+            for prefix, size in HOST_POOL_SIZES.items():
+                session.mount(prefix, _PooledAdapter(pool_connections=1, pool_maxsize=size))
+            _session = session
+            logger.info(f"已创建共享HTTP客户端，连接池配置: {HOST_POOL_SIZES}")
+        return _session
+
+
+def get_client_stats() -> Dict:
+    """获取连接复用统计"""
+    return _stats.snapshot()
@@ -0,0 +1,175 @@
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urlparse
+
+import requests
+
+from hls import get_hls_resolver, segment_url
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# 链接状态
+STATUS_OK = 'ok'
+STATUS_SLOW = 'slow'
+STATUS_DEAD = 'dead'
+
+STATUS_LABELS = {STATUS_SLOW: '慢', STATUS_DEAD: '失效'}
+
+
+class LinkHealthStore:
+    """剧集链接健康状态记录（link_health.json），以剧集URL为键"""
+
+    def __init__(self, store_file: str = 'link_health.json'):
+        self.logger = logging.getLogger(__name__)
+        self.store_file = store_file
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict] = self._load()
+
+    def _load(self) -> Dict[str, Dict]:
+        try:
+            if os.path.exists(self.store_file):
+                with open(self.store_file, 'r', encoding='utf-8') as f:
+                    entries = json.load(f)
+                    if isinstance(entries, dict):
+                        return entries
+        except Exception as e:
+            self.logger.warning(f"读取链接状态失败，将重新创建: {str(e)}")
+        return {}
+
+    def get(self, url: str) -> Optional[Dict]:
+        with self._lock:
+            return self._entries.get(url)
+
+    def update(self, results: Dict[str, Dict]):
+        with self._lock:
+            self._entries.update(results)
+
+    def stale(self, urls: List[str], max_age_hours: float) -> List[str]:
+        """返回从未检查或检查时间早于max_age_hours的链接"""
+        cutoff = (datetime.now() - timedelta(hours=max_age_hours)).strftime(TIME_FORMAT)
+        with self._lock:
+            return [url for url in urls
+                    if url not in self._entries or self._entries[url].get('checked_at', '') < cutoff]
+
+    def summary(self, urls: List[str]) -> Dict[str, int]:
+        """统计一组链接中各状态的数量"""
+        counts = {STATUS_OK: 0, STATUS_SLOW: 0, STATUS_DEAD: 0}
+        with self._lock:
+            for url in urls:
+                entry = self._entries.get(url)
+                if entry:
+                    counts[entry['status']] = counts.get(entry['status'], 0) + 1
+        return counts
+
+    def save(self):
+        """保存链接状态"""
+        with self._lock:
+            entries = dict(self._entries)
+        temp_file = f"{self.store_file}.tmp"
+        try:
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(entries, f, ensure_ascii=False, indent=1)
+            os.replace(temp_file, self.store_file)
+        except Exception as e:
+            self.logger.error(f"保存链接状态失败: {str(e)}")
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+
+
+class LinkChecker:
+    """并发检查剧集播放链接
+
+    每集解析播放列表（已有分片索引时跳过），再对首个分片发起Range请求读取少量字节。
+    线程池限制总并发，按主机的信号量限制单个主机的并发数。
+    """
+
+    def __init__(self, max_workers: int = 32, per_host_limit: int = 16, timeout: float = 5,
+                 slow_threshold_ms: float = 1500, store: Optional[LinkHealthStore] = None):
+        self.logger = logging.getLogger(__name__)
+        self.max_workers = max_workers
+        self.per_host_limit = per_host_limit
+        self.timeout = timeout
+        self.slow_threshold_ms = slow_threshold_ms
+        self.store = store or LinkHealthStore()
+        self.resolver = get_hls_resolver()
+        self.session = self.resolver.session
+        self._host_semaphores: Dict[str, threading.BoundedSemaphore] = {}
+        self._semaphore_lock = threading.Lock()
+
+    def _host_semaphore(self, url: str) -> threading.BoundedSemaphore:
+        host = urlparse(url).netloc
+        with self._semaphore_lock:
+            if host not in self._host_semaphores:
+                self._host_semaphores[host] = threading.BoundedSemaphore(self.per_host_limit)
+            return self._host_semaphores[host]
+
+    def _probe_segment(self, url: str) -> int:
+        """读取分片的前1KB，返回HTTP状态码"""
+        response = self.session.get(url, headers={'Range': 'bytes=0-1023'}, timeout=self.timeout, stream=True)
+        try:
+            if response.status_code == 206:
+                # 读完剩余内容，连接可以放回连接池
+                response.content
+            return response.status_code
+        finally:
+            response.close()
+
+    def probe(self, url: str) -> Dict:
+        """检查单集链接，返回状态记录"""
+        result = {'status': STATUS_DEAD, 'latency_ms': None, 'code': None, 'error': '',
+                  'checked_at': datetime.now().strftime(TIME_FORMAT)}
+        try:
+            with self._host_semaphore(url):
+                # 从拿到主机并发名额开始计时，排队时间不计入延迟
+                start = time.perf_counter()
+                index = self.resolver.resolve(url, raise_errors=True)
+                if not index['segments']:
+                    raise ValueError("播放列表中没有分片")
+                code = self._probe_segment(segment_url(index, 0))
+                latency = (time.perf_counter() - start) * 1000
+            result['code'] = code
+            result['latency_ms'] = round(latency)
+            if code >= 400:
+                result['error'] = f"分片请求失败: HTTP {code}"
+            else:
+                result['status'] = STATUS_SLOW if latency > self.slow_threshold_ms else STATUS_OK
+        except requests.HTTPError as e:
+            result['code'] = e.response.status_code if e.response is not None else None
+            result['error'] = str(e)
+        except Exception as e:
+            result['error'] = str(e)
+        return result
+
+    def check(self, urls: List[str], progress: Optional[Callable[[int, int], None]] = None) -> Dict[str, Dict]:
+        """并发检查一组链接并保存结果
+
+        参数:
+            progress: 进度回调progress(已完成数, 总数)，在工作线程中调用
+        """
+        urls = list(dict.fromkeys(urls))
+        results = {}
+        if not urls:
+            return results
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(urls))) as executor:
+            for done, (url, result) in enumerate(zip(urls, executor.map(self.probe, urls)), 1):
+                results[url] = result
+                if progress:
+                    progress(done, len(urls))
+
+        self.store.update(results)
+        self.store.save()
+
+        counts = self.store.summary(urls)
+        self.logger.info(
+            f"链接检查完成: {len(urls)}个，耗时 {time.perf_counter() - start:.1f}s，"
+            f"正常 {counts[STATUS_OK]}，慢 {counts[STATUS_SLOW]}，失效 {counts[STATUS_DEAD]}"
+        )
+        return results
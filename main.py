@@ -6,7 +6,11 @@ import os
 import logging
 from datetime import datetime
 from video_player import VideoPlayerWindow
-from crawler import VideoCrawler
+from vlc_pool import get_player_pool, shutdown_player_pool
+from crawler import VideoCrawler, load_update_settings
+from download_manager import get_download_manager, shutdown_download_manager
+from hls_proxy import shutdown_proxy
+from link_checker import LinkChecker, STATUS_DEAD, STATUS_SLOW
 from subscription_manager import SubscriptionManager
 import threading
 
@@ -61,7 +65,7 @@ class VideoPlayer(tk.Tk):
         self.update_btn = ttk.Button(
             btn_frame,
             text="检查更新",
-            command=self.check_updates
+            command=lambda: self.check_updates(force=True)
         )
         self.update_btn.pack(side=tk.LEFT, padx=5)
 
@@ -86,6 +90,17 @@ class VideoPlayer(tk.Tk):
             self.crawler = VideoCrawler()
             self.updating = False
 
+            # 初始化链接检查
+            self.link_checker = LinkChecker()
+            self.checking_links = False
+
+            # 离线下载
+            self.downloads = get_download_manager()
+            self._download_timer = None
+
+            # 后台创建共享的VLC实例并预建播放器，打开播放窗口时直接取用
+            threading.Thread(target=lambda: get_player_pool().warm(), daemon=True).start()
+
             # 创建主框架
             self.main_frame = ttk.Frame(self)
             self.main_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
@@ -110,12 +125,30 @@ class VideoPlayer(tk.Tk):
             # 程序启动后自动检查更新（延迟1秒确保UI就绪）
             self.after(1000, self.auto_check_updates)
 
+            # 退出时保存缓存和下载索引（后台线程每30秒才保存一次）
+            self.protocol("WM_DELETE_WINDOW", self.on_closing)
+
         except Exception as e:
             self.logger.error(f"初始化失败: {str(e)}")
             messagebox.showerror("错误", f"初始化失败: {str(e)}")
             self.destroy()
             raise
 
+    def on_closing(self):
+        """关闭播放窗口，停止代理和下载并保存索引，最后释放播放器池"""
+        for child in self.winfo_children():
+            if isinstance(child, VideoPlayerWindow):
+                try:
+                    child.on_closing()
+                except Exception as e:
+                    self.logger.error(f"关闭播放窗口失败: {str(e)}")
+        for shutdown in (shutdown_proxy, shutdown_download_manager, shutdown_player_pool):
+            try:
+                shutdown()
+            except Exception as e:
+                self.logger.error(f"退出时清理失败: {str(e)}")
+        self.destroy()
+
     def show_subscription_manager(self):
         """显示订阅管理对话框"""
         try:
@@ -297,10 +330,26 @@ class VideoPlayer(tk.Tk):
         self.update_button = ttk.Button(
             left_frame,
             text="检查更新",
-            command=self.check_updates
+            command=lambda: self.check_updates(force=True)
         )
         self.update_button.pack(side=tk.LEFT, padx=5)
 
+        # 链接检查按钮
+        self.link_check_button = ttk.Button(
+            left_frame,
+            text="检查链接",
+            command=lambda: self.check_links(force=True)
+        )
+        self.link_check_button.pack(side=tk.LEFT, padx=5)
+
+        # 离线下载按钮
+        self.download_button = ttk.Button(
+            left_frame,
+            text="下载选中",
+            command=self.download_selected
+        )
+        self.download_button.pack(side=tk.LEFT, padx=5)
+
         # 更新状态标签
         self.status_label = ttk.Label(
             left_frame,
@@ -367,8 +416,9 @@ class VideoPlayer(tk.Tk):
 
 4. 更新检查：
    - 点击"检查更新"手动更新
-   - 每小时自动检查更新
+   - 按各剧更新规律自动检查更新（已完结的剧不再自动检查）
    - 状态栏显示更新进度
+   - 点击"检查链接"检查全部剧集链接，列表和选集菜单中标记失效/慢的剧集
 
 快捷键：
 - Enter: 播放选中剧集
@@ -390,8 +440,12 @@ class VideoPlayer(tk.Tk):
                     widget.focus_set()
                     return
 
-    def check_updates(self):
-        """检查剧集更新"""
+    def check_updates(self, force=False):
+        """检查剧集更新
+
+        参数:
+            force: 手动检查时忽略检查计划，刷新全部订阅
+        """
         if self.updating:
             return
 
@@ -399,12 +453,15 @@ class VideoPlayer(tk.Tk):
         self.update_button.configure(state='disabled')
         self.status_var.set("正在检查更新...")
 
+        # 记录变更记录当前位置，更新完成后只读取本次新增的记录
+        feed_offset = self.crawler.change_feed.offset()
+
         # 在后台线程中执行更新
         def update_task():
             try:
                 # 检查剧集更新
                 try:
-                    episode_updates = self.crawler.update_subscriptions()
+                    episode_updates = self.crawler.update_subscriptions(force=force)
                     if not isinstance(episode_updates, dict):
                         episode_updates = {'_default': {'has_update': bool(episode_updates)}}
 
@@ -417,7 +474,7 @@ class VideoPlayer(tk.Tk):
                         f.truncate()
 
                     # 在主线程中更新UI
-                    self.after(0, self.update_complete, True, None, episode_updates)
+                    self.after(0, self.update_complete, True, None, episode_updates, feed_offset)
                 except Exception as e:
                     self.after(0, self.update_complete, False, str(e), None)
             except Exception as e:
@@ -427,11 +484,14 @@ class VideoPlayer(tk.Tk):
         thread.daemon = True
         thread.start()
 
-    def update_complete(self, success, error=None, episode_updates=None):
+    def update_complete(self, success, error=None, episode_updates=None, feed_offset=None):
         """更新完成后的处理"""
         self.updating = False
         self.update_button.configure(state='normal')
 
+        # 按最新的检查计划重新安排自动检查
+        self.schedule_update_check()
+
         if success:
             self.status_var.set("更新成功")
             # 重新加载配置
@@ -440,25 +500,144 @@ class VideoPlayer(tk.Tk):
             if hasattr(self, 'tree') and self.tree:
                 self.refresh_video_list()
 
-            # 显示剧集更新通知
-            if episode_updates and isinstance(episode_updates, dict):
+            # 显示剧集更新通知（读取本次检查写入的剧集变更记录）
+            if feed_offset is not None:
                 try:
-                    new_episodes = [k for k, v in episode_updates.items()
-                                    if isinstance(v, dict) and v.get('has_update')]
-                    if new_episodes:
-                        msg = f"发现新剧集:\n" + "\n".join(new_episodes)
+                    changes, _ = self.crawler.change_feed.read_since(feed_offset)
+                    lines = []
+                    for change in changes:
+                        if change['added']:
+                            titles = [ep['title'] for ep in change['added']]
+                            preview = "、".join(titles[:5]) + (" 等" if len(titles) > 5 else "")
+                            lines.append(f"{change['title']}: 新增{len(titles)}集 ({preview})")
+                        if change['retitled']:
+                            lines.append(f"{change['title']}: {len(change['retitled'])}集标题变更")
+                        if change['removed']:
+                            lines.append(f"{change['title']}: {len(change['removed'])}集已下架")
+                    if lines:
+                        msg = f"发现剧集变化:\n" + "\n".join(lines)
                         self.show_notification("剧集更新", msg)
                 except Exception as e:
                     self.logger.error(f"处理更新通知时出错: {str(e)}")
 
             # 刷新最后更新时间显示
             self.load_last_update_time()
+
+            # 后台检查新增或过期的剧集链接
+            self.check_links()
         else:
             error_msg = error if error else "更新失败"
             self.status_var.set(f"更新失败: {error_msg}")
             self.logger.error(f"更新失败: {error_msg}")
             messagebox.showerror("错误", f"更新失败: {error_msg}")
 
+    def check_links(self, force=False):
+        """后台检查剧集链接
+
+        参数:
+            force: 检查全部剧集，默认只检查从未检查或超过link_check_hours未检查的剧集
+        """
+        if self.checking_links:
+            return
+
+        config = getattr(self, 'config', None)
+        subs = config.get('subscriptions', []) if isinstance(config, dict) else []
+        urls = [ep['url'] for sub in subs for ep in sub.get('episodes', []) if ep.get('url')]
+        if not force:
+            settings = load_update_settings()
+            urls = self.link_checker.store.stale(urls, settings.get('link_check_hours', 24))
+        if not urls:
+            return
+
+        self.checking_links = True
+        self.link_check_button.configure(state='disabled')
+        self.status_var.set(f"正在检查链接 0/{len(urls)}...")
+
+        def on_progress(done, total):
+            if done % 50 == 0 or done == total:
+                self.after(0, self.status_var.set, f"正在检查链接 {done}/{total}...")
+
+        def check_task():
+            try:
+                results = self.link_checker.check(urls, on_progress)
+                self.after(0, self.link_check_complete, results, None)
+            except Exception as e:
+                self.after(0, self.link_check_complete, None, str(e))
+
+        thread = threading.Thread(target=check_task)
+        thread.daemon = True
+        thread.start()
+
+    def link_check_complete(self, results, error=None):
+        """链接检查完成后的处理"""
+        self.checking_links = False
+        self.link_check_button.configure(state='normal')
+
+        if error:
+            self.status_var.set(f"链接检查失败: {error}")
+            self.logger.error(f"链接检查失败: {error}")
+            return
+
+        dead = sum(1 for result in results.values() if result['status'] == STATUS_DEAD)
+        slow = sum(1 for result in results.values() if result['status'] == STATUS_SLOW)
+        self.status_var.set(f"链接检查完成: {len(results)}个，失效{dead}，慢{slow}")
+        if hasattr(self, 'tree') and self.tree:
+            self.refresh_video_list()
+
+    def download_selected(self):
+        """把列表中选中的订阅加入离线下载队列"""
+        if not hasattr(self, 'tree') or not self.tree:
+            return
+        titles = {self.tree.item(item, 'values')[1] for item in self.tree.selection()}
+        subs = [video for video in self.config.get('subscriptions', []) if video.get('title') in titles]
+        if not subs:
+            messagebox.showwarning("警告", "请先选择要下载的剧集")
+            return
+
+        queued = sum(len(self.downloads.enqueue_series(video)) for video in subs)
+        self.logger.info(f"加入离线下载: {len(subs)}部，{queued}集")
+        if not queued:
+            self.status_var.set("选中的剧集已全部下载")
+            return
+        self.status_var.set(f"已加入下载队列: {queued}集")
+        if self._download_timer is None:
+            self._download_timer = self.after(1000, self.update_download_status)
+
+    def update_download_status(self):
+        """每秒在状态栏显示下载进度和总体速度，队列完成后停止"""
+        self._download_timer = None
+        progress = self.downloads.get_progress()
+        episodes = progress['episodes']
+        finished = episodes['done'] + episodes['failed'] + episodes['cancelled']
+        total = finished + progress['active']
+        if progress['active']:
+            speed = progress['speed_kbs'] or 0
+            current = progress['current']
+            current_text = (f" {current['title']} {current['done_segments']}/{current['total_segments']}"
+                            if current else "")
+            self.status_var.set(f"下载中 {finished}/{total}集{current_text} "
+                                f"{progress['bytes'] / 1024 / 1024:.0f}MB {speed / 1024:.1f}MB/s")
+            self._download_timer = self.after(1000, self.update_download_status)
+            return
+
+        text = f"下载完成: {episodes['done']}集，{progress['bytes'] / 1024 / 1024:.0f}MB"
+        if episodes['failed']:
+            text += f"，失败{episodes['failed']}集"
+        self.status_var.set(text)
+
+    def link_summary(self, video):
+        """订阅的链接状态摘要，用于列表显示"""
+        urls = [ep['url'] for ep in video.get('episodes', []) if ep.get('url')]
+        counts = self.link_checker.store.summary(urls)
+        if not any(counts.values()):
+            return ""
+        parts = []
+        if counts[STATUS_DEAD]:
+            parts.append(f"失效{counts[STATUS_DEAD]}")
+        if counts[STATUS_SLOW]:
+            parts.append(f"慢{counts[STATUS_SLOW]}")
+        return " ".join(parts) or "正常"
+
     def show_notification(self, title, message):
         """显示更新通知"""
         top = tk.Toplevel(self)
@@ -482,7 +661,7 @@ class VideoPlayer(tk.Tk):
 
         # 重新添加视频
         for index,video in enumerate(self.config['subscriptions']):
-            self.tree.insert('', tk.END, values=(f"{index:03d}",video['title'],f"{video['total_episodes']}", video['update_time']))
+            self.tree.insert('', tk.END, values=(f"{index:03d}",video['title'],f"{video['total_episodes']}", video['update_time'], self.link_summary(video)))
 
     def load_config(self):
         """加载配置文件"""
@@ -544,10 +723,10 @@ class VideoPlayer(tk.Tk):
                 'normal': ('Microsoft YaHei', 10)
             },
             'columns': {
-                'tree': ('id','title', 'episodes', 'update_time'),
-                'display': ('序号','剧名','剧集', '更新时间'),
-                'widths': {'序号': 20,'剧名': 90, '剧集': 30, '更新时间': 90},
-                'min_widths': {'序号': 20,'剧名': 90,'剧集': 30, '更新时间': 90}
+                'tree': ('id','title', 'episodes', 'update_time', 'links'),
+                'display': ('序号','剧名','剧集', '更新时间', '链接'),
+                'widths': {'序号': 20,'剧名': 90, '剧集': 30, '更新时间': 90, '链接': 60},
+                'min_widths': {'序号': 20,'剧名': 90,'剧集': 30, '更新时间': 90, '链接': 40}
             },
             'padding': {
                 'x_small': 3,
@@ -735,7 +914,8 @@ class VideoPlayer(tk.Tk):
                         f"{index:03d}",  # 格式化序号为3位数
                         f"{video['total_episodes']}",
                         episode_title,
-                        video['last_update']
+                        video['last_update'],
+                        self.link_summary(video)
                     ), tags=(str(episode_num),))
 
             # 应用当前排序方式
@@ -809,16 +989,39 @@ class VideoPlayer(tk.Tk):
             self.tree.move(item, '', index)
 
     def schedule_update_check(self):
-        """安排定时更新检查"""
-        # 每小时检查一次更新
-        self.after(3600000, self.auto_update_check)
+        """按订阅的检查计划安排下一次自动检查"""
+        if getattr(self, '_update_check_timer', None):
+            self.after_cancel(self._update_check_timer)
+            self._update_check_timer = None
+
+        settings = load_update_settings()
+        if not settings.get('auto_check', True):
+            return
+
+        # 最长间隔为check_interval_hours，最短1分钟
+        max_delay = settings.get('check_interval_hours', 6) * 3600
+        delay = max_delay
+        try:
+            config = getattr(self, 'config', None)
+            subs = config.get('subscriptions', []) if isinstance(config, dict) else []
+            next_due = self.crawler.scheduler.next_due_time(subs)
+            if next_due:
+                delay = (next_due - datetime.now()).total_seconds()
+        except Exception as e:
+            self.logger.error(f"计算下次检查时间失败: {str(e)}")
+        delay = min(max(delay, 60), max_delay)
+
+        self.logger.info(f"下次自动检查更新: {delay / 60:.0f}分钟后")
+        self._update_check_timer = self.after(int(delay * 1000), self.auto_update_check)
 
     def auto_update_check(self):
-        """自动更新检查"""
+        """自动更新检查（只检查到期的订阅）"""
+        self._update_check_timer = None
         if not self.updating:
+            # 检查完成后由update_complete重新安排
             self.check_updates()
-        # 重新安排下一次检查
-        self.schedule_update_check()
+        else:
+            self.schedule_update_check()
 
     def on_video_select(self, event):
         """处理视频选择事件"""
@@ -0,0 +1,258 @@
+"""播放质量（QoE）记录与统计
+
+每次播放一集记录一个会话：起播耗时、首帧时间、卡顿次数和总时长、恢复次数、读取字节数、
+切集耗时等，结束时以一行JSON追加到qoe_sessions.jsonl。
+
+用法:
+    python qoe.py [--file qoe_sessions.jsonl] [--by series|host] [--days 7]
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# 参与统计的毫秒类指标
+TIMING_METRICS = ('startup_ms', 'first_frame_ms', 'switch_ms', 'stall_ms', 'seek_wait_ms')
+
+
+class QoESession:
+    """单集播放会话的质量指标
+
+    时间都用time.perf_counter()计算。切集时传入switch_started（用户点下一集或自动切集的时刻），
+    首帧出现时记录切集耗时。卡顿只统计起播之后的缓冲，由on_tick按播放器状态累计；
+    跳转（拖动进度条、跳过片头）后等待画面恢复的时间单独记在seek_wait_ms，不算卡顿。
+    """
+
+    def __init__(self, url: str, series: str = '', episode: str = '', episode_index: int = 0,
+                 switch_started: Optional[float] = None, gapless: bool = False):
+        self.url = url
+        self.series = series
+        self.episode = episode
+        self.episode_index = episode_index
+        self.gapless = gapless
+        self.started_at = datetime.now().strftime(TIME_FORMAT)
+        self._start = time.perf_counter()
+        self._switch_started = switch_started
+        self.startup_ms: Optional[float] = None
+        self.first_frame_ms: Optional[float] = None
+        self.switch_ms: Optional[float] = None
+        self.rebuffer_count = 0
+        self.stall_ms = 0.0
+        self.seek_count = 0
+        self.seek_wait_ms = 0.0
+        self.recovery_attempts = 0
+        self.bytes_read = 0
+        self.caching_ms: Optional[int] = None
+        self.finished = False
+        self._stall_started: Optional[float] = None
+        self._seek_wait_started: Optional[float] = None
+        self._media_bytes = 0
+
+    def mark_playing(self):
+        """MediaPlayerPlaying：只记录第一次"""
+        if self.startup_ms is None:
+            self.startup_ms = (time.perf_counter() - self._start) * 1000
+
+    def mark_first_frame(self):
+        """首个画面已输出：只记录第一次"""
+        if self.first_frame_ms is not None:
+            return
+        now = time.perf_counter()
+        self.first_frame_ms = (now - self._start) * 1000
+        if self._switch_started is not None:
+            self.switch_ms = (now - self._switch_started) * 1000
+
+    def mark_recovery(self):
+        self.recovery_attempts += 1
+
+    def mark_seek(self, now: Optional[float] = None):
+        """用户跳转：起播前的跳转（续播位置）不计；正在进行的卡顿到此结束"""
+        if self.startup_ms is None:
+            return
+        now = time.perf_counter() if now is None else now
+        self.seek_count += 1
+        if self._stall_started is not None:
+            self.stall_ms += (now - self._stall_started) * 1000
+            self._stall_started = None
+
+    def _end_seek_wait(self, now: float):
+        if self._seek_wait_started is not None:
+            self.seek_wait_ms += (now - self._seek_wait_started) * 1000
+            self._seek_wait_started = None
+
+    def on_tick(self, stalled: bool, read_bytes: Optional[int] = None, now: Optional[float] = None,
+                seeking: bool = False):
+        """每个节拍更新卡顿状态和读取字节数
+
+        参数:
+            stalled: 播放器正在缓冲或已因缓冲暂停
+            read_bytes: 当前媒体的累计读取字节数（重新加载媒体后从0开始）
+            seeking: 仍在跳转宽限期内，此时的缓冲计入seek_wait_ms；宽限期过后仍在缓冲才开始算卡顿
+        """
+        now = time.perf_counter() if now is None else now
+        if read_bytes is not None:
+            if read_bytes < self._media_bytes:
+                # 恢复播放时重新加载了媒体，之前读取的字节已计入
+                self.bytes_read += self._media_bytes
+            self._media_bytes = read_bytes
+
+        if self.startup_ms is None:
+            return
+        if seeking:
+            if stalled and self._seek_wait_started is None:
+                self._seek_wait_started = now
+            elif not stalled:
+                self._end_seek_wait(now)
+            return
+        self._end_seek_wait(now)
+        if stalled and self._stall_started is None:
+            self._stall_started = now
+            self.rebuffer_count += 1
+        elif not stalled and self._stall_started is not None:
+            self.stall_ms += (now - self._stall_started) * 1000
+            self._stall_started = None
+
+    def finish(self, position_ms: Optional[int] = None) -> Dict:
+        """结束会话，返回要写入的记录"""
+        now = time.perf_counter()
+        if self._stall_started is not None:
+            self.stall_ms += (now - self._stall_started) * 1000
+            self._stall_started = None
+        self._end_seek_wait(now)
+        self.finished = True
+
+        def rounded(value):
+            return round(value) if value is not None else None
+
+        return {
+            'started_at': self.started_at,
+            'series': self.series,
+            'episode': self.episode,
+            'episode_index': self.episode_index,
+            'url': self.url,
+            'host': urlparse(self.url).netloc,
+            'gapless': self.gapless,
+            'caching_ms': self.caching_ms,
+            'startup_ms': rounded(self.startup_ms),
+            'first_frame_ms': rounded(self.first_frame_ms),
+            'switch_ms': rounded(self.switch_ms),
+            'rebuffer_count': self.rebuffer_count,
+            'stall_ms': round(self.stall_ms),
+            'seek_count': self.seek_count,
+            'seek_wait_ms': round(self.seek_wait_ms),
+            'recovery_attempts': self.recovery_attempts,
+            'bytes_read': self.bytes_read + self._media_bytes,
+            'watch_ms': round((now - self._start) * 1000),
+            'position_ms': position_ms
+        }
+
+
+class QoELog:
+    """按行追加的会话记录文件（JSONL）"""
+
+    def __init__(self, log_file: str = 'qoe_sessions.jsonl'):
+        self.log_file = log_file
+        self._lock = threading.Lock()
+
+    def append(self, record: Dict):
+        line = json.dumps(record, ensure_ascii=False)
+        try:
+            with self._lock, open(self.log_file, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+        except OSError as e:
+            logger.error(f"写入播放质量记录失败: {str(e)}")
+
+    def load(self, since: Optional[datetime] = None) -> List[Dict]:
+        """读取全部记录，跳过损坏的行"""
+        records = []
+        if not os.path.exists(self.log_file):
+            return records
+        cutoff = since.strftime(TIME_FORMAT) if since else ''
+        with open(self.log_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get('started_at', '') >= cutoff:
+                    records.append(record)
+        return records
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """第p百分位（线性插值），没有数据时返回None"""
+    if not values:
+        return None
+    values = sorted(values)
+    rank = (len(values) - 1) * p / 100
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+def summarize(records: List[Dict], by: str = 'series') -> Dict[str, Dict]:
+    """按剧集或主机分组汇总：各耗时指标的P50/P90，以及卡顿率、恢复次数和流量"""
+    groups: Dict[str, List[Dict]] = {}
+    for record in records:
+        groups.setdefault(record.get(by) or '未知', []).append(record)
+
+    summary = {}
+    for key, items in groups.items():
+        row = {'sessions': len(items)}
+        for metric in TIMING_METRICS:
+            values = [item[metric] for item in items if item.get(metric) is not None]
+            row[metric] = {'p50': percentile(values, 50), 'p90': percentile(values, 90), 'count': len(values)}
+        watch_ms = sum(item.get('watch_ms', 0) for item in items)
+        row['rebuffers_per_hour'] = (sum(item.get('rebuffer_count', 0) for item in items) / (watch_ms / 3600000)
+                                     if watch_ms else 0)
+        row['stall_ratio'] = sum(item.get('stall_ms', 0) for item in items) / watch_ms if watch_ms else 0
+        row['recovery_attempts'] = sum(item.get('recovery_attempts', 0) for item in items)
+        row['bytes_read'] = sum(item.get('bytes_read', 0) for item in items)
+        summary[key] = row
+    return summary
+
+
+def print_report(summary: Dict[str, Dict], by: str):
+    def fmt(value):
+        return f"{value:7.0f}" if value is not None else "      -"
+
+    print(f"{'剧集' if by == 'series' else '主机':<24} 会话  起播P50/P90     首帧P50/P90     切集P50/P90     "
+          f"卡顿/小时 卡顿占比 恢复  流量MB")
+    for key, row in sorted(summary.items(), key=lambda item: -item[1]['sessions']):
+        cells = "".join(f"{fmt(row[m]['p50'])}/{fmt(row[m]['p90']).strip():<7}"
+                        for m in ('startup_ms', 'first_frame_ms', 'switch_ms'))
+        print(f"{key[:24]:<24} {row['sessions']:4d} {cells} {row['rebuffers_per_hour']:8.1f} "
+              f"{row['stall_ratio'] * 100:7.2f}% {row['recovery_attempts']:4d} {row['bytes_read'] / 1024 / 1024:7.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="播放质量统计")
+    parser.add_argument('--file', default='qoe_sessions.jsonl')
+    parser.add_argument('--by', choices=('series', 'host'), default='series')
+    parser.add_argument('--days', type=float, help="只统计最近几天的会话")
+    parser.add_argument('--json', action='store_true', help="输出JSON")
+    args = parser.parse_args()
+
+    since = datetime.now() - timedelta(days=args.days) if args.days else None
+    records = QoELog(args.file).load(since)
+    if not records:
+        print("没有播放质量记录")
+        return
+    summary = summarize(records, args.by)
+    if args.json:
+        print(json.dumps(summary, ensure_ascii=False, indent=1))
+    else:
+        print_report(summary, args.by)
+
+
+if __name__ == '__main__':
+    main()
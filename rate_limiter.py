@@ -0,0 +1,155 @@
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析Retry-After头（秒数或HTTP日期），无法解析时返回None"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+class _HostBucket:
+    """单个主机的令牌桶状态"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.backoff_level = 0
+        self.waiting = 0
+        self.throttle_events = 0
+
+
+class HostRateLimiter:
+    """进程级按主机限速器
+
+    每个主机一个令牌桶。遇到429/503时按Retry-After或带抖动的指数退避暂停该主机，
+    并将速率减半；请求成功后逐步恢复到基准速率。所有VideoCrawler实例共享同一个限速器，
+    等待在acquire中进行，不再由每个请求各自sleep。
+    """
+
+    def __init__(self, rate: float = 4.0, burst: int = 4, min_rate: float = 0.25,
+                 base_backoff: float = 1.0, max_backoff: float = 60.0):
+        self.logger = logging.getLogger(__name__)
+        self.base_rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._buckets: Dict[str, _HostBucket] = {}
+        self._cond = threading.Condition()
+
+    def _bucket(self, url: str) -> _HostBucket:
+        host = urlparse(url).netloc
+        if host not in self._buckets:
+            self._buckets[host] = _HostBucket(self.base_rate, self.burst)
+        return self._buckets[host]
+
+    def _refill(self, bucket: _HostBucket, now: float):
+        bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * bucket.rate)
+        bucket.updated = now
+
+    def acquire(self, url: str, timeout: Optional[float] = None) -> bool:
+        """等待目标主机的令牌，超时返回False"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            bucket = self._bucket(url)
+            bucket.waiting += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(bucket, now)
+                    wait = max(bucket.blocked_until - now, (1 - bucket.tokens) / bucket.rate)
+                    if wait <= 0:
+                        bucket.tokens -= 1
+                        return True
+                    if deadline is not None:
+                        if now >= deadline:
+                            return False
+                        wait = min(wait, deadline - now)
+                    self._cond.wait(wait)
+            finally:
+                bucket.waiting -= 1
+
+    def _backoff_delay(self, bucket: _HostBucket) -> float:
+        """带抖动的指数退避时长，在[上限/2, 上限]内随机"""
+        ceiling = min(self.max_backoff, self.base_backoff * (2 ** bucket.backoff_level))
+        bucket.backoff_level += 1
+        return random.uniform(ceiling / 2, ceiling)
+
+    def on_throttled(self, url: str, retry_after: Optional[str] = None) -> float:
+        """服务器限流（429/503）：暂停该主机并降低速率，返回暂停秒数"""
+        with self._cond:
+            bucket = self._bucket(url)
+            delay = parse_retry_after(retry_after)
+            if delay is None:
+                delay = self._backoff_delay(bucket)
+            else:
+                bucket.backoff_level += 1
+            delay = min(delay, self.max_backoff)
+
+            bucket.rate = max(self.min_rate, bucket.rate / 2)
+            bucket.blocked_until = max(bucket.blocked_until, time.monotonic() + delay)
+            bucket.throttle_events += 1
+            self._cond.notify_all()
+        self.logger.warning(f"主机限流 {urlparse(url).netloc}: 暂停 {delay:.1f}s，速率降至 {bucket.rate:.2f}/s")
+        return delay
+
+    def on_error(self, url: str) -> float:
+        """网络错误：按指数退避暂停该主机，不调整速率，返回暂停秒数"""
+        with self._cond:
+            bucket = self._bucket(url)
+            delay = self._backoff_delay(bucket)
+            bucket.blocked_until = max(bucket.blocked_until, time.monotonic() + delay)
+            self._cond.notify_all()
+        return delay
+
+    def on_success(self, url: str):
+        """请求成功：重置退避并逐步恢复速率"""
+        with self._cond:
+            bucket = self._bucket(url)
+            bucket.backoff_level = 0
+            if bucket.rate < self.base_rate:
+                bucket.rate = min(self.base_rate, bucket.rate + self.base_rate / 10)
+
+    def get_metrics(self) -> Dict[str, Dict]:
+        """各主机当前速率、排队数和限流次数"""
+        with self._cond:
+            now = time.monotonic()
+            return {
+                host: {
+                    'rate': round(bucket.rate, 3),
+                    'queue_depth': bucket.waiting,
+                    'throttle_events': bucket.throttle_events,
+                    'blocked_for': round(max(0.0, bucket.blocked_until - now), 3)
+                }
+                for host, bucket in self._buckets.items()
+            }
+
+
+_shared_limiter: Optional[HostRateLimiter] = None
+_shared_lock = threading.Lock()
+
+
+def get_rate_limiter(**kwargs) -> HostRateLimiter:
+    """获取进程共享的限速器，参数仅在首次创建时生效"""
+    global _shared_limiter
+    with _shared_lock:
+        if _shared_limiter is None:
+            _shared_limiter = HostRateLimiter(**kwargs)
+        return _shared_limiter
@@ -9,7 +9,8 @@ class SubscriptionManager(tk.Toplevel):
     def __init__(self, parent):
         super().__init__(parent)
         self.parent = parent
-        self.crawler = VideoCrawler()
+        # 优先复用主窗口的爬虫，共享连接池与条件请求缓存
+        self.crawler = getattr(parent, 'crawler', None) or VideoCrawler()
 
         self.title("订阅管理")
         self.geometry("600x400")
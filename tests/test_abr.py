@@ -0,0 +1,88 @@
+"""码率选择：质量打分和ABRSelector按代理实测吞吐量升降码率"""
+import pytest
+
+from abr import ABRSelector, QualityScorer
+from hls import HLSResolver
+from hls_origin import HLSOrigin
+from hls_proxy import HLSProxy, SegmentCache
+
+VARIANTS = [{'name': 'low', 'bandwidth': 400000}, {'name': 'mid', 'bandwidth': 1200000},
+            {'name': 'high', 'bandwidth': 4000000}]
+
+
+@pytest.fixture
+def proxy(tmp_path):
+    # 不预取，吞吐量只来自逐段读取的分片
+    proxy = HLSProxy(SegmentCache(str(tmp_path / 'segment_cache')), prefetch_segments=0)
+    proxy.resolver = HLSResolver(cache_dir=str(tmp_path / 'hls_cache'))
+    proxy.start()
+    yield proxy
+    proxy.stop()
+    proxy.cache.store.stop()
+
+
+def test_score_uses_loss_deltas():
+    scorer = QualityScorer()
+    # 第一次只记录基准值，之前累计的丢帧不扣分
+    assert scorer.score((40, 2, 1)) == 100
+    assert scorer.score((40, 2, 1)) == 100
+    assert scorer.score((45, 2, 1)) == 90
+    assert scorer.score((45, 3, 2)) == 85
+    # 重新加载媒体后计数器从0开始
+    assert scorer.score((1, 0, 0)) == 98
+    scorer.reset()
+    assert scorer.score((30, 0, 0)) == 100
+
+
+def test_score_penalizes_new_stalls():
+    scorer = QualityScorer()
+    scorer.score((0, 0, 0), rebuffers=0, stall_ms=0)
+    assert scorer.score((0, 0, 0), rebuffers=1, stall_ms=2000) == 50
+    assert scorer.score((0, 0, 0), rebuffers=1, stall_ms=2000) == 100
+
+
+def play_trace(proxy, master_url, selector, scorer, trace):
+    """按(累计丢帧, 累计丢失音频缓冲)逐段播放：读取分片、打分、按代理实测吞吐量更新码率"""
+    variants = []
+    for i, (lost_pictures, lost_abuffers) in enumerate(trace):
+        proxy.abr_segment(master_url, i)
+        score = scorer.score((lost_pictures, lost_abuffers, 0))
+        variant = selector.update(proxy.measured_kbps(), score)
+        if variant:
+            proxy.set_variant(master_url, variant['url'])
+        variants.append(selector.current_variant['url'])
+    return variants
+
+
+def test_low_rendition_steps_up_on_clean_playback(proxy):
+    scenario = {'name': 'abr', 'segments': 12, 'variants': VARIANTS,
+                'network': {'throughput_kbps': 20000, 'latency_ms': 5}}
+    with HLSOrigin(scenario) as origin:
+        index = proxy.resolver.resolve(origin.master_url, raise_errors=True)
+        selector = ABRSelector(index['variants'])
+        low = selector.start_at(origin.variant_url('low'))['url']
+        proxy.set_variant(origin.master_url, low)
+        proxy.abr_playlist(origin.master_url)
+
+        # 低码率下播放器只按400kbps读取，但代理实测的源站吞吐量远高于此，播放无丢帧时应升档
+        variants = play_trace(proxy, origin.master_url, selector, QualityScorer(), [(0, 0)] * 8)
+        assert proxy.measured_kbps() > 2000
+        assert variants[-1] != low
+        assert proxy.current_variant(origin.master_url) == variants[-1]
+
+
+def test_frame_loss_steps_down(proxy):
+    scenario = {'name': 'abr', 'segments': 12, 'variants': VARIANTS,
+                'network': {'throughput_kbps': 20000, 'latency_ms': 5}}
+    with HLSOrigin(scenario) as origin:
+        index = proxy.resolver.resolve(origin.master_url, raise_errors=True)
+        selector = ABRSelector(index['variants'])
+        mid = selector.start_at(origin.variant_url('mid'))['url']
+        proxy.set_variant(origin.master_url, mid)
+        proxy.abr_playlist(origin.master_url)
+
+        # 每段新增30个丢帧（得分40），连续3次低分后降档
+        trace = [(0, 0), (30, 0), (60, 0), (90, 0)]
+        variants = play_trace(proxy, origin.master_url, selector, QualityScorer(), trace)
+        assert variants[:3] == [mid] * 3
+        assert variants[3] == origin.variant_url('low')
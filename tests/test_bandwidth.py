@@ -0,0 +1,64 @@
+"""用回放的MediaStats.read_bytes序列检查速度估计"""
+import pytest
+
+from bandwidth import BandwidthEstimator
+from benchmark import bursty_trace, legacy_speeds, media_stats_trace, replay_media_stats
+
+
+@pytest.mark.parametrize('tick', [0.5, 1.0])
+def test_estimate_does_not_depend_on_tick(tick):
+    trace = media_stats_trace([(30, 800)], tick)
+    estimator, _ = replay_media_stats(trace)
+    assert estimator.estimate() == pytest.approx(800, abs=8)
+    # 原算法把每个节拍的字节差当作每秒速度，500ms节拍下只有一半
+    if tick == 0.5:
+        assert legacy_speeds(trace)[-1] == pytest.approx(400, abs=8)
+
+
+def test_reacts_to_sudden_drop():
+    trace = media_stats_trace([(30, 1000), (15, 100)], 0.5)
+    _, estimates = replay_media_stats(trace)
+    reaction = next(now - 30 for now, value in estimates if now > 30 and value < 550)
+    assert reaction <= 3
+
+
+def test_short_recovery_is_not_chased():
+    trace = media_stats_trace([(30, 100), (3, 1000)], 0.5)
+    estimator, _ = replay_media_stats(trace)
+    assert estimator.estimate() < 600
+    assert estimator.fast_estimate() > estimator.estimate()
+
+
+def test_bursty_segment_reads_average_out():
+    trace = bursty_trace(60, segment_kb=2000, segment_seconds=4, link_kbps=2000, tick=0.5)
+    estimator, _ = replay_media_stats(trace)
+    assert 300 < estimator.slow_estimate() < 700
+    # 分位数反映突发：空闲节拍为0，下载节拍接近链路速度
+    assert estimator.percentile(10) == 0
+    assert estimator.percentile(90) == pytest.approx(2000, rel=0.05)
+    assert estimator.stddev() > 0
+
+
+def test_counter_reset_gives_no_negative_rate():
+    trace = media_stats_trace([(20, 500)], 0.5, reset_at=10)
+    estimator, estimates = replay_media_stats(trace)
+    assert all(value is None or value >= 0 for _, value in estimates)
+    assert estimator.estimate() == pytest.approx(500, abs=10)
+
+
+def test_idle_time_is_measured_in_seconds():
+    trace = media_stats_trace([(10, 500), (6, 0)], 0.5)
+    estimator, _ = replay_media_stats(trace)
+    assert estimator.idle_seconds(trace[-1][0]) >= 5
+
+
+def test_ring_buffer_is_bounded():
+    trace = media_stats_trace([(3600, 600)], 0.5)
+    estimator, _ = replay_media_stats(trace)
+    assert estimator.sample_count == estimator.capacity
+
+
+def test_empty_estimator():
+    estimator = BandwidthEstimator()
+    assert estimator.estimate() is None
+    assert estimator.percentile(50) is None
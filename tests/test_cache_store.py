@@ -0,0 +1,71 @@
+"""缓存索引：启动时核对磁盘，退出时保存"""
+import json
+import os
+import time
+
+import pytest
+
+import hls_proxy
+from cache_store import WatchHistory
+from hls_proxy import SegmentCache
+
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    return str(tmp_path / 'segment_cache')
+
+
+def open_cache(cache_dir, tmp_path):
+    cache = SegmentCache(cache_dir, max_bytes=0, history=WatchHistory(str(tmp_path / 'play_history.json')))
+    assert cache.store.reconciled.wait(10)
+    return cache
+
+
+def test_reconcile_with_existing_index(cache_dir, tmp_path):
+    cache = open_cache(cache_dir, tmp_path)
+    for n in range(3):
+        cache.put(f"http://example.com/ep1/{n}.ts", b'x' * 100, {'url': 'http://example.com/ep1'})
+    cache.store.stop()
+
+    # 退出前没写入索引的分片，以及索引中有但已被删除的分片
+    stray = SegmentCache.key('http://example.com/ep2/0.ts')
+    with open(os.path.join(cache_dir, stray), 'wb') as f:
+        f.write(b'y' * 50)
+    past = time.time() - 60
+    os.utime(os.path.join(cache_dir, stray), (past, past))
+    os.remove(os.path.join(cache_dir, SegmentCache.key('http://example.com/ep1/0.ts')))
+
+    reopened = open_cache(cache_dir, tmp_path)
+    try:
+        assert stray in reopened.store
+        assert 'http://example.com/ep1/0.ts' not in reopened
+        assert 'http://example.com/ep1/1.ts' in reopened
+        assert reopened.total_bytes == 250
+        with open(os.path.join(cache_dir, SegmentCache.INDEX_NAME), 'r', encoding='utf-8') as f:
+            assert set(json.load(f)) == set(os.listdir(cache_dir)) - {SegmentCache.INDEX_NAME}
+    finally:
+        reopened.store.stop()
+
+
+def test_entries_written_after_start_are_kept(cache_dir, tmp_path):
+    cache = open_cache(cache_dir, tmp_path)
+    try:
+        cache.put('http://example.com/ep1/0.ts', b'x' * 10)
+        cache.store._reconcile()
+        assert 'http://example.com/ep1/0.ts' in cache
+    finally:
+        cache.store.stop()
+
+
+def test_shutdown_proxy_saves_index(cache_dir, tmp_path, monkeypatch):
+    proxy = hls_proxy.HLSProxy(SegmentCache(cache_dir, max_bytes=0))
+    proxy.start()
+    monkeypatch.setattr(hls_proxy, '_shared_proxy', proxy)
+    proxy.cache.put('http://example.com/ep1/0.ts', b'x' * 10)
+
+    hls_proxy.shutdown_proxy()
+    assert hls_proxy._shared_proxy is None
+    with open(os.path.join(cache_dir, SegmentCache.INDEX_NAME), 'r', encoding='utf-8') as f:
+        assert SegmentCache.key('http://example.com/ep1/0.ts') in json.load(f)
+    # 没有创建过代理时什么也不做
+    hls_proxy.shutdown_proxy()
@@ -0,0 +1,39 @@
+"""快速提取器与BeautifulSoup提取器的一致性"""
+import pytest
+
+from benchmark import render_detail_page, sample_pages
+from extractors import FastExtractor, SoupExtractor
+
+PAGES = sample_pages()
+
+
+@pytest.mark.parametrize('name', [name for name in PAGES if name != 'missing_markers'])
+def test_fast_matches_soup(name):
+    html = PAGES[name]
+    assert FastExtractor().extract(html) == SoupExtractor().extract(html)
+
+
+def test_missing_markers_falls_back():
+    assert FastExtractor().extract(PAGES['missing_markers']) is None
+
+
+def test_entities_are_unescaped():
+    info = FastExtractor().extract(PAGES['entities'])
+    assert info['title'] == '测试&剧集 <2001>'
+
+
+def test_second_playlist_is_included():
+    info = FastExtractor().extract(PAGES['two_sources'])
+    assert info['total_episodes'] == 121
+    assert info['episodes'][-1]['url'] == 'https://b.example.test/1/index.m3u8'
+
+
+def test_is_complete_on_stream_prefix():
+    html = render_detail_page(2003, 40)
+    fast = FastExtractor()
+    end = html.index('</ul></div>') + len('</ul></div>')
+    assert not fast.is_complete(html[:end - 20])
+    assert not fast.is_complete(html[:end])
+    prefix = html[:end + FastExtractor.STREAM_LOOKAHEAD]
+    assert fast.is_complete(prefix)
+    assert fast.extract(prefix) == SoupExtractor().extract(html)
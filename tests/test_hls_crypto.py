@@ -0,0 +1,159 @@
+"""AES-128分片解密和密钥缓存，密文由本地生成（需要cryptography）"""
+import os
+import random
+import shutil
+import subprocess
+import threading
+import tracemalloc
+
+import pytest
+
+import download_manager
+from benchmark import new_download_manager, verify_download
+from download_manager import DownloadTask
+from hls import parse_key_tag, parse_playlist
+from hls_crypto import (HAS_AES, KeyCache, SegmentDecryptor, decrypt_file, decrypt_stream, encrypt_segment,
+                        segment_iv)
+from hls_origin import HLSOrigin
+
+pytestmark = pytest.mark.skipif(not HAS_AES, reason="需要cryptography")
+
+RNG = random.Random(7)
+KEY = bytes(RNG.randrange(256) for _ in range(16))
+IV = bytes(RNG.randrange(256) for _ in range(16))
+
+
+@pytest.mark.parametrize('size', [0, 1, 15, 16, 17, 188 * 7, 188 * 1000 + 3])
+@pytest.mark.parametrize('chunk_size', [1, 7, 16, 4096, None])
+def test_streaming_decrypt_round_trip(size, chunk_size):
+    plain = os.urandom(size)
+    cipher = encrypt_segment(plain, KEY, IV)
+    chunk_size = chunk_size or len(cipher)
+    chunks = [cipher[i:i + chunk_size] for i in range(0, len(cipher), chunk_size)]
+    assert b''.join(decrypt_stream(chunks, KEY, IV)) == plain
+
+
+@pytest.mark.parametrize('case', ['wrong_key', 'truncated', 'missing_block'])
+def test_bad_ciphertext_raises(case):
+    cipher = encrypt_segment(b'x' * 1000, KEY, IV)
+    data, key = {'wrong_key': (cipher, bytes(16)), 'truncated': (cipher[:-5], KEY),
+                 'missing_block': (cipher[:-16], KEY)}[case]
+    decryptor = SegmentDecryptor(key, IV)
+    decryptor.update(data)
+    with pytest.raises(ValueError):
+        decryptor.finalize()
+
+
+@pytest.mark.skipif(shutil.which('openssl') is None, reason="需要openssl")
+def test_matches_openssl(tmp_path):
+    plain_file, cipher_file, out_file = tmp_path / 'plain.ts', tmp_path / 'cipher.ts', tmp_path / 'out.ts'
+    plain_file.write_bytes(os.urandom(188 * 3000))
+    subprocess.run(['openssl', 'enc', '-aes-128-cbc', '-K', KEY.hex(), '-iv', IV.hex(),
+                    '-in', str(plain_file), '-out', str(cipher_file)], check=True)
+    assert decrypt_file(str(cipher_file), str(out_file), KEY, IV) == 188 * 3000
+    assert out_file.read_bytes() == plain_file.read_bytes()
+
+
+def test_streaming_memory_does_not_grow_with_length():
+    block = encrypt_segment(b'\0' * (1024 * 1024 - 1), KEY, IV)[:1024 * 1024]
+    decryptor = SegmentDecryptor(KEY, IV)
+    tracemalloc.start()
+    try:
+        for _ in range(64):
+            for i in range(0, len(block), 64 * 1024):
+                decryptor.update(block[i:i + 64 * 1024])
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert peak < 4 * 1024 * 1024
+
+
+def test_segment_iv():
+    key = parse_key_tag('#EXT-X-KEY:METHOD=AES-128,URI="k.key"', 'https://a.test/v/index.m3u8')
+    assert key['uri'] == 'https://a.test/v/k.key'
+    assert segment_iv(key, 5) == (5).to_bytes(16, 'big')
+    explicit = parse_key_tag('#EXT-X-KEY:METHOD=AES-128,URI="k.key",IV=0x0A', 'https://a.test/')
+    assert segment_iv(explicit, 5) == (10).to_bytes(16, 'big')
+    assert parse_key_tag('#EXT-X-KEY:METHOD=NONE', 'https://a.test/') is None
+
+
+@pytest.fixture
+def encrypted_origin():
+    with HLSOrigin({'name': 'aes', 'segments': 12, 'encryption': {'rotate': 4}}) as origin:
+        yield origin
+
+
+def test_key_cache_fetches_each_key_once(encrypted_origin):
+    cache = KeyCache()
+    url = f"{encrypted_origin.base_url}/keys/0.key"
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get(url))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [encrypted_origin.key_bytes(0)] * 8
+    assert encrypted_origin.key_requests == 1
+
+
+def test_key_cache_evicts_least_recently_used(encrypted_origin):
+    cache = KeyCache(max_keys=2)
+    urls = [f"{encrypted_origin.base_url}/keys/{i}.key" for i in range(3)]
+    for url in urls:
+        cache.get(url)
+    cache.get(urls[2])
+    cache.get(urls[0])
+    assert encrypted_origin.key_requests == 4
+    assert cache.get_stats()['evicted'] == 2
+
+
+def test_key_cache_rejects_wrong_length(encrypted_origin):
+    with pytest.raises(ValueError):
+        KeyCache().get(f"{encrypted_origin.variant_url('mid').rsplit('/', 1)[0]}/0.ts")
+
+
+@pytest.mark.parametrize('iv_mode', ['sequence', 'explicit'])
+def test_encrypted_download_is_decrypted(tmp_path, iv_mode):
+    scenario = {'name': iv_mode, 'segments': 10, 'encryption': {'rotate': 4, 'iv': iv_mode}}
+    with HLSOrigin(scenario) as origin:
+        manager = new_download_manager(str(tmp_path), 4)
+        manager.keys = KeyCache()
+        url = f"{origin.variant_url()}?ep=1"
+        try:
+            manager.download(DownloadTask(url, "测试", iv_mode))
+        finally:
+            manager.shutdown()
+        assert verify_download(manager, origin, url) is None
+        assert origin.key_requests == 3
+        with open(manager.local_playlist(url), 'r', encoding='utf-8') as f:
+            assert '#EXT-X-KEY' not in f.read()
+
+
+def test_kept_ciphertext_keeps_media_sequence(tmp_path, monkeypatch):
+    # 不能在本地解密时原样保存密文；源站是滑动窗口，媒体序号从4开始
+    monkeypatch.setattr(download_manager, 'can_decrypt', lambda key: False)
+    scenario = {'name': 'sequence', 'segments': 10, 'encryption': {'rotate': 0, 'iv': 'sequence'}}
+    with HLSOrigin(scenario) as origin:
+        origin.window = 6
+        manager = new_download_manager(str(tmp_path), 4)
+        url = f"{origin.variant_url()}?ep=1"
+        try:
+            manager.download(DownloadTask(url, "测试", "密文"))
+        finally:
+            manager.shutdown()
+        path = manager.local_playlist(url)
+        with open(path, 'r', encoding='utf-8') as f:
+            playlist = parse_playlist(f.read(), path)
+        assert playlist['media_sequence'] == 4
+        assert len(playlist['segments']) == 6
+
+        # 播放器按本地列表的媒体序号推算IV，解密结果应与源站明文一致
+        directory = os.path.dirname(path)
+        key = playlist['keys'][0]
+        with open(os.path.join(directory, os.path.basename(key['uri'])), 'rb') as f:
+            key_bytes = f.read()
+        for i, segment in enumerate(playlist['segments']):
+            with open(os.path.join(directory, segment['uri']), 'rb') as f:
+                data = f.read()
+            iv = segment_iv(key, playlist['media_sequence'] + i)
+            assert b''.join(decrypt_stream([data], key_bytes, iv)) == origin.segment_body('mid', 4 + i)
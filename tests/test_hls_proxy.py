@@ -0,0 +1,77 @@
+"""HLS缓存代理：按本地模拟源站检查码率选择、切换与预取"""
+import pytest
+
+from hls import HLSResolver
+from hls_crypto import HAS_AES
+from hls_origin import HLSOrigin
+from hls_proxy import HLSProxy, SegmentCache
+
+VARIANTS = [{'name': 'low', 'bandwidth': 400000}, {'name': 'mid', 'bandwidth': 1200000},
+            {'name': 'high', 'bandwidth': 4000000}]
+
+
+@pytest.fixture
+def proxy(tmp_path):
+    proxy = HLSProxy(SegmentCache(str(tmp_path / 'segment_cache')))
+    proxy.resolver = HLSResolver(cache_dir=str(tmp_path / 'hls_cache'))
+    proxy.start()
+    yield proxy
+    proxy.stop()
+    proxy.cache.store.stop()
+
+
+def test_next_episode_prefetch_uses_startup_variant(proxy):
+    with HLSOrigin({'name': 'abr', 'segments': 10, 'variants': VARIANTS}) as origin:
+        # 实测2000kbps：起播规则（吞吐量×0.8）选中1200kbps的mid，而不是最高码率
+        with proxy._lock:
+            proxy._throughput.append((250000, 1.0))
+        proxy.prefetch_episode(origin.master_url, 0, 4, rate_kbps=100000, abr=True)
+
+        mid = origin.variant_url('mid')
+        assert proxy.prefetched_variant(origin.master_url) == mid
+        assert f"{origin.base_url}/mid/0.ts" in proxy.cache
+        assert f"{origin.base_url}/high/0.ts" not in proxy.cache
+
+        # 起播时沿用预取的码率，之后的分片请求命中缓存
+        proxy.abr_playlist(origin.master_url)
+        assert proxy.current_variant(origin.master_url) == mid
+        requests_before = origin.segment_requests
+        proxy.abr_segment(origin.master_url, 0)
+        assert origin.segment_requests == requests_before
+
+
+def test_prefetch_without_abr_keeps_resolver_variant(proxy):
+    with HLSOrigin({'name': 'abr', 'segments': 10, 'variants': VARIANTS}) as origin:
+        with proxy._lock:
+            proxy._throughput.append((250000, 1.0))
+        proxy.prefetch_episode(origin.master_url, 0, 4, rate_kbps=100000)
+        assert proxy.prefetched_variant(origin.master_url) is None
+        assert f"{origin.base_url}/high/0.ts" in proxy.cache
+
+
+@pytest.mark.skipif(not HAS_AES, reason="需要cryptography")
+def test_abr_playlist_switches_shared_key_variants(proxy):
+    scenario = {'name': 'abr', 'segments': 6, 'variants': VARIANTS, 'encryption': {'rotate': 2}}
+    with HLSOrigin(scenario) as origin:
+        proxy.set_variant(origin.master_url, origin.variant_url('high'))
+        playlist = proxy.abr_playlist(origin.master_url)
+        # 各码率共用密钥、IV按媒体序号，可以按分片序号互换
+        assert proxy.abr_switchable(origin.master_url) is True
+        assert playlist.count('/abrseg?') == 6
+        assert playlist.count('#EXT-X-KEY:') == 3
+
+        proxy.set_variant(origin.master_url, origin.variant_url('low'))
+        proxy.abr_segment(origin.master_url, 3)
+        assert f"{origin.base_url}/low/3.ts" in proxy.cache
+
+
+def test_abr_playlist_pins_variant_when_init_segments_differ(proxy):
+    scenario = {'name': 'abr', 'segments': 6, 'variants': VARIANTS, 'format': 'fmp4'}
+    with HLSOrigin(scenario) as origin:
+        high = origin.variant_url('high')
+        proxy.set_variant(origin.master_url, high)
+        playlist = proxy.abr_playlist(origin.master_url)
+        # 每个码率有自己的init.mp4，换码率后播放器无法解码，只播放起始码率
+        assert proxy.abr_switchable(origin.master_url) is False
+        assert '/abrseg?' not in playlist
+        assert playlist == proxy.fetch_playlist(high)
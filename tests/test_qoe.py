@@ -0,0 +1,71 @@
+"""播放质量会话的卡顿统计：跳转等待与真实卡顿分开记录"""
+import pytest
+
+from qoe import QoESession, summarize
+
+
+@pytest.fixture
+def session():
+    qoe = QoESession('http://example.com/a.m3u8', 'series', 'ep1')
+    qoe.startup_ms = 500.0
+    return qoe
+
+
+def tick_all(qoe, ticks, seeking_until=None):
+    """按(时刻, 是否卡顿)逐个节拍推进，seeking_until之前的节拍处于跳转宽限期"""
+    for now, stalled in ticks:
+        qoe.on_tick(stalled, now=now, seeking=seeking_until is not None and now < seeking_until)
+
+
+def test_stall_counts_rebuffer(session):
+    tick_all(session, [(1.0, False), (2.0, True), (3.5, True), (4.0, False)])
+    assert session.rebuffer_count == 1
+    assert session.stall_ms == pytest.approx(2000)
+    assert session.seek_wait_ms == 0
+
+
+def test_seek_wait_is_not_a_rebuffer(session):
+    session.mark_seek(now=10.0)
+    tick_all(session, [(10.2, True), (11.0, True), (11.8, False), (12.0, False)], seeking_until=12.0)
+    assert session.seek_count == 1
+    assert session.rebuffer_count == 0
+    assert session.stall_ms == 0
+    assert session.seek_wait_ms == pytest.approx(1600)
+
+
+def test_stall_past_grace_becomes_rebuffer(session):
+    session.mark_seek(now=10.0)
+    tick_all(session, [(10.5, True), (15.0, True), (20.0, True), (22.0, False)], seeking_until=20.0)
+    assert session.rebuffer_count == 1
+    assert session.seek_wait_ms == pytest.approx(9500)
+    assert session.stall_ms == pytest.approx(2000)
+
+
+def test_seek_closes_ongoing_stall(session):
+    tick_all(session, [(1.0, True)])
+    session.mark_seek(now=3.0)
+    tick_all(session, [(3.5, True), (4.0, False)], seeking_until=5.0)
+    assert session.rebuffer_count == 1
+    assert session.stall_ms == pytest.approx(2000)
+    assert session.seek_wait_ms == pytest.approx(500)
+
+
+def test_seek_before_startup_is_ignored():
+    qoe = QoESession('http://example.com/a.m3u8')
+    qoe.mark_seek(now=1.0)
+    qoe.on_tick(True, now=1.5, seeking=True)
+    assert qoe.seek_count == 0
+    assert qoe.seek_wait_ms == 0
+
+
+def test_record_and_summary_keep_seek_wait_separate(session):
+    session.mark_seek(now=10.0)
+    tick_all(session, [(10.1, True), (11.1, False)], seeking_until=12.0)
+    record = session.finish()
+    assert record['seek_count'] == 1
+    assert record['seek_wait_ms'] == 1000
+    assert record['stall_ms'] == 0 and record['rebuffer_count'] == 0
+    row = summarize([record, dict(record, seek_wait_ms=3000), {'series': 'series', 'stall_ms': 0}])['series']
+    assert row['seek_wait_ms']['count'] == 2
+    assert row['seek_wait_ms']['p50'] == 2000
+    assert row['stall_ratio'] == 0
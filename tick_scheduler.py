@@ -0,0 +1,93 @@
+import logging
+from typing import Callable, Dict, List, Optional
+
+
+class TickScheduler:
+    """窗口内唯一的定时轮询循环
+
+    每个节拍调用一次sample()采集播放器状态，把同一份快照依次交给各订阅者，订阅者之间
+    不再各自查询播放器。start()可以重复调用，同一时刻最多只有一个循环在运行；
+    interval(snapshot)返回下一个节拍的间隔（毫秒），暂停或窗口不在前台时可以放慢。
+
+    参数:
+        widget: 提供after/after_cancel的Tk部件，循环随部件销毁而结束
+        sample: 采集快照的函数，返回None时本节拍不通知订阅者
+        interval: 根据快照计算下次间隔的函数，默认固定default_ms
+    """
+
+    def __init__(self, widget, sample: Callable[[], Optional[Dict]],
+                 interval: Optional[Callable[[Optional[Dict]], int]] = None, default_ms: int = 500):
+        self.logger = logging.getLogger(__name__)
+        self.widget = widget
+        self.sample = sample
+        self.interval = interval
+        self.default_ms = default_ms
+        self.tick_count = 0
+        self._subscribers: List[Callable[[Dict], None]] = []
+        self._after_id = None
+        self._stopped = True
+
+    def subscribe(self, callback: Callable[[Dict], None]):
+        """添加订阅者，按添加顺序调用"""
+        if callback not in self._subscribers:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback: Callable[[Dict], None]):
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+    @property
+    def running(self) -> bool:
+        return not self._stopped
+
+    def start(self):
+        """启动循环，已在运行时不做任何事"""
+        self._stopped = False
+        if self._after_id is None:
+            self._after_id = self.widget.after(0, self._tick)
+
+    def stop(self):
+        """停止循环"""
+        self._stopped = True
+        if self._after_id is not None:
+            try:
+                self.widget.after_cancel(self._after_id)
+            except Exception:
+                pass
+            self._after_id = None
+
+    def _next_interval(self, snapshot: Optional[Dict]) -> int:
+        if self.interval is None:
+            return self.default_ms
+        try:
+            return int(self.interval(snapshot))
+        except Exception as e:
+            self.logger.error(f"计算节拍间隔出错: {str(e)}")
+            return self.default_ms
+
+    def _tick(self):
+        self._after_id = None
+        if self._stopped:
+            return
+        self.tick_count += 1
+
+        snapshot = None
+        try:
+            snapshot = self.sample()
+        except Exception as e:
+            self.logger.error(f"采集播放状态出错: {str(e)}")
+
+        if snapshot is not None:
+            for callback in list(self._subscribers):
+                try:
+                    callback(snapshot)
+                except Exception as e:
+                    self.logger.error(f"节拍处理{getattr(callback, '__name__', callback)}出错: {str(e)}")
+
+        # 订阅者在本节拍内调用了start()时已经安排了下一个节拍
+        if not self._stopped and self._after_id is None:
+            try:
+                self._after_id = self.widget.after(self._next_interval(snapshot), self._tick)
+            except Exception:
+                # 窗口已销毁
+                self._stopped = True
@@ -0,0 +1,165 @@
+import heapq
+import json
+import logging
+import os
+import statistics
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+# 更新状态中包含这些字样时视为已完结，不再自动检查
+FINISHED_MARKERS = ('完结', '全集')
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class UpdateScheduler:
+    """按订阅自适应安排检查时间
+
+    根据每部剧检测到新剧集的历史时间推算更新周期：距离预计更新时间还早时一直等到
+    更新窗口开启，窗口内按周期的1/8轮询；没有足够历史时使用基础间隔，并在连续
+    无更新时逐步拉长间隔。已完结的剧集冻结，只有手动强制刷新才会检查。
+    """
+
+    def __init__(self, state_file: str = 'update_schedule.json', base_interval_hours: float = 6,
+                 min_interval_hours: float = 1, max_interval_hours: float = 24 * 7, history_size: int = 10):
+        self.logger = logging.getLogger(__name__)
+        self.state_file = state_file
+        self.base_interval = timedelta(hours=base_interval_hours)
+        self.min_interval = timedelta(hours=min_interval_hours)
+        self.max_interval = timedelta(hours=max_interval_hours)
+        self.history_size = history_size
+        self._lock = threading.Lock()
+        self._state: Dict[str, Dict] = self._load()
+
+    def _load(self) -> Dict[str, Dict]:
+        try:
+            if os.path.exists(self.state_file):
+                with open(self.state_file, 'r', encoding='utf-8') as f:
+                    state = json.load(f)
+                    if isinstance(state, dict):
+                        return state
+        except Exception as e:
+            self.logger.warning(f"读取更新计划失败，将重新创建: {str(e)}")
+        return {}
+
+    def save(self):
+        """保存调度状态"""
+        with self._lock:
+            state = json.loads(json.dumps(self._state))
+        temp_file = f"{self.state_file}.tmp"
+        try:
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(state, f, ensure_ascii=False, indent=4)
+            os.replace(temp_file, self.state_file)
+        except Exception as e:
+            self.logger.error(f"保存更新计划失败: {str(e)}")
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+
+    def _entry(self, sub: Dict) -> Dict:
+        """获取订阅的调度记录，首次出现时根据旧的last_check初始化"""
+        entry = self._state.get(sub['url'])
+        if entry is None:
+            next_check = datetime.now()
+            try:
+                next_check = datetime.strptime(sub['last_check'], TIME_FORMAT) + self.base_interval
+            except (KeyError, TypeError, ValueError):
+                pass
+            entry = {
+                'releases': [],
+                'misses': 0,
+                'frozen': self.is_finished(sub.get('update_status', '')),
+                'next_check': next_check.strftime(TIME_FORMAT)
+            }
+            self._state[sub['url']] = entry
+        return entry
+
+    @staticmethod
+    def is_finished(update_status: str) -> bool:
+        return any(marker in (update_status or '') for marker in FINISHED_MARKERS)
+
+    def due(self, subs: List[Dict], force: bool = False, now: Optional[datetime] = None) -> List[Dict]:
+        """返回到期需要检查的订阅，按到期时间先后排序
+
+        参数:
+            force: 忽略计划，检查所有订阅（包括已完结的）
+        """
+        now = now or datetime.now()
+        with self._lock:
+            if force:
+                return list(subs)
+
+            queue = []
+            for index, sub in enumerate(subs):
+                entry = self._entry(sub)
+                if entry['frozen']:
+                    continue
+                heapq.heappush(queue, (entry['next_check'], index, sub))
+
+            due = []
+            now_text = now.strftime(TIME_FORMAT)
+            while queue and queue[0][0] <= now_text:
+                due.append(heapq.heappop(queue)[2])
+            return due
+
+    def next_due_time(self, subs: List[Dict]) -> Optional[datetime]:
+        """最早的下次检查时间，全部冻结时返回None"""
+        with self._lock:
+            times = [self._entry(sub)['next_check'] for sub in subs if not self._entry(sub)['frozen']]
+        return datetime.strptime(min(times), TIME_FORMAT) if times else None
+
+    def describe(self, url: str) -> Dict:
+        """调度记录（只读副本）"""
+        with self._lock:
+            return dict(self._state.get(url, {}))
+
+    def _release_gap(self, releases: List[str]) -> Optional[timedelta]:
+        """根据历史更新时间估算更新周期（相邻间隔的中位数）"""
+        if len(releases) < 2:
+            return None
+        times = [datetime.strptime(t, TIME_FORMAT) for t in releases]
+        gaps = [(b - a).total_seconds() for a, b in zip(times, times[1:]) if b > a]
+        if not gaps:
+            return None
+        return timedelta(seconds=statistics.median(gaps))
+
+    def record(self, sub: Dict, has_new: bool, update_status: str = '', now: Optional[datetime] = None):
+        """记录一次成功检查的结果并安排下次检查"""
+        now = now or datetime.now()
+        with self._lock:
+            entry = self._entry(sub)
+            entry['last_check'] = now.strftime(TIME_FORMAT)
+            entry['update_status'] = update_status
+            entry['frozen'] = self.is_finished(update_status)
+
+            if has_new:
+                entry['releases'] = (entry['releases'] + [now.strftime(TIME_FORMAT)])[-self.history_size:]
+                entry['misses'] = 0
+            else:
+                entry['misses'] = entry.get('misses', 0) + 1
+
+            gap = self._release_gap(entry['releases'])
+            if gap:
+                entry['interval_hours'] = round(gap.total_seconds() / 3600, 2)
+                last_release = datetime.strptime(entry['releases'][-1], TIME_FORMAT)
+                window_open = last_release + gap * 0.9
+                if now < window_open:
+                    # 距离预计更新还早，直接等到更新窗口开启
+                    next_check = window_open
+                else:
+                    # 已进入更新窗口，按周期的1/8轮询
+                    next_check = now + min(max(gap / 8, self.min_interval), self.base_interval)
+            else:
+                # 没有足够历史：基础间隔，连续无更新时逐步拉长
+                next_check = now + self.base_interval * (2 ** min(entry['misses'], 5))
+
+            next_check = min(max(next_check, now + self.min_interval), now + self.max_interval)
+            entry['next_check'] = next_check.strftime(TIME_FORMAT)
+
+    def record_failure(self, sub: Dict, now: Optional[datetime] = None):
+        """检查失败时按最小间隔重试"""
+        now = now or datetime.now()
+        with self._lock:
+            entry = self._entry(sub)
+            entry['next_check'] = (now + self.min_interval).strftime(TIME_FORMAT)
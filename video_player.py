@@ -6,9 +6,23 @@ from tkinter import ttk, messagebox
 import vlc
 import logging
 import json
+import threading
 import traceback
+from collections import deque
 from datetime import datetime, timedelta
 
+from abr import ABRSelector, QualityScorer
+from bandwidth import BandwidthEstimator
+from cache_store import pin_episode, unpin_episode
+from download_manager import get_download_manager
+from hls import get_hls_resolver, segment_at
+from hls_proxy import get_proxy, load_playback_settings
+from link_checker import STATUS_LABELS
+from qoe import QoELog, QoESession
+from tick_scheduler import TickScheduler
+from vlc_events import EventBridge
+from vlc_pool import get_player_pool
+
 try:
     import win32gui
     import win32con
@@ -190,19 +204,58 @@ class VideoPlayerWindow(tk.Toplevel):
             f"}}"  # 转义外层花括号
         )
         self.intro_duration = self.subscription_data.get('intro_duration', 90)
+
+        # 分片索引缓存：已解析的剧集直接播放码率列表，并显示时长
+        self.hls_resolver = get_hls_resolver()
+        self.current_video_url = video_url
+
+        # 本地缓存代理：分片落盘缓存并预取，启动失败时直接播放原始地址
+        self.playback_settings = load_playback_settings()
+        self.proxy = None
+        if self.playback_settings.get('proxy_enabled', True):
+            try:
+                self.proxy = get_proxy()
+            except Exception as e:
+                self.logger.error(f"启动HLS缓存代理失败: {str(e)}")
+
+        # 离线下载：已下载完成的剧集直接播放本地播放列表
+        self.downloads = get_download_manager()
+        # 正在播放和预缓冲的剧集不会被缓存淘汰
+        self._pinned_urls = set()
+
+        # 下一集预取：播放进度超过该比例后预取下一集片头之后的一段内容
+        self.next_prefetch_fraction = self.playback_settings.get('next_prefetch_fraction', 0.7)
+        self._next_prefetch_index = None
+
+        # 快速起播：按实测带宽和码率确定起播缓存，播放稳定后逐步加大代理预取深度
+        self.fast_start = self.playback_settings.get('fast_start', True)
+        self.max_prefetch_segments = self.playback_settings.get('prefetch_segments', 5)
+        self._load_started = None
+        self._startup_caching_ms = None
+        self._last_depth_raise = 0
+        self.last_ttff_ms = None
+
+        # 多码率剧集经代理播放，按吞吐量和质量得分在分片边界切换码率
+        self.abr_enabled = self.playback_settings.get('abr', True)
+        self._abr_selectors = {}
+
+        # 播放质量记录：每集一个会话，结束时追加到qoe_sessions.jsonl
+        self.qoe_log = QoELog()
+        self.qoe = None
+        self._switch_requested = None
+        self._last_progress = None
+        # 拖动进度条和跳过片头后的等待不是网络卡顿：宽限期内不降码率
+        self._seek_started = None
+        self.seek_grace = 10
         self.outro_duration = self.subscription_data.get('outro_duration', 90)
         
-        # 缓存状态变量
-        self.is_buffering = False
-        self.min_buffer_threshold = 0.2  # 最小缓冲阈值（20%）
-        self.max_buffer_threshold = 0.8  # 最大缓冲阈值（80%）
-        self.buffer_size = 0
-        self.last_buffer_update = 0
-        
         # 自适应缓冲设置
-        self.network_quality_history = []  # 存储最近的网络质量数据
         self.history_size = 10  # 保存最近10次的网络质量数据
-        self.network_unstable_count = 0  # 网络不稳定计数
+        self.network_quality_history = deque(maxlen=self.history_size)  # 存储最近的网络质量数据
+        # 按丢帧/丢音频/损坏和卡顿的增量打分，MediaStats中是整个媒体的累计值
+        self.quality_scorer = QualityScorer()
+        # 读取速度估计：所有网速显示、缓冲和恢复判断都从这里查询
+        self.bandwidth = BandwidthEstimator()
         self.adaptive_buffer_enabled = True  # 启用自适应缓冲
 
         # 动画相关属性
@@ -246,19 +299,30 @@ class VideoPlayerWindow(tk.Toplevel):
         # 再创建UI元素
         self.create_ui()
 
-        # 创建VLC实例和播放器
-        self.instance = vlc.Instance()
-        self.player = self.instance.media_player_new()
-
-        # 设置事件管理器
-        self.event_manager = self.player.event_manager()
-        self.event_manager.event_attach(vlc.EventType.MediaPlayerPlaying, self.on_media_playing)
-        self.event_manager.event_attach(vlc.EventType.MediaPlayerTimeChanged, self.on_time_changed)
-        self.event_manager.event_attach(vlc.EventType.MediaPlayerLengthChanged, self.on_length_changed)
-
-        # 初始化网速监控变量
-        self.last_bytes = 0
-        self.last_update_time = datetime.now()
+        # 使用进程共享的VLC实例，从播放器池取出播放器，关闭窗口时归还
+        self.pool = get_player_pool()
+        self.instance = self.pool.instance
+        self.player = self.pool.acquire()
+        self._closed = False
+
+        # 设置事件管理器：VLC回调只把事件放入队列，由主线程统一处理
+        self.events = EventBridge(self)
+        self.events.start()
+        self._attach_player_events(self.player)
+
+        # 节拍循环：每个节拍采集一次播放器状态，分发给进度、网速、缓冲和播放记录
+        self._last_player_state = None
+        self.ticker = TickScheduler(self, self._sample_player, self._tick_interval)
+        for callback in (self._tick_progress, self._tick_network, self._tick_buffer, self._tick_history,
+                         self._tick_qoe):
+            self.ticker.subscribe(callback)
+
+        # 无缝切换：片尾前由备用播放器预先缓冲下一集
+        self.gapless_enabled = self.playback_settings.get('gapless', True)
+        self.standby_player = None
+        self._standby_index = None
+        self._standby_ready = False
+        self._switch_started = None
 
         # 加载视频
         self.load_video(video_url)
@@ -298,6 +362,13 @@ class VideoPlayerWindow(tk.Toplevel):
         self.video_frame = ttk.Frame(self)  # 确保视频框架已创建
         self.video_frame.grid(row=0, column=0, sticky="nsew")
 
+        # 无缝切换用的备用视频框架，与视频框架重叠并位于其下方
+        self.standby_frame = ttk.Frame(self)
+        self.standby_frame.grid(row=0, column=0, sticky="nsew")
+        self.standby_frame.lower(self.video_frame)
+        self.standby_frame.bind('<Double-Button-1>', lambda e: self.toggle_fullscreen())
+        self.standby_frame.bind('<Motion>', lambda e: self.show_controls_temporarily())
+
         # 控制栏框架（增强稳定性）
         self.control_frame = ttk.Frame(self, style='ControlFrame.TFrame', height=50)
         self.control_frame.grid(row=1, column=0, sticky="ew", padx=0, pady=0)
@@ -346,24 +417,15 @@ class VideoPlayerWindow(tk.Toplevel):
         )
         self.status_label.pack(side='left', padx=5)
 
-        # 初始化网速监控
-        self.last_bytes = 0
-        self.last_update_time = datetime.now()
-
         self.control_alpha = 1.0
 
     def configure_styles(self):
-        """配置全局样式"""
-        self.style = ttk.Style()
-
-        # 预定义0-100的所有透明度样式
-        for alpha in range(0, 101):
-            self.style.configure(
-                f'ControlFrame.TFrame.{alpha}',
-                background=self._rgba_to_hex(45, 45, 45, alpha/100),
-                borderwidth=0,
-                relief='flat'
-            )
+        """配置全局样式（ttk样式在整个Tk解释器中共享，只需注册一次）"""
+        self.style = ttk.Style(self)
+        root = self._root()
+        if getattr(root, '_player_styles_configured', False):
+            return
+        root._player_styles_configured = True
 
         # 配置控制栏基础样式
         self.style.configure(
@@ -384,203 +446,52 @@ class VideoPlayerWindow(tk.Toplevel):
 
 
         
-    def update_network_stats(self):
-        """更新网络状态信息"""
-        global stats
-        try:
-            # 检查播放器是否已初始化且正在播放
-            if not hasattr(self, 'player') or not self.player:
-                self.network_speed_label.config(text="网速: --")
-                self.status_label.config(text="状态: 未播放")
-                self.buffer_label.config(text="缓冲: --")
-                self.after(1000, self.update_network_stats)
-                return
-
-            # 获取VLC媒体统计信息
-            try:
-                media = self.player.get_media()
-                if media:
-                    # 使用正确的VLC API获取统计信息
-                    stats = vlc.MediaStats()
-                    if media.get_stats(stats):
-                        # 计算网速 - 使用read_bytes而不是input_bytes
-                        bytes_read = getattr(stats, 'read_bytes', 0)
-                        current_time = datetime.now()
-                        time_diff = (current_time - self.last_update_time).total_seconds()
-                        
-                        if hasattr(self, 'last_bytes') and time_diff > 0:
-                            bytes_diff = bytes_read - self.last_bytes
-                            speed = bytes_diff / time_diff / 1024  # KB/s
-                            
-                            # 更新缓冲状态
-                            self.update_buffer_status(speed, stats)
-                            
-                            # 检测网络状态
-                            if speed == 0 and self.player.is_playing():
-                                if not hasattr(self, 'zero_speed_count'):
-                                    self.zero_speed_count = 0
-                                self.zero_speed_count += 1
-                                
-                                # 如果连续5秒没有数据，进入缓冲模式
-                                if self.zero_speed_count >= 5:
-                                    self.enter_buffering_mode()
-                            else:
-                                self.zero_speed_count = 0
-                                if speed > 1024:
-                                    self.network_speed_label.config(text=f"网速: {speed/1024:.1f} MB/s")
-                                else:
-                                    self.network_speed_label.config(text=f"网速: {speed:.1f} KB/s")
-                            
-                            self.last_bytes = bytes_read
-                            self.last_update_time = current_time
-                    else:
-                        self.network_speed_label.config(text="网速: --")
-            except Exception as e:
-                self.logger.error(f"获取网络统计信息失败: {str(e)}")
-                self.network_speed_label.config(text="网速: --")
-
-
-                # 更新状态信息
-                lost_pictures = stats.get('lost_pictures', -1)
-                lost_abuffers = stats.get('lost_abuffers', -1)
-                demux_corrupted = stats.get('demux_corrupted', -1)
-                demux_discontinuity = stats.get('demux_discontinuity', -1)
-                current_state = self.player.get_state()
-                # 状态判断逻辑
-                if current_state == vlc.State.Error:
-                    self.status_label.config(text="状态: 播放错误")
-                    self.attempt_recovery()
-                elif current_state == vlc.State.Buffering:
-                    self.status_label.config(text="状态: 正在缓冲...")
-                    self.is_buffering = True
-                elif self.is_buffering and self.buffer_size >= self.max_buffer_threshold:
-                    self.resume_from_buffering()
-                elif lost_pictures > 0 or lost_abuffers > 0:
-                    self.status_label.config(text="状态: 播放不稳定")
-                    if lost_pictures > 10 or lost_abuffers > 10:
-                        self.enter_buffering_mode()
-                else:
-                    if not self.is_buffering:
-                        self.status_label.config(text="状态: 正常播放")
-            else:
-                self.network_speed_label.config(text="网速: --")
-                self.status_label.config(text="状态: 无媒体")
-                self.buffer_label.config(text="缓冲: --")
-
-        except Exception as e:
-            self.logger.error(f"更新网络状态时出错: {str(e)}")
+    def _show_network_speed(self):
+        """在状态栏显示当前速度估计"""
+        speed = self.bandwidth.estimate()
+        if speed is None:
             self.network_speed_label.config(text="网速: --")
-            self.status_label.config(text="状态: 错误")
-            self.buffer_label.config(text="缓冲: --")
-
-        # 每秒更新一次
-        self.after(1000, self.update_network_stats)
+        elif speed > 1024:
+            self.network_speed_label.config(text=f"网速: {speed/1024:.1f} MB/s")
+        else:
+            self.network_speed_label.config(text=f"网速: {speed:.1f} KB/s")
 
-    def update_buffer_status(self, speed, stats):
-        """更新缓冲状态"""
-        try:
-            # 计算缓冲大小
-            read_bytes = stats.get('read_bytes', 0)
-            input_bitrate = stats.get('input_bitrate', 0)
-            
-            if input_bitrate > 0:
-                # 估算缓冲时间（秒）
-                buffer_time = read_bytes / (input_bitrate * 128)  # 转换为秒
-                self.buffer_size = min(1.0, buffer_time / 60)  # 最大1分钟的缓冲
-                
-                # 更新缓冲显示
-                buffer_percent = int(self.buffer_size * 100)
-                self.buffer_label.config(text=f"缓冲: {buffer_percent}%")
-                
-                # 更新网络质量历史
-                if self.adaptive_buffer_enabled:
-                    self.update_network_quality(speed, stats)
-                    self.adjust_buffer_thresholds()
-                
-                # 检查缓冲状态
-                if self.buffer_size < self.min_buffer_threshold and not self.is_buffering:
-                    self.enter_buffering_mode()
-                elif self.buffer_size >= self.max_buffer_threshold and self.is_buffering:
-                    self.resume_from_buffering()
-                
-                # 显示详细缓冲信息
-                if self.is_buffering:
-                    self.buffer_label.config(
-                        text=f"缓冲: {buffer_percent}% (目标: {int(self.max_buffer_threshold * 100)}%)"
-                    )
-        except Exception as e:
-            self.logger.error(f"更新缓冲状态时出错: {str(e)}")
-            
-    def update_network_quality(self, speed, stats):
-        """更新网络质量历史"""
+    def update_network_quality(self, stats):
+        """按本节拍新增的丢帧、损坏和卡顿计算质量得分，更新网络质量历史"""
         try:
-            # 计算网络质量得分 (0-100)
-            lost_pictures = stats.get('lost_pictures', 0)
-            lost_abuffers = stats.get('lost_abuffers', 0)
-            demux_corrupted = stats.get('demux_corrupted', 0)
-            
-            # 基础得分从100开始，根据各种问题扣分
-            quality_score = 100
-            
-            # 根据速度评分（假设理想速度是1MB/s）
-            speed_mb = speed / 1024  # 转换为MB/s
-            if speed_mb < 0.1:  # 低于100KB/s
-                quality_score -= 40
-            elif speed_mb < 0.5:  # 低于500KB/s
-                quality_score -= 20
-            elif speed_mb < 1.0:  # 低于1MB/s
-                quality_score -= 10
-                
-            # 根据问题扣分
-            quality_score -= lost_pictures * 2  # 每丢失一帧扣2分
-            quality_score -= lost_abuffers * 5  # 每丢失一个音频缓冲扣5分
-            quality_score -= demux_corrupted * 10  # 每次损坏扣10分
-            
-            # 确保分数在0-100之间
-            quality_score = max(0, min(100, quality_score))
-            
-            # 更新历史记录
+            counters = (getattr(stats, 'lost_pictures', 0), getattr(stats, 'lost_abuffers', 0),
+                        getattr(stats, 'demux_corrupted', 0))
+            rebuffers, stall_ms = (self.qoe.rebuffer_count, self.qoe.stall_ms) if self.qoe else (0, 0)
+            quality_score = self.quality_scorer.score(counters, rebuffers, stall_ms)
+
+            # 更新历史记录（deque按maxlen自动丢弃最旧的记录）
             self.network_quality_history.append(quality_score)
-            if len(self.network_quality_history) > self.history_size:
-                self.network_quality_history.pop(0)
-                
-            # 更新网络不稳定计数
-            if quality_score < 60:  # 如果质量分数低于60
-                self.network_unstable_count += 1
-            else:
-                self.network_unstable_count = max(0, self.network_unstable_count - 1)
-                
+
         except Exception as e:
             self.logger.error(f"更新网络质量时出错: {str(e)}")
             
-    def adjust_buffer_thresholds(self):
-        """根据网络质量调整缓冲阈值"""
+    def adapt_to_network_quality(self):
+        """根据网络质量调整码率和代理预取深度"""
         try:
             if not self.network_quality_history:
                 return
-                
+
             # 计算最近的平均网络质量
             avg_quality = sum(self.network_quality_history) / len(self.network_quality_history)
-            
-            # 根据网络质量调整缓冲阈值
-            if avg_quality >= 80:  # 网络质量很好
-                self.min_buffer_threshold = 0.15  # 15%
-                self.max_buffer_threshold = 0.6   # 60%
-            elif avg_quality >= 60:  # 网络质量一般
-                self.min_buffer_threshold = 0.2   # 20%
-                self.max_buffer_threshold = 0.8   # 80%
-            else:  # 网络质量差
-                self.min_buffer_threshold = 0.3   # 30%
-                self.max_buffer_threshold = 0.9   # 90%
-                
-            # 如果检测到持续的网络不稳定
-            if self.network_unstable_count > 5:
-                # 增加缓冲区大小
-                self.min_buffer_threshold = min(0.4, self.min_buffer_threshold + 0.1)
-                self.max_buffer_threshold = min(0.95, self.max_buffer_threshold + 0.1)
+
+            self._abr_update(self.network_quality_history[-1])
+
+            # 快速起播后网络质量稳定时，每10秒把代理预取深度加1，直到设定值
+            if (self.fast_start and self.proxy and avg_quality >= 60
+                    and len(self.network_quality_history) >= self.history_size
+                    and self.proxy.prefetch_segments < self.max_prefetch_segments
+                    and time.time() - self._last_depth_raise >= 10):
+                self.proxy.prefetch_segments += 1
+                self._last_depth_raise = time.time()
+                self.logger.info(f"播放稳定，预取深度提高到 {self.proxy.prefetch_segments} 个分片")
                 
         except Exception as e:
-            self.logger.error(f"调整缓冲阈值时出错: {str(e)}")
+            self.logger.error(f"根据网络质量调整时出错: {str(e)}")
             
     def toggle_adaptive_buffer(self):
         """切换自适应缓冲状态"""
@@ -588,29 +499,9 @@ class VideoPlayerWindow(tk.Toplevel):
         if self.adaptive_buffer_enabled:
             self.logger.info("已启用自适应缓冲")
             # 重置网络质量历史
-            self.network_quality_history = []
-            self.network_unstable_count = 0
+            self.network_quality_history.clear()
         else:
             self.logger.info("已禁用自适应缓冲")
-            # 恢复默认阈值
-            self.min_buffer_threshold = 0.2
-            self.max_buffer_threshold = 0.8
-
-    def enter_buffering_mode(self):
-        """进入缓冲模式"""
-        if not self.is_buffering:
-            self.is_buffering = True
-            self.player.pause()  # 暂停播放
-            self.status_label.config(text="状态: 等待缓冲...")
-            self.logger.info("进入缓冲模式")
-
-    def resume_from_buffering(self):
-        """从缓冲模式恢复"""
-        if self.is_buffering:
-            self.is_buffering = False
-            self.player.play()  # 恢复播放
-            self.status_label.config(text="状态: 正常播放")
-            self.logger.info("从缓冲模式恢复")
 
     def attempt_recovery(self):
         """尝试恢复播放"""
@@ -621,11 +512,19 @@ class VideoPlayerWindow(tk.Toplevel):
             # 最多尝试3次恢复
             if self.recovery_attempts < 3:
                 self.recovery_attempts += 1
-                self.logger.info(f"尝试恢复播放 (第{self.recovery_attempts}次)")
+                if self.qoe:
+                    self.qoe.mark_recovery()
+                speed = self.bandwidth.estimate()
+                speed_text = f"{speed:.1f}KB/s" if speed is not None else "未知"
+                self.logger.info(
+                    f"尝试恢复播放 (第{self.recovery_attempts}次)，网速估计 {speed_text}，"
+                    f"P10 {self.bandwidth.percentile(10) or 0:.1f}KB/s，"
+                    f"已 {self.bandwidth.idle_seconds():.0f} 秒没有读到数据"
+                )
                 
                 # 保存当前播放位置
                 current_time = self.player.get_time()
-                current_url = self.player.get_media().get_mrl()
+                current_url = self.current_video_url
                 
                 # 重新加载视频
                 self.status_label.config(text=f"状态: 正在重新连接 ({self.recovery_attempts}/3)...")
@@ -689,10 +588,6 @@ class VideoPlayerWindow(tk.Toplevel):
         # 设置窗口背景色
         self.configure(background='black')
 
-    def _rgba_to_hex(self, r, g, b, a):
-        """将RGBA颜色转换为十六进制格式"""
-        return f'#{int(r*a):02x}{int(g*a):02x}{int(b*a):02x}'
-
     def create_control_buttons(self):
         """创建控制按钮"""
         # 创建按钮组框架
@@ -734,16 +629,171 @@ class VideoPlayerWindow(tk.Toplevel):
                 self.episode_combobox = ttk.Combobox(
                     self.button_frame,
                     textvariable=self.episode_var,
-                    values=[video['title'] for video in self.video_list if 'title' in video],
+                    values=[self._episode_label(video) for video in self.video_list],
                     state='readonly'
                 )
-                if self.current_index < len(self.video_list) and 'title' in self.video_list[self.current_index]:
-                    self.episode_combobox.set(self.video_list[self.current_index]['title'])
+                if self.current_index < len(self.video_list):
+                    self.episode_combobox.current(self.current_index)
                 self.episode_combobox.pack(side=tk.RIGHT, padx=5)
                 self.episode_combobox.bind('<<ComboboxSelected>>', self.on_episode_selected)
             except Exception as e:
                 self.logger.error(f"创建选集下拉菜单失败: {str(e)}")
 
+    def _episode_label(self, video):
+        """选集菜单文字，分片索引已缓存时附带时长"""
+        label = video.get('title', '')
+        index = self.hls_resolver.cached(video.get('url', ''))
+        if index and index['total_duration'] > 0:
+            label += f" ({self.format_time(index['total_duration'] * 1000)})"
+        link_checker = getattr(self.parent, 'link_checker', None)
+        health = link_checker.store.get(video.get('url', '')) if link_checker else None
+        if health and health['status'] in STATUS_LABELS:
+            label += f" [{STATUS_LABELS[health['status']]}]"
+        if self.downloads.local_playlist(video.get('url', '')):
+            label += " [已下载]"
+        return label
+
+    def _refresh_episode_labels(self):
+        """后台解析完成后刷新选集菜单中的时长"""
+        if not hasattr(self, 'episode_combobox') or not self.winfo_exists():
+            return
+        self.episode_combobox.configure(values=[self._episode_label(video) for video in self.video_list])
+        if 0 <= self.current_index < len(self.video_list):
+            self.episode_combobox.current(self.current_index)
+
+    def _warm_playlists(self, count=3):
+        """后台解析当前及后续几集的播放列表"""
+        urls = [video['url'] for video in self.video_list[self.current_index:self.current_index + count]
+                if video.get('url') and self.hls_resolver.cached(video['url']) is None]
+        if not urls:
+            return
+
+        def on_resolved(url, index):
+            try:
+                self.after(0, self._refresh_episode_labels)
+            except Exception:
+                pass  # 窗口已关闭
+
+        self.hls_resolver.resolve_async(urls, on_resolved)
+
+    def _media_url(self, video_url):
+        """交给VLC的播放地址
+
+        已下载的剧集播放本地播放列表；有未过期的分片索引时直接使用码率列表地址，省去主列表请求；
+        启用代理时经本地代理播放。
+        """
+        local_playlist = self.downloads.local_playlist(video_url)
+        if local_playlist:
+            self.logger.info(f"播放已下载的剧集: {local_playlist}")
+            self.downloads.touch(video_url)
+            return local_playlist
+
+        if self.proxy and self.abr_enabled:
+            self._register_cache_episode(video_url, video_url)
+            selector = self._abr_selector(video_url)
+            if selector:
+                # 已预取过的剧集从预取的码率起播，否则按实测带宽选择
+                prefetched = self.proxy.prefetched_variant(video_url)
+                variant = selector.start_at(prefetched) if prefetched else selector.select(self.proxy.measured_kbps())
+                self.proxy.set_variant(video_url, variant['url'])
+            # 分片索引未缓存时由代理按实测带宽选择起始码率
+            return self.proxy.abr_url(video_url)
+
+        playlist_url = video_url
+        index = self.hls_resolver.cached(video_url)
+        if index and index['variant_url'] != video_url:
+            self.logger.info(f"使用缓存的码率列表: {index['variant_url']}")
+            playlist_url = index['variant_url']
+        if self.proxy:
+            self._register_cache_episode(playlist_url, video_url)
+            return self.proxy.proxy_url(playlist_url)
+        return playlist_url
+
+    def _register_cache_episode(self, playlist_url, video_url):
+        """告诉代理播放列表属于哪一集，缓存淘汰时据此判断是否已看完"""
+        video = next((v for v in self.video_list if isinstance(v, dict) and v.get('url') == video_url), {})
+        self.proxy.register_episode(playlist_url, video_url, str(self.subscription_data.get('title', '')),
+                                    video.get('title', ''))
+
+    def _update_pins(self):
+        """当前剧集和备用播放器中的剧集不参与缓存淘汰"""
+        urls = set()
+        if not self._closed:
+            urls.add(self.current_video_url)
+            if self._standby_index is not None and self._standby_index < len(self.video_list):
+                urls.add(self.video_list[self._standby_index].get('url'))
+        urls.discard(None)
+        for url in urls - self._pinned_urls:
+            pin_episode(url)
+        for url in self._pinned_urls - urls:
+            unpin_episode(url)
+        self._pinned_urls = urls
+
+    def _abr_selector(self, video_url):
+        """剧集的码率选择器，分片索引未缓存、只有一个码率或各码率不能互换时返回None"""
+        if self.proxy.abr_switchable(video_url) is False:
+            return None
+        if video_url in self._abr_selectors:
+            return self._abr_selectors[video_url]
+        index = self.hls_resolver.cached(video_url)
+        if not index or len(index.get('variants', [])) < 2:
+            return None
+        selector = ABRSelector(index['variants'], current_url=self.proxy.current_variant(video_url))
+        self._abr_selectors[video_url] = selector
+        return selector
+
+    def _abr_update(self, quality_score):
+        """根据最新质量得分调整当前剧集的码率"""
+        if not (self.proxy and self.abr_enabled):
+            return
+        selector = self._abr_selector(self.current_video_url)
+        if selector is None:
+            return
+        variant = selector.update(self.proxy.measured_kbps(), quality_score)
+        if variant:
+            self.proxy.set_variant(self.current_video_url, variant['url'])
+            self.logger.info(f"码率调整为 {variant['bandwidth'] // 1000}kbps {variant.get('resolution', '')}")
+
+    def _abr_step_down(self):
+        """降低当前剧集的码率，成功时返回True"""
+        if not (self.proxy and self.abr_enabled):
+            return False
+        selector = self._abr_selector(self.current_video_url)
+        variant = selector.step_down() if selector else None
+        if variant is None:
+            return False
+        self.proxy.set_variant(self.current_video_url, variant['url'])
+        self.status_label.config(text="状态: 网络较差，已降低清晰度")
+        self.logger.info(f"网络较差，码率降为 {variant['bandwidth'] // 1000}kbps，不暂停播放")
+        return True
+
+    def _prefetch_next_episode(self):
+        """后台预取下一集（每集只触发一次）"""
+        next_index = self.current_index + 1
+        if not self.proxy or next_index >= len(self.video_list) or self._next_prefetch_index == next_index:
+            return
+        self._next_prefetch_index = next_index
+        next_url = self.video_list[next_index].get('url')
+        if not next_url or self.downloads.local_playlist(next_url):
+            return
+
+        self.logger.info(f"开始预取下一集: {self.video_list[next_index].get('title', '')}")
+        self._register_cache_episode(next_url, next_url)
+        threading.Thread(
+            target=self.proxy.prefetch_episode,
+            args=(next_url, self.intro_duration,
+                  self.playback_settings.get('next_prefetch_seconds', 30),
+                  self.playback_settings.get('next_prefetch_kbps', 2048), self.abr_enabled),
+            daemon=True
+        ).start()
+
+    def segment_for_time(self, ms):
+        """当前剧集播放时间对应的(分片序号, 分片内偏移毫秒)，没有索引时返回None"""
+        index = self.hls_resolver.cached(self.current_video_url)
+        if not index or not index['segments']:
+            return None
+        return segment_at(index, ms)
+
     def create_progress_bar(self):
         """创建进度条"""
         # 创建进度条容器
@@ -819,6 +869,7 @@ class VideoPlayerWindow(tk.Toplevel):
             self._seeking = False
         if not self._seeking:
             position = float(value) / 100.0
+            self._mark_seek()
             self.player.set_position(position)
 
     def on_progress_click(self, event):
@@ -828,6 +879,7 @@ class VideoPlayerWindow(tk.Toplevel):
         x = event.x
         position = max(0, min(1, x / width))
         self.progress_var.set(position * 100)
+        self._mark_seek()
         self.player.set_position(position)
         self._seeking = False
 
@@ -838,11 +890,16 @@ class VideoPlayerWindow(tk.Toplevel):
         x = event.x
         position = max(0, min(1, x / width))
         self.progress_var.set(position * 100)
+        self._mark_seek()
         self.player.set_position(position)
 
     def on_progress_release(self, event):
         """处理进度条释放事件"""
         self._seeking = False
+        length = self.player.get_length()
+        segment = self.segment_for_time(int(self.progress_var.get() / 100 * length)) if length > 0 else None
+        if segment:
+            self.logger.debug(f"跳转到第{segment[0] + 1}个分片，偏移{segment[1]}ms")
 
     def skip_intro(self):
         """跳过片头并记录播放历史"""
@@ -850,6 +907,7 @@ class VideoPlayerWindow(tk.Toplevel):
         current_time = self.player.get_time()
         if current_time < self.intro_duration * 1000:  # 转换为毫秒
             skip_to = self.intro_duration * 1000
+            self._mark_seek()
             self.player.set_time(skip_to)
             # 记录跳过片头后的播放位置
             if hasattr(self, 'current_index') and 0 <= self.current_index < len(self.video_list):
@@ -937,193 +995,195 @@ class VideoPlayerWindow(tk.Toplevel):
             self.logger.error(f"保存设置失败: {str(e)}")
             messagebox.showerror("错误", f"保存设置失败: {str(e)}")
 
-    def _update_progress_bar(self):
-        """更新进度条和时间显示"""
-        if not self.player.is_playing():
+    def _sample_player(self):
+        """每个节拍采集一次播放器状态，订阅者只读这份快照"""
+        if not getattr(self, 'player', None):
+            return None
+        media = self.player.get_media()
+        snapshot = {
+            'has_media': media is not None,
+            'state': self.player.get_state(),
+            'playing': bool(self.player.is_playing()),
+            'time': self.player.get_time(),
+            'length': self.player.get_length(),
+            'position': self.player.get_position(),
+            'stats': None
+        }
+        if media is not None:
+            if snapshot['playing']:
+                stats = vlc.MediaStats()
+                if media.get_stats(stats):
+                    snapshot['stats'] = stats
+            # get_media()增加了引用计数
+            media.release()
+        return snapshot
+
+    def _tick_interval(self, snapshot):
+        """播放且窗口在前台时500ms一次，不在前台时1秒，暂停或最小化时2秒"""
+        if not snapshot or not snapshot['playing'] or self.state() == 'iconic':
+            return 2000
+        try:
+            focus = self.focus_displayof()
+            focused = focus is not None and focus.winfo_toplevel() is self
+        except (KeyError, tk.TclError):
+            focused = False
+        return 500 if focused else 1000
+
+    def _tick_progress(self, snapshot):
+        """更新进度条、时间显示和片头按钮"""
+        if not snapshot['playing']:
             return
+        if not getattr(self, '_seeking', False):
+            self.progress_var.set(snapshot['position'] * 100)
 
-        position = self.player.get_position()
-        if not hasattr(self, '_seeking') or not self._seeking:
-            self.progress_var.set(position * 100)
-
-        current_time = self.player.get_time()
-        total_time = self.player.get_length()
+        current_time, total_time = snapshot['time'], snapshot['length']
         if current_time >= 0 and total_time > 0:
-            time_text = f"{self.format_time(current_time)} / {self.format_time(total_time)}"
-            self.time_display.configure(text=time_text)
-
-    def _update_button_states(self):
-        """更新按钮状态"""
-        if not self.player.is_playing():
-            return
+            self.time_display.configure(text=f"{self.format_time(current_time)} / {self.format_time(total_time)}")
 
-        current_time = self.player.get_time()
-        total_time = self.player.get_length()
-
-        # 更新片头片尾按钮高亮状态
-        if current_time < self.intro_duration * 1000:
-            self.skip_intro_button.configure(style='PlayerHighlight.TButton')
-        else:
-            self.skip_intro_button.configure(style='Player.TButton')
-
-    def _update_network_stats(self):
-        """更新网络统计信息"""
-        if not hasattr(self, 'network_speed_label') or not hasattr(self, 'status_label'):
-            return
-
-        try:
-            media = self.player.get_media()
-            if not media:
-                self.network_speed_label.config(text="网速: --")
-                self.status_label.config(text="状态: 无媒体")
-                return
-
-            stats = vlc.MediaStats()
-            if not media.get_stats(stats):
-                self.network_speed_label.config(text="网速: --")
-                self.status_label.config(text="状态: 统计失败")
-                return
-
-            # 计算网速
-            bytes_read = getattr(stats, 'read_bytes', 0)
-            if hasattr(self, 'last_bytes'):
-                bytes_diff = bytes_read - self.last_bytes
-                speed = bytes_diff / 1024  # KB/s
-                if speed > 1024:
-                    self.network_speed_label.config(text=f"网速: {speed/1024:.1f} MB/s")
-                else:
-                    self.network_speed_label.config(text=f"网速: {speed:.1f} KB/s")
-                self.last_bytes = bytes_read
+        if hasattr(self, 'skip_intro_button'):
+            if current_time < self.intro_duration * 1000:
+                self.skip_intro_button.configure(style='PlayerHighlight.TButton')
             else:
-                self.last_bytes = bytes_read
-
-            # 更新播放状态
-            lost_pictures = getattr(stats, 'lost_pictures', -1)
-            lost_abuffers = getattr(stats, 'lost_abuffers', -1)
-            demux_corrupted = getattr(stats, 'demux_corrupted', -1)
-            demux_discontinuity = getattr(stats, 'demux_discontinuity', -1)
-
-            if lost_pictures > 0 or lost_abuffers > 0:
-                self.status_label.config(text="状态: 播放不稳定")
-            elif demux_corrupted > 0:
-                self.status_label.config(text="状态: 数据损坏")
-            elif demux_discontinuity > 0:
-                self.status_label.config(text="状态: 播放中断")
-            else:
-                self.status_label.config(text="状态: 正常播放")
+                self.skip_intro_button.configure(style='Player.TButton')
 
-        except Exception as e:
-            self.logger.error(f"更新网络统计时出错: {str(e)}")
+    def _tick_network(self, snapshot):
+        """采样读取速度，更新网速和播放状态显示"""
+        if not snapshot['playing']:
             self.network_speed_label.config(text="网速: --")
-            self.status_label.config(text="状态: 统计错误")
+            if not snapshot['has_media']:
+                self.status_label.config(text="状态: 未加载")
+            elif snapshot['state'] == vlc.State.Error:
+                self.status_label.config(text="状态: 播放错误")
+            elif snapshot['state'] == vlc.State.Ended:
+                self.status_label.config(text="状态: 播放结束")
+                self.show_controls_temporarily()
+            elif snapshot['state'] == vlc.State.Buffering:
+                self.status_label.config(text="状态: 正在缓冲...")
+            else:
+                self.status_label.config(text="状态: 已暂停")
+            return
 
-    def _update_non_playing_status(self):
-        """更新非播放状态信息"""
-        if not hasattr(self, 'network_speed_label') or not hasattr(self, 'status_label'):
+        stats = snapshot['stats']
+        if stats is None:
+            self.network_speed_label.config(text="网速: --")
+            self.status_label.config(text="状态: 统计信息不可用")
             return
 
-        self.network_speed_label.config(text="网速: --")
+        # 唯一的速度采样点，按实际间隔计算，与节拍快慢无关
+        self.bandwidth.add_bytes(getattr(stats, 'read_bytes', 0))
+        self._show_network_speed()
 
-        if not self.player.get_media():
-            self.status_label.config(text="状态: 未加载")
-        elif self.player.get_state() == vlc.State.Error:
-            self.status_label.config(text="状态: 播放错误")
-        elif self.player.get_state() == vlc.State.Ended:
-            self.status_label.config(text="状态: 播放结束")
-            self.show_controls_temporarily()
+        lost_pictures = getattr(stats, 'lost_pictures', -1)
+        lost_abuffers = getattr(stats, 'lost_abuffers', -1)
+        if lost_pictures > 0 or lost_abuffers > 0:
+            self.status_label.config(text="状态: 播放不稳定")
+        elif lost_pictures == -1 and lost_abuffers == -1:
+            self.status_label.config(text="状态: 统计信息不可用")
         else:
-            self.status_label.config(text="状态: 已暂停")
+            self.status_label.config(text="状态: 正常播放")
 
-    def update_progress(self):
-        """更新进度条、时间显示和网络状态"""
-        try:
-            if not hasattr(self, 'player') or not self.player:
-                self.logger.warning("播放器未初始化")
-                return
+    def _tick_buffer(self, snapshot):
+        """更新网络质量并据此调整码率和预取深度；播放器刚进入错误状态时尝试恢复"""
+        state = snapshot['state']
+        previous_state, self._last_player_state = self._last_player_state, state
+        if state == vlc.State.Error and previous_state != vlc.State.Error:
+            self.attempt_recovery()
+            return
 
-            if self.player.is_playing():
-                # 更新进度条和时间显示
-                position = self.player.get_position()
-                if not hasattr(self, '_seeking') or not self._seeking:
-                    self.progress_var.set(position * 100)
+        if snapshot['playing'] and snapshot['stats'] is not None and self.adaptive_buffer_enabled:
+            self.update_network_quality(snapshot['stats'])
+            self.adapt_to_network_quality()
 
-                current_time = self.player.get_time()
-                total_time = self.player.get_length()
-                if current_time >= 0 and total_time > 0:
-                    time_text = f"{self.format_time(current_time)} / {self.format_time(total_time)}"
-                    self.time_display.configure(text=time_text)
+    def _tick_history(self, snapshot):
+        """播放中每10秒记录一次播放进度"""
+        if not snapshot['playing'] or snapshot['time'] < 0:
+            return
+        now = time.time()
+        if now - self.last_record_time >= 10 and 0 <= self.current_index < len(self.video_list):
+            video = self.video_list[self.current_index]
+            video['series_title'] = self.subscription_data.get('title', {})
+            self.save_play_history(video, snapshot['time'])
+            self.last_record_time = now
 
-                # 更新按钮状态
-                if current_time < self.intro_duration * 1000:
-                    self.skip_intro_button.configure(style='PlayerHighlight.TButton')
-                else:
-                    self.skip_intro_button.configure(style='Player.TButton')
-
-                # 更新网络状态
-                if hasattr(self, 'network_speed_label') and hasattr(self, 'status_label'):
-                    try:
-                        media = self.player.get_media()
-                        if media:
-                            stats = vlc.MediaStats()
-                            if media.get_stats(stats):
-                                # 计算网速
-                                bytes_read = getattr(stats, 'read_bytes', 0)
-                                if hasattr(self, 'last_bytes'):
-                                    bytes_diff = bytes_read - self.last_bytes
-                                    speed = bytes_diff / 1024  # KB/s
-                                    if speed > 1024:
-                                        self.network_speed_label.config(text=f"网速: {speed/1024:.1f} MB/s")
-                                    else:
-                                        self.network_speed_label.config(text=f"网速: {speed:.1f} KB/s")
-                                    self.last_bytes = bytes_read
-                                else:
-                                    self.last_bytes = bytes_read
-
-                                # 更新播放状态
-                                lost_pictures = getattr(stats, 'lost_pictures', -1)
-                                lost_abuffers = getattr(stats, 'lost_abuffers', -1)
-                                if lost_pictures > 0 or lost_abuffers > 0:
-                                    self.status_label.config(text="状态: 播放不稳定")
-                                elif lost_pictures == -1 and lost_abuffers == -1:
-                                    self.status_label.config(text="状态: 统计信息不可用")
-                                else:
-                                    self.status_label.config(text="状态: 正常播放")
-                    except Exception as e:
-                        self.logger.error(f"更新网络状态时出错: {str(e)}")
-                        if hasattr(self, 'network_speed_label'):
-                            self.network_speed_label.config(text="网速: --")
-                        if hasattr(self, 'status_label'):
-                            self.status_label.config(text="状态: 统计错误")
-            else:
-                # 非播放状态更新
-                if hasattr(self, 'network_speed_label'):
-                    self.network_speed_label.config(text="网速: --")
-                if hasattr(self, 'status_label'):
-                    if not self.player.get_media():
-                        self.status_label.config(text="状态: 未加载")
-                    elif self.player.get_state() == vlc.State.Error:
-                        self.status_label.config(text="状态: 播放错误")
-                    elif self.player.get_state() == vlc.State.Ended:
-                        self.status_label.config(text="状态: 播放结束")
-                        self.show_controls_temporarily()
-                    else:
-                        self.status_label.config(text="状态: 已暂停")
+    def _tick_qoe(self, snapshot):
+        """累计卡顿和读取字节数：播放器在缓冲，或播放中时间超过1秒没有前进都算卡顿
 
-        except Exception as e:
-            self.logger.error(f"更新进度时出错: {str(e)}")
-            if hasattr(self, 'status_label'):
-                self.status_label.config(text="状态: 更新错误")
-            if hasattr(self, 'network_speed_label'):
-                self.network_speed_label.config(text="网速: --")
+        起播后每次开始卡顿时，多码率剧集降低一档码率（从下一个分片生效），不暂停播放；
+        拖动进度条或跳过片头后的宽限期内的卡顿不降码率。
+        """
+        if self.qoe is None or self.qoe.finished:
+            return
+        now = time.perf_counter()
+        frozen = False
+        if snapshot['playing'] and self._last_progress is not None:
+            last_time, since = self._last_progress
+            if snapshot['time'] == last_time:
+                frozen = now - since >= 1
+            else:
+                self._last_progress = (snapshot['time'], now)
+        else:
+            self._last_progress = (snapshot['time'], now)
+        stalled = snapshot['state'] == vlc.State.Buffering or frozen
+        seeking = self._seek_in_progress(stalled, now)
+        stats = snapshot['stats']
+        rebuffers = self.qoe.rebuffer_count
+        self.qoe.on_tick(stalled, getattr(stats, 'read_bytes', None) if stats is not None else None, now,
+                         seeking=seeking)
+        if self.qoe.rebuffer_count > rebuffers and not seeking:
+            self._abr_step_down()
+
+    def _mark_seek(self):
+        """记录一次跳转：重新计算画面冻结，并开始跳转宽限期"""
+        self._seek_started = time.perf_counter()
+        self._last_progress = None
+        if self.qoe and not self.qoe.finished:
+            self.qoe.mark_seek(self._seek_started)
+
+    def _seek_in_progress(self, stalled, now):
+        """跳转后到画面恢复前的等待算作跳转；超过宽限期仍卡住则按真实卡顿处理"""
+        if self._seek_started is None:
+            return False
+        elapsed = now - self._seek_started
+        # 冻结判定需要1秒，跳转后至少观察1.5秒才能确认已恢复播放
+        if elapsed >= self.seek_grace or (not stalled and elapsed >= 1.5):
+            self._seek_started = None
+            return False
+        return True
 
-        self.after(500, self.update_progress)
+    def _begin_qoe_session(self, gapless=False):
+        """为当前剧集开始质量记录；同一集的重试和恢复沿用已有会话"""
+        if self.qoe and not self.qoe.finished and self.qoe.url == self.current_video_url:
+            return
+        self._end_qoe_session()
+        index = next((i for i, video in enumerate(self.video_list) if video.get('url') == self.current_video_url),
+                     self.current_index)
+        episode = self.video_list[index].get('title', '') if 0 <= index < len(self.video_list) else ''
+        self.qoe = QoESession(self.current_video_url, str(self.subscription_data.get('title', '')), episode, index,
+                              switch_started=self._switch_requested, gapless=gapless)
+        self._switch_requested = None
+        self._last_progress = None
+        self._seek_started = None
+
+    def _end_qoe_session(self):
+        """结束当前会话并写入记录"""
+        if self.qoe is None or self.qoe.finished:
+            return
+        position = self.player.get_time() if self.player else -1
+        record = self.qoe.finish(position if position > 0 else None)
+        self.qoe_log.append(record)
+        self.logger.info(
+            f"播放质量: 起播 {record['startup_ms']}ms，首帧 {record['first_frame_ms']}ms，"
+            f"切集 {record['switch_ms']}ms，卡顿 {record['rebuffer_count']}次/{record['stall_ms']}ms，"
+            f"恢复 {record['recovery_attempts']}次，读取 {record['bytes_read'] / 1024 / 1024:.1f}MB"
+        )
 
     def play_previous(self):
         """播放上一集"""
         if self.video_list and self.current_index > 0:
+            self._switch_requested = time.perf_counter()
             self.current_index -= 1
             self.play_video(self.video_list[self.current_index])
-            self.episode_combobox.set(self.video_list[self.current_index]['title'])
+            self.episode_combobox.current(self.current_index)
 
     def play_next(self):
         """播放下一集"""
@@ -1134,18 +1194,20 @@ class VideoPlayerWindow(tk.Toplevel):
         next_index = self.current_index + 1
         next_video = self.video_list[next_index]
         self.logger.info(f"准备播放下一集: {next_video['title']}")
+        self._switch_requested = time.perf_counter()
 
         # 保存当前窗口状态
         was_fullscreen = self.is_fullscreen
         original_geometry = self.original_geometry if hasattr(self, 'original_geometry') else None
 
-        # 播放下一集
-        self.play_video(next_video)
+        # 播放下一集（备用播放器已就绪时直接切换）
+        if not self._switch_to_standby(next_index):
+            self.play_video(next_video)
 
         # 更新当前索引和标题
         self.current_index = next_index
         if hasattr(self, 'episode_combobox'):
-            self.episode_combobox.set(next_video['title'])
+            self.episode_combobox.current(next_index)
 
         # 恢复窗口状态
         if was_fullscreen:
@@ -1160,7 +1222,9 @@ class VideoPlayerWindow(tk.Toplevel):
             self.title(f"正在播放: {video['title']}")
 
             # 停止当前播放
+            self._end_qoe_session()
             self.player.stop()
+            self._release_standby_player()
 
             # 获取当前窗口状态
             was_fullscreen = self.is_fullscreen
@@ -1175,8 +1239,15 @@ class VideoPlayerWindow(tk.Toplevel):
                 self.logger.info(f"从历史记录恢复播放: 第{current_episode}集 时间点: {seek_time}ms")
 
             # 播放新视频
-            media = self.instance.media_new(video['url'])
+            self.current_video_url = video['url']
+            self._update_pins()
+            caching_ms = self._startup_caching(video['url'])
+            media = self._create_media(self._media_url(video['url']), caching_ms)
             self.player.set_media(media)
+            media.release()
+            self.bandwidth.reset_counter()
+            self.quality_scorer.reset()
+            self._start_load_timer(caching_ms)
             self.player.play()
 
             # 设置播放位置
@@ -1194,24 +1265,26 @@ class VideoPlayerWindow(tk.Toplevel):
             self.save_play_history(video)
             self.last_record_time = time.time()
 
+            self._warm_playlists()
+
         except Exception as e:
             self.logger.error(f"播放视频时出错: {str(e)}")
             messagebox.showerror("播放错误", f"无法播放视频: {str(e)}")
 
     def on_episode_selected(self, event):
         """处理选集事件"""
-        selected_title = self.episode_var.get()
-        for i, video in enumerate(self.video_list):
-            if video['title'] == selected_title:
-                self.current_index = i
-                # 添加系列标题信息
-                video['series_title'] = self.subscription_data.get('title', {})
-                self.play_video(video)
-                # 记录选集信息
-                self.save_play_history(video)
-                # 重置记录时间
-                self.last_record_time = time.time()
-                break
+        i = self.episode_combobox.current()
+        if 0 <= i < len(self.video_list):
+            self._switch_requested = time.perf_counter()
+            video = self.video_list[i]
+            self.current_index = i
+            # 添加系列标题信息
+            video['series_title'] = self.subscription_data.get('title', {})
+            self.play_video(video)
+            # 记录选集信息
+            self.save_play_history(video)
+            # 重置记录时间
+            self.last_record_time = time.time()
 
     def toggle_fullscreen(self, event=None):
         """切换全屏模式"""
@@ -1270,7 +1343,16 @@ class VideoPlayerWindow(tk.Toplevel):
 
     def on_closing(self):
         """窗口关闭时的处理"""
-        self.player.stop()
+        self._closed = True
+        self._end_qoe_session()
+        self.ticker.stop()
+        self.events.stop()
+        self._detach_player_events(self.player)
+        self._release_standby_player()
+        self.pool.release(self.player)
+        self._update_pins()
+        if self.proxy:
+            self.logger.info(f"HLS缓存代理统计: {self.proxy.get_stats()}")
         self.destroy()
 
     def load_video(self, video_url, retry_count=0):
@@ -1279,6 +1361,9 @@ class VideoPlayerWindow(tk.Toplevel):
             video_url: 视频URL
             retry_count: 当前重试次数，内部使用
         """
+        if self._closed:
+            # 窗口关闭后仍在等待的重试，播放器已归还
+            return
         try:
             if not video_url or not isinstance(video_url, str):
                 raise ValueError("无效的视频URL")
@@ -1288,33 +1373,29 @@ class VideoPlayerWindow(tk.Toplevel):
                 raise ValueError("视频URL必须以http://或https://开头")
 
             # 获取视频框架的句柄
+            self._bind_video_output(self.player, self.video_frame)
             if sys.platform.startswith('win'):
-                hwnd = self.video_frame.winfo_id()
-                self.player.set_hwnd(hwnd)
-                
-                # 重新绑定事件到视频框架
-                self.video_frame.bind('<Double-Button-1>', lambda e: self.toggle_fullscreen())
-                self.video_frame.bind('<Motion>', lambda e: self.show_controls_temporarily())
-
                 # 确保视频框架在最上层但不遮挡控件
                 self.video_frame.lift()
-                
-            elif sys.platform.startswith('linux'):
-                self.player.set_xwindow(self.video_frame.winfo_id())
-            elif sys.platform.startswith('darwin'):
-                self.player.set_nsobject(self.video_frame.winfo_id())
-
-            # 创建媒体并设置网络缓存（增加缓冲时间和容错）
-            media = self.instance.media_new(video_url)
-            media.add_option(':network-caching=60000')  # 增加到60秒网络缓存
-            media.add_option(':file-caching=60000')     # 增加到60秒文件缓存
-            media.add_option(':live-caching=60000')     # 直播缓存
-            media.add_option(':clock-jitter=5000')      # 增加时钟抖动容忍
-            media.add_option(':clock-synchro=1')        # 启用时钟同步
-            media.add_option(':http-reconnect=1')       # 启用HTTP重连
-            # media.add_option(':rtsp-tcp=1')             # 使用TCP而不是UDP
-            media.add_option(':network-timeout=5000')   # 网络超时时间
+
+            # 首次加载使用缓存的码率列表，重试时回退到原始地址并清除索引
+            self.current_video_url = video_url
+            self._update_pins()
+            if retry_count == 0 or self.downloads.local_playlist(video_url):
+                media_url = self._media_url(video_url)
+            else:
+                self.hls_resolver.invalidate(video_url)
+                media_url = video_url
+
+            caching_ms = self._startup_caching(video_url)
+            media = self._create_media(media_url, caching_ms)
             self.player.set_media(media)
+            media.release()
+            # 新媒体的read_bytes从0开始计数
+            self.bandwidth.reset_counter()
+            self.quality_scorer.reset()
+            if retry_count == 0:
+                self._start_load_timer(caching_ms)
 
             # 开始播放
             if self.player.play() == -1:
@@ -1327,8 +1408,10 @@ class VideoPlayerWindow(tk.Toplevel):
             # 更新播放按钮状态
             self.play_button.config(text="⏸")
 
-            # 开始更新进度条
-            self.update_progress()
+            # 启动节拍循环（已在运行时不会重复启动）
+            self.ticker.start()
+
+            self._warm_playlists()
 
         except Exception as e:
             self.logger.error(f"加载视频时出错: {str(e)}")
@@ -1341,8 +1424,193 @@ class VideoPlayerWindow(tk.Toplevel):
                 messagebox.showerror("播放错误", f"无法播放视频: {str(e)}")
                 self.destroy()
 
-    def on_media_playing(self, event):
-        """视频开始播放时的回调"""
+    def _bind_video_output(self, player, frame):
+        """把播放器的视频输出绑定到指定框架"""
+        if sys.platform.startswith('win'):
+            player.set_hwnd(frame.winfo_id())
+
+            # 重新绑定事件到视频框架
+            frame.bind('<Double-Button-1>', lambda e: self.toggle_fullscreen())
+            frame.bind('<Motion>', lambda e: self.show_controls_temporarily())
+        elif sys.platform.startswith('linux'):
+            player.set_xwindow(frame.winfo_id())
+        elif sys.platform.startswith('darwin'):
+            player.set_nsobject(frame.winfo_id())
+
+    def _startup_caching(self, video_url):
+        """起播网络缓存（毫秒）
+
+        按码率与实测带宽之比确定：带宽是码率2倍以上时只缓存1.5秒，接近码率时3秒，
+        更慢时按比例增加，最多10秒。未启用快速起播时保持60秒。
+        """
+        if self.downloads.local_playlist(video_url):
+            # 本地文件不受网络影响
+            return 1000
+        if not self.fast_start:
+            return 60000
+
+        index = self.hls_resolver.cached(video_url)
+        selector = self._abr_selectors.get(video_url)
+        if selector:
+            bitrate = selector.current_variant['bandwidth'] / 1000
+        elif index and index.get('bandwidth'):
+            bitrate = index['bandwidth'] / 1000
+        else:
+            bitrate = self.playback_settings.get('assumed_bitrate_kbps', 2000)
+        # 代理测得的是分片下载带宽；不经代理时退回播放器读取速度的估计（受播放消耗限制，偏保守）
+        bandwidth = self.proxy.measured_kbps() if self.proxy else self.bandwidth.estimate_kbps()
+
+        if bandwidth:
+            caching = 3000 * bitrate / bandwidth
+        else:
+            caching = self.playback_settings.get('startup_caching_ms', 3000)
+        caching = int(min(max(caching, 1500), 10000))
+        bandwidth_text = f"{bandwidth:.0f}kbps" if bandwidth else "未知"
+        self.logger.info(f"起播缓存: {caching}ms（码率 {bitrate:.0f}kbps，带宽 {bandwidth_text}）")
+        return caching
+
+    def _start_load_timer(self, caching_ms):
+        """记录开始加载的时间，用于统计首帧时间；快速起播时先用较小的预取深度"""
+        self._load_started = time.perf_counter()
+        self._startup_caching_ms = caching_ms
+        self._begin_qoe_session()
+        self.qoe.caching_ms = caching_ms
+        if self.fast_start and self.proxy:
+            self.proxy.prefetch_segments = min(self.max_prefetch_segments,
+                                               self.playback_settings.get('startup_prefetch_segments', 2))
+
+    def _create_media(self, media_url, caching_ms=60000):
+        """创建媒体并设置网络缓存（增加缓冲时间和容错）"""
+        media = self.instance.media_new(media_url)
+        media.add_option(f':network-caching={caching_ms}')  # 网络缓存
+        media.add_option(f':file-caching={caching_ms}')     # 文件缓存
+        media.add_option(f':live-caching={caching_ms}')     # 直播缓存
+        media.add_option(':clock-jitter=5000')      # 增加时钟抖动容忍
+        media.add_option(':clock-synchro=1')        # 启用时钟同步
+        media.add_option(':http-reconnect=1')       # 启用HTTP重连
+        # media.add_option(':rtsp-tcp=1')             # 使用TCP而不是UDP
+        media.add_option(':network-timeout=5000')   # 网络超时时间
+        return media
+
+    def _attach_player_events(self, player):
+        """为播放器绑定窗口的事件回调（事件管理器从播放器池取得，解除时用同一个对象）"""
+        self.event_manager = self.pool.event_manager(player)
+        self.event_manager.event_attach(vlc.EventType.MediaPlayerPlaying, self.events.callback(self.on_media_playing))
+        # TimeChanged每秒触发多次，只处理最新一次
+        self.event_manager.event_attach(vlc.EventType.MediaPlayerTimeChanged,
+                                        self.events.callback(self.on_time_changed, coalesce=True))
+        self.event_manager.event_attach(vlc.EventType.MediaPlayerLengthChanged,
+                                        self.events.callback(self.on_length_changed))
+        self.event_manager.event_attach(vlc.EventType.MediaPlayerVout, self.events.callback(self.on_video_output))
+
+    def _detach_player_events(self, player):
+        """解除播放器的事件回调"""
+        event_manager = self.pool.event_manager(player)
+        for event_type in (vlc.EventType.MediaPlayerPlaying, vlc.EventType.MediaPlayerTimeChanged,
+                           vlc.EventType.MediaPlayerLengthChanged, vlc.EventType.MediaPlayerVout):
+            event_manager.event_detach(event_type)
+
+    def _arm_standby_player(self, next_index):
+        """无缝切换：用第二个播放器在隐藏的框架中预先打开下一集并暂停在片头之后"""
+        if self._standby_index == next_index or next_index >= len(self.video_list):
+            return
+        self._release_standby_player()
+        video = self.video_list[next_index]
+        if not video.get('url'):
+            return
+
+        try:
+            # 有下一集的播放记录时从记录位置开始，否则直接从片头之后开始
+            start_ms = self.intro_duration * 1000
+            if self.last_play_info and self.last_play_info['episode_number'] == next_index + 1:
+                start_ms = max(start_ms, self.last_play_info['current_time'])
+
+            player = self.pool.acquire()
+            self._bind_video_output(player, self.standby_frame)
+            media = self._create_media(self._media_url(video['url']), self._startup_caching(video['url']))
+            media.add_option(f':start-time={start_ms / 1000:.3f}')
+            player.set_media(media)
+            media.release()
+            player.audio_set_mute(True)
+
+            def on_standby_playing():
+                # 开始播放说明已完成缓冲和首帧解码，暂停等待切换
+                if self.standby_player is player:
+                    self._standby_ready = True
+                    player.set_pause(1)
+
+            self.pool.event_manager(player).event_attach(vlc.EventType.MediaPlayerPlaying,
+                                                         self.events.callback(on_standby_playing))
+            self.standby_player = player
+            self._standby_index = next_index
+            self._standby_ready = False
+            self._update_pins()
+            player.play()
+            self.logger.info(f"备用播放器开始预缓冲: {video.get('title', '')} 起始 {start_ms}ms")
+        except Exception as e:
+            self.logger.error(f"备用播放器预缓冲失败: {str(e)}")
+            self._release_standby_player()
+
+    def _release_standby_player(self):
+        """停止并释放备用播放器"""
+        player = self.standby_player
+        self.standby_player = None
+        self._standby_index = None
+        self._standby_ready = False
+        if player is not None:
+            self.pool.release(player)
+        self._update_pins()
+
+    def _switch_to_standby(self, next_index):
+        """切换到已预缓冲的备用播放器，返回是否成功"""
+        if self.standby_player is None or self._standby_index != next_index or not self._standby_ready:
+            self._release_standby_player()
+            return False
+
+        self._switch_started = time.perf_counter()
+        self._end_qoe_session()
+        old_player, new_player = self.player, self.standby_player
+        self.standby_player = None
+        self._standby_index = None
+        self._standby_ready = False
+
+        # 先显示新画面并恢复播放，再停止旧播放器
+        # 解除备用播放器暂停用的回调，之后的Playing事件交给窗口处理
+        self.pool.event_manager(new_player).event_detach(vlc.EventType.MediaPlayerPlaying)
+        self._attach_player_events(new_player)
+        self.standby_frame.lift(self.video_frame)
+        new_player.audio_set_mute(False)
+        new_player.set_pause(0)
+
+        self._detach_player_events(old_player)
+        self.player = new_player
+        self.bandwidth.reset_counter()
+        self.quality_scorer.reset()
+        self.video_frame, self.standby_frame = self.standby_frame, self.video_frame
+
+        self.after(0, lambda: self.pool.release(old_player))
+
+        video = self.video_list[next_index]
+        self.title(f"正在播放: {video['title']}")
+        self.current_video_url = video['url']
+        if self._switch_requested is None:
+            self._switch_requested = self._switch_started
+        self._begin_qoe_session(gapless=True)
+        self.qoe.mark_playing()
+        video['series_title'] = self.subscription_data.get('title', {})
+        self.save_play_history(video)
+        self.last_record_time = time.time()
+        self._update_pins()
+        return True
+
+    def on_media_playing(self, event=None):
+        """视频开始播放时的回调（经EventBridge在主线程执行）"""
+        if self.qoe:
+            self.qoe.mark_playing()
+        if self._load_started is not None:
+            self.last_ttff_ms = (time.perf_counter() - self._load_started) * 1000
+            self._load_started = None
+            self.logger.info(f"首帧时间(TTFF): {self.last_ttff_ms:.0f}ms，起播缓存 {self._startup_caching_ms}ms")
         try:
             # 获取视频尺寸
             video_width = self.player.video_get_width()
@@ -1411,26 +1679,35 @@ class VideoPlayerWindow(tk.Toplevel):
             self.logger.error(f"调整窗口大小时出错: {str(e)}")
             self.logger.error(traceback.format_exc())
 
-    def on_time_changed(self, event):
-        """视频时间变化时的回调"""
-        self.update_time_display()
+    def on_time_changed(self, event=None):
+        """视频时间变化时的回调（经EventBridge合并后在主线程执行，时间显示和播放记录由节拍循环处理）"""
         current_time = self.player.get_time()
-        
+
+        if self._switch_started is not None:
+            self.logger.info(f"无缝切换耗时: {(time.perf_counter() - self._switch_started) * 1000:.0f}ms")
+            self._switch_started = None
+        if self.qoe and current_time > 0:
+            # 没有收到视频输出事件时（如纯音频），以播放时间开始前进作为首帧
+            self.qoe.mark_first_frame()
+
         try:
-            # 每10秒记录一次播放进度
-            current_timestamp = time.time()  # 使用time模块的time()函数
-            if current_timestamp - self.last_record_time >= 10:
-                if hasattr(self, 'current_index') and 0 <= self.current_index < len(self.video_list):
-                    video = self.video_list[self.current_index]
-                    video['series_title'] =  self.subscription_data.get('title', {})
-                    self.save_play_history(video, current_time)
-                    self.last_record_time = current_timestamp
-            
+            # 播放进度超过设定比例后预取下一集
+            total_time = self.player.get_length()
+            if total_time > 0 and current_time >= total_time * self.next_prefetch_fraction:
+                self._prefetch_next_episode()
+
             # 检查是否到达片尾
             if self.outro_duration > 0 and current_time > 0:
                 total_time = self.player.get_length()
                 outro_start = total_time - (self.outro_duration * 1000)
 
+                # 片尾前gapless_arm_seconds秒开始预缓冲下一集
+                arm_at = outro_start - self.playback_settings.get('gapless_arm_seconds', 20) * 1000
+                if (self.gapless_enabled and current_time >= arm_at
+                        and self.current_index + 1 < len(self.video_list)
+                        and self._standby_index != self.current_index + 1):
+                    self._arm_standby_player(self.current_index + 1)
+
                 if current_time >= outro_start:
                     # 如果有下一集，自动播放下一集
                     if self.video_list and self.current_index < len(self.video_list) - 1:
@@ -1438,7 +1715,12 @@ class VideoPlayerWindow(tk.Toplevel):
         except Exception as e:
             self.logger.error(f"处理时间变化时出错: {str(e)}")
 
-    def on_length_changed(self, event):
+    def on_video_output(self, event=None):
+        """视频输出已创建，即首个画面开始显示"""
+        if self.qoe:
+            self.qoe.mark_first_frame()
+
+    def on_length_changed(self, event=None):
         """视频长度变化时的回调"""
         self.update_time_display()
 
@@ -1569,7 +1851,8 @@ class VideoPlayerWindow(tk.Toplevel):
                 'episode_number': episode_number,
                 'last_played_time': now,
                 'current_time': current_time if current_time else 0,
-                'total_time': self.player.get_length() if self.player else 0
+                'total_time': self.player.get_length() if self.player else 0,
+                'url': video.get('url', '')
             }
 
             # 更新历史记录
@@ -0,0 +1,111 @@
+import logging
+import queue
+import threading
+import time
+from typing import Callable, Dict
+
+
+class EventBridge:
+    """把libvlc线程上的事件转交给Tk主线程处理
+
+    VLC事件回调在libvlc的线程中执行，不能操作Tk部件，也不应做文件读写等耗时操作。
+    callback()包装出的回调只把处理函数放入线程安全的队列，由主线程上唯一的after循环
+    每interval_ms取出执行。coalesce=True的事件（如TimeChanged）只保留最新一次，
+    并且每coalesce_ms最多处理一次。
+
+    参数:
+        widget: 提供after/after_cancel的Tk部件
+    """
+
+    def __init__(self, widget, interval_ms: int = 50, coalesce_ms: int = 250):
+        self.logger = logging.getLogger(__name__)
+        self.widget = widget
+        self.interval_ms = interval_ms
+        self.coalesce_ms = coalesce_ms
+        self._queue: "queue.SimpleQueue[Callable[[], None]]" = queue.SimpleQueue()
+        self._coalesced: Dict[Callable[[], None], float] = {}
+        self._last_dispatch: Dict[Callable[[], None], float] = {}
+        self._lock = threading.Lock()
+        self._after_id = None
+        self._stopped = True
+        self.stats = {'posted': 0, 'dispatched': 0, 'coalesced': 0}
+
+    def callback(self, handler: Callable[[], None], coalesce: bool = False) -> Callable:
+        """包装为VLC事件回调，回调中不访问事件对象以外的任何状态"""
+        def on_event(event):
+            self.post(handler, coalesce)
+        return on_event
+
+    def post(self, handler: Callable[[], None], coalesce: bool = False):
+        """从任意线程提交一个在主线程执行的处理函数"""
+        with self._lock:
+            self.stats['posted'] += 1
+            if coalesce:
+                if handler in self._coalesced:
+                    self.stats['coalesced'] += 1
+                else:
+                    self._coalesced[handler] = time.monotonic()
+                return
+        self._queue.put(handler)
+
+    def start(self):
+        """在主线程启动取队列的循环，已在运行时不做任何事"""
+        self._stopped = False
+        if self._after_id is None:
+            self._after_id = self.widget.after(self.interval_ms, self._pump)
+
+    def stop(self):
+        """停止循环并丢弃未处理的事件"""
+        self._stopped = True
+        if self._after_id is not None:
+            try:
+                self.widget.after_cancel(self._after_id)
+            except Exception:
+                pass
+            self._after_id = None
+        with self._lock:
+            self._coalesced.clear()
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+    def _run(self, handler: Callable[[], None]):
+        try:
+            handler()
+            self.stats['dispatched'] += 1
+        except Exception as e:
+            self.logger.error(f"处理播放器事件{getattr(handler, '__name__', handler)}出错: {str(e)}")
+
+    def _pump(self):
+        self._after_id = None
+        if self._stopped:
+            return
+
+        while True:
+            try:
+                handler = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            self._run(handler)
+            if self._stopped:
+                return
+
+        now = time.monotonic()
+        with self._lock:
+            due = [handler for handler in self._coalesced
+                   if (now - self._last_dispatch.get(handler, 0)) * 1000 >= self.coalesce_ms]
+            for handler in due:
+                del self._coalesced[handler]
+                self._last_dispatch[handler] = now
+        for handler in due:
+            self._run(handler)
+            if self._stopped:
+                return
+
+        try:
+            self._after_id = self.widget.after(self.interval_ms, self._pump)
+        except Exception:
+            # 窗口已销毁
+            self._stopped = True
@@ -0,0 +1,152 @@
+import logging
+import sys
+import threading
+from typing import Dict, List, Optional
+
+import vlc
+
+# 播放器归还时需要解除的事件，避免回调指向已关闭的窗口
+POOLED_EVENTS = (
+    vlc.EventType.MediaPlayerPlaying,
+    vlc.EventType.MediaPlayerTimeChanged,
+    vlc.EventType.MediaPlayerLengthChanged,
+    vlc.EventType.MediaPlayerVout,
+    vlc.EventType.MediaPlayerEndReached,
+    vlc.EventType.MediaPlayerEncounteredError,
+)
+
+
+class PlayerPool:
+    """进程共享的libvlc实例和预先创建的播放器池
+
+    vlc.Instance()需要加载并扫描插件缓存，每个播放窗口各建一个会让打开窗口慢上几百毫秒，
+    关闭后也不会释放。这里整个进程只创建一个实例；播放器用完后停止、解绑窗口并放回池中，
+    池中最多保留size个，多出的直接release()。
+
+    python-vlc每次调用player.event_manager()都返回新的包装对象，event_detach只能解除通过同一个对象
+    绑定的回调，而且该对象被回收后libvlc仍会调用它的回调函数。所以绑定事件一律通过event_manager(player)
+    取得池中保存的对象，归还时也通过它解除。
+    """
+
+    def __init__(self, size: int = 2, instance_args: tuple = ()):
+        self.logger = logging.getLogger(__name__)
+        self.size = size
+        self.instance = vlc.Instance(*instance_args)
+        self._idle: List[vlc.MediaPlayer] = []
+        self._event_managers: Dict[vlc.MediaPlayer, vlc.EventManager] = {}
+        self._lock = threading.Lock()
+        self.stats = {'created': 0, 'reused': 0, 'returned': 0, 'released': 0}
+
+    def _new_player(self) -> vlc.MediaPlayer:
+        player = self.instance.media_player_new()
+        with self._lock:
+            self.stats['created'] += 1
+        return player
+
+    def event_manager(self, player: vlc.MediaPlayer) -> vlc.EventManager:
+        """播放器的事件管理器，每个播放器只创建一个，直到播放器被释放"""
+        with self._lock:
+            event_manager = self._event_managers.get(player)
+            if event_manager is None:
+                event_manager = self._event_managers[player] = player.event_manager()
+            return event_manager
+
+    def warm(self, count: Optional[int] = None):
+        """预先创建播放器，直到池中有count个（默认size个）空闲播放器"""
+        count = self.size if count is None else min(count, self.size)
+        while True:
+            with self._lock:
+                if len(self._idle) >= count:
+                    return
+            player = self._new_player()
+            with self._lock:
+                self._idle.append(player)
+
+    def warm_async(self, count: Optional[int] = None) -> threading.Thread:
+        """后台线程预先创建播放器"""
+        thread = threading.Thread(target=self.warm, args=(count,), daemon=True)
+        thread.start()
+        return thread
+
+    def acquire(self) -> vlc.MediaPlayer:
+        """取出一个播放器，池为空时新建"""
+        with self._lock:
+            if self._idle:
+                self.stats['reused'] += 1
+                return self._idle.pop()
+        return self._new_player()
+
+    def release(self, player: Optional[vlc.MediaPlayer]):
+        """归还播放器：停止播放、解除事件和窗口绑定，池满时直接释放"""
+        if player is None:
+            return
+        try:
+            # 必须通过绑定时的同一个对象解除，否则旧窗口的回调仍留在播放器上
+            event_manager = self.event_manager(player)
+            for event_type in POOLED_EVENTS:
+                event_manager.event_detach(event_type)
+            player.stop()
+            player.set_media(None)
+            player.audio_set_mute(False)
+            # 窗口即将销毁，解除视频输出绑定
+            if sys.platform.startswith('win'):
+                player.set_hwnd(0)
+            elif sys.platform.startswith('linux'):
+                player.set_xwindow(0)
+            elif sys.platform.startswith('darwin'):
+                player.set_nsobject(0)
+        except Exception as e:
+            self.logger.error(f"重置播放器失败，直接释放: {str(e)}")
+            self._release_player(player)
+            return
+
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(player)
+                self.stats['returned'] += 1
+                return
+        self._release_player(player)
+
+    def _release_player(self, player: vlc.MediaPlayer):
+        try:
+            player.release()
+        except Exception as e:
+            self.logger.error(f"释放播放器失败: {str(e)}")
+        with self._lock:
+            # 播放器已释放，不会再有回调，包装对象可以回收
+            self._event_managers.pop(player, None)
+            self.stats['released'] += 1
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return dict(self.stats, idle=len(self._idle))
+
+    def close(self):
+        """释放池中所有播放器和libvlc实例（程序退出时调用）"""
+        with self._lock:
+            players, self._idle = self._idle, []
+        for player in players:
+            self._release_player(player)
+        self.instance.release()
+
+
+_shared_pool: Optional[PlayerPool] = None
+_shared_lock = threading.Lock()
+
+
+def get_player_pool(instance_args: tuple = ()) -> PlayerPool:
+    """获取进程共享的播放器池，instance_args只在首次创建时生效"""
+    global _shared_pool
+    with _shared_lock:
+        if _shared_pool is None:
+            _shared_pool = PlayerPool(instance_args=instance_args)
+        return _shared_pool
+
+
+def shutdown_player_pool():
+    """程序退出时释放共享的播放器池"""
+    global _shared_pool
+    with _shared_lock:
+        pool, _shared_pool = _shared_pool, None
+    if pool is not None:
+        pool.close()